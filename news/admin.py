@@ -1,12 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django import forms
-from .models import Author, Category, PostCategory, Post, Comment, Subscription
+from .models import (
+    Author, Category, PostCategory, Post, Comment, Subscription, Delivery, DigestRun, ModerationScan, ModerationFlag,
+)
+from . import page_cache, publishing, quota, ratings, search
+from .forms import PostQuotaMixin
 
 
 class PostCategoryInline(admin.TabularInline):
     model = PostCategory
     extra = 1
+    autocomplete_fields = ('category',)
     verbose_name = "Категория"
     verbose_name_plural = "Категории"
 
@@ -18,7 +25,7 @@ class SubscriptionInline(admin.TabularInline):
     verbose_name_plural = "Подписки"
 
 
-class PostForm(forms.ModelForm):
+class PostForm(PostQuotaMixin, forms.ModelForm):
     class Meta:
         model = Post
         fields = '__all__'
@@ -31,6 +38,8 @@ class PostForm(forms.ModelForm):
         if title and content and title == content:
             raise ValidationError('Заголовок не должен совпадать с содержанием')
 
+        if cleaned_data.get('author'):
+            self.check_quota(cleaned_data['author'])
         return cleaned_data
 
 
@@ -73,6 +82,8 @@ class CategoryAdmin(admin.ModelAdmin):
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     form = PostForm
+    # авторы и категории подгружаются поиском, а не списком всех строк
+    autocomplete_fields = ('author',)
     list_display = (
         'title',
         'author',
@@ -84,6 +95,7 @@ class PostAdmin(admin.ModelAdmin):
         'preview_short'
     )
     list_filter = ('post_type', 'created_at', 'author')
+    # по заголовку и тексту ищет полнотекстовый индекс, см. get_search_results
     search_fields = ('title', 'content', 'author__user__username')
     readonly_fields = ('created_at', 'rating')
     date_hierarchy = 'created_at'
@@ -100,6 +112,41 @@ class PostAdmin(admin.ModelAdmin):
         # Убрали поле categories из fieldsets, т.к. оно управляется через inline
     )
 
+    def save_related(self, request, form, formsets, change):
+        if change:
+            return super().save_related(request, form, formsets, change)
+        # новый пост: категории из инлайна пишутся одной вставкой, а
+        # уведомления ставятся после коммита, как и при публикации с сайта
+        form.save_m2m()
+        for formset in formsets:
+            if formset.model is PostCategory:
+                links = formset.save(commit=False)
+                publishing.link_categories(form.instance, [link.category_id for link in links])
+            else:
+                self.save_formset(request, form, formset, change=change)
+
+    def save_model(self, request, obj, form, change):
+        # лимит проверяется в транзакции changeform_view, как в publishing.publish
+        if not change:
+            quota.check(obj.author)
+        super().save_model(request, obj, form, change)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except quota.QuotaExceeded as e:
+            # форма прошла предварительную проверку, но последний слот
+            # успел занять параллельный запрос; транзакция уже откачена
+            self.message_user(request, e.message, messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        found = search.search_posts(queryset, search_term, ranked=False)
+        by_author = queryset.filter(author__user__username__icontains=search_term)
+        return found | by_author, False
+
     def categories_list(self, obj):
         return ", ".join([category.name for category in obj.categories.all()])
 
@@ -118,19 +165,32 @@ class PostAdmin(admin.ModelAdmin):
     actions = ['reset_rating', 'mark_as_news', 'mark_as_article']
 
     def reset_rating(self, request, queryset):
-        updated = queryset.update(rating=0)
+        deltas = {pk: -rating for pk, rating in queryset.values_list('pk', 'rating')}
+        updated = ratings.apply_deltas(queryset.model, deltas)
         self.message_user(request, f'Рейтинг сброшен для {updated} постов')
 
     reset_rating.short_description = 'Сбросить рейтинг'
 
+    def change_post_type(self, queryset, post_type):
+        # update() не шлёт post_save: страницы лент сбрасываются здесь
+        post_ids = list(queryset.values_list('pk', flat=True))
+        category_ids = PostCategory.objects.filter(post_id__in=post_ids).values_list('category_id', flat=True).distinct()
+        updated = queryset.update(post_type=post_type, updated_at=timezone.now())
+        page_cache.bump(
+            page_cache.LIST,
+            *map(page_cache.post_scope, post_ids),
+            *map(page_cache.category_scope, category_ids),
+        )
+        return updated
+
     def mark_as_news(self, request, queryset):
-        updated = queryset.update(post_type='NW')
+        updated = self.change_post_type(queryset, Post.NEWS)
         self.message_user(request, f'{updated} постов помечены как новости')
 
     mark_as_news.short_description = 'Пометить как новости'
 
     def mark_as_article(self, request, queryset):
-        updated = queryset.update(post_type='AR')
+        updated = self.change_post_type(queryset, Post.ARTICLE)
         self.message_user(request, f'{updated} постов помечены как статьи')
 
     mark_as_article.short_description = 'Пометить как статьи'
@@ -152,7 +212,8 @@ class CommentAdmin(admin.ModelAdmin):
     actions = ['reset_rating']
 
     def reset_rating(self, request, queryset):
-        updated = queryset.update(rating=0)
+        deltas = {pk: -rating for pk, rating in queryset.values_list('pk', 'rating')}
+        updated = ratings.apply_deltas(queryset.model, deltas)
         self.message_user(request, f'Рейтинг сброшен для {updated} комментариев')
 
     reset_rating.short_description = 'Сбросить рейтинг'
@@ -167,12 +228,52 @@ class PostCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
-    list_display = ('user', 'category', 'subscribed_at')
-    list_filter = ('subscribed_at', 'category')
+    list_display = ('user', 'category', 'delivery_mode', 'subscribed_at')
+    list_filter = ('subscribed_at', 'category', 'delivery_mode')
     search_fields = ('user__username', 'category__name')
     readonly_fields = ('subscribed_at',)
 
 
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    list_display = ('post', 'user', 'kind', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('user__username', 'user__email', 'post__title')
+    readonly_fields = ('created_at', 'sent_at', 'claim', 'last_error')
+    list_select_related = ('post', 'user')
+
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=Delivery.SENT).update(
+            status=Delivery.PENDING, attempts=0, next_attempt_at=timezone.now(), claim='',
+        )
+        self.message_user(request, f'Повторная отправка запланирована для {updated} писем')
+
+    retry_now.short_description = 'Отправить повторно'
+
+
+@admin.register(DigestRun)
+class DigestRunAdmin(admin.ModelAdmin):
+    list_display = ('period', 'started_at', 'finished_at', 'sent', 'failed', 'last_user_id')
+    readonly_fields = ('period', 'since', 'started_at', 'finished_at', 'sent', 'failed', 'last_user_id')
+
+
+@admin.register(ModerationScan)
+class ModerationScanAdmin(admin.ModelAdmin):
+    list_display = ('dictionary', 'words', 'started_at', 'finished_at', 'scanned', 'flagged')
+    readonly_fields = (
+        'dictionary', 'words', 'started_at', 'finished_at', 'last_post_id', 'last_comment_id', 'scanned', 'flagged',
+    )
+
+
+@admin.register(ModerationFlag)
+class ModerationFlagAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'object_id', 'matches', 'scan')
+    list_filter = ('kind', 'scan')
+    ordering = ('-matches',)
+
+
 # Кастомизация заголовков админ-панели
 admin.site.site_header = "News Portal Administration"
 admin.site.site_title = "News Portal Admin"
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class NewsConfig(AppConfig):
@@ -6,3 +7,5 @@ class NewsConfig(AppConfig):
     name = 'news'
     def ready(self):
         import news.signals
+        from news import search
+        post_migrate.connect(search.repair_triggers, sender=self)
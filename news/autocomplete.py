@@ -0,0 +1,95 @@
+"""
+Автодополнение авторов и категорий для форм постов и фильтров лент.
+
+Раньше каждый выпадающий список выводил все строки таблицы, и на каждой
+странице ленты и поиска читались и рендерились все авторы и категории.
+Теперь виджет AutocompleteSelect выводит только выбранные значения, а
+остальные подгружает небольшими JSON-страницами по началу имени.
+
+Поиск идёт диапазоном по индексу search_name (имя в нижнем регистре, см.
+SearchNameMixin): search_name >= q и < q + U+10FFFF. Ответы кешируются
+через page_cache по поколениям AUTHORS и CATEGORIES, которые сигналы
+увеличивают при изменении авторов и категорий.
+"""
+from django import forms
+from django.conf import settings
+from django.urls import reverse
+
+from .models import Author, Category
+
+# больше любого символа: верхняя граница диапазона для префикса
+_MAX_CHAR = '\U0010ffff'
+
+
+def page_size():
+    return getattr(settings, 'AUTOCOMPLETE_PAGE_SIZE', 20)
+
+
+def prefix_search(queryset, term):
+    term = term.strip().lower()
+    if term:
+        queryset = queryset.filter(search_name__gte=term, search_name__lt=term + _MAX_CHAR)
+    return queryset.order_by('search_name', 'pk')
+
+
+def results_page(queryset, term, page):
+    """
+    Страница в формате Select2: {"results": [{"id", "text"}], "more"}
+    """
+    size = page_size()
+    start = (max(page, 1) - 1) * size
+    rows = list(prefix_search(queryset, term).values_list('pk', 'name')[start:start + size + 1])
+    return {
+        'results': [{'id': pk, 'text': name} for pk, name in rows[:size]],
+        'more': len(rows) > size,
+    }
+
+
+def authors(term, page=1, publishers_only=False):
+    queryset = Author.objects.all()
+    if publishers_only:
+        # как в PostForm: публиковать можно только от имени не-сотрудников
+        queryset = queryset.filter(user__is_staff=False)
+    return results_page(queryset, term, page)
+
+
+def categories(term, page=1):
+    return results_page(Category.objects.all(), term, page)
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    Выпадающий список, который рендерит только выбранные значения;
+    остальные подгружает static/js/autocomplete.js из url
+    """
+    class Media:
+        js = ['js/autocomplete.js']
+
+    def __init__(self, url_name, query='', attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+        self.query = query
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        url = reverse(self.url_name)
+        attrs['data-autocomplete-url'] = f'{url}?{self.query}' if self.query else url
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [item for item in value if str(item).isdigit()]
+        options = []
+        field = getattr(self.choices, 'field', None)
+        if not self.allow_multiple_selected and (field is None or field.empty_label is not None):
+            options.append(self.create_option(name, '', getattr(field, 'empty_label', None) or '', not selected, 0))
+        if selected:
+            # полный queryset не читается: только выбранные строки, с теми же
+            # подписями, что и в ответах автодополнения
+            rows = self.choices.queryset.filter(pk__in=selected).values_list('pk', 'name')
+            for pk, label in rows:
+                options.append(self.create_option(name, pk, label, True, len(options)))
+        return [(None, options, 0)] if options else []
+
+
+class AutocompleteSelectMultiple(AutocompleteSelect, forms.SelectMultiple):
+    pass
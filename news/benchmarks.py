@@ -0,0 +1,483 @@
+"""
+Нагрузочные замеры. Запуск: python manage.py benchmark <имя>
+
+Каждый замер работает на временной файловой SQLite-базе с применёнными
+миграциями и не трогает рабочую news.sqlite3.
+"""
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.db import connection, connections, OperationalError
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import censor, mailing, ratings, search, tasks
+from .models import Author, Category, Post, PostCategory, Subscription
+
+BENCHMARKS = {}
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+@contextmanager
+def temporary_database():
+    """
+    Создаёт временную базу с миграциями и удаляет её после замера
+    """
+    old_name = connection.settings_dict['NAME']
+    with tempfile.TemporaryDirectory() as tmp:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run_threads(workers, target):
+    """
+    Запускает target(номер_потока) в workers потоках, возвращает время в секундах
+    """
+    def run(index):
+        try:
+            target(index)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def create_author(username='benchmark'):
+    user = User.objects.create(username=username)
+    return Author.objects.create(user=user, name=username)
+
+
+WORDS = (
+    'новость спорт матч команда игрок тренер политика выборы министр закон '
+    'экономика рынок курс валюта банк погода дождь снег город мэр школа '
+    'наука открытие космос ракета театр премьера фильм музыка концерт выставка'
+).split()
+
+# Частые слова из WORDS и длинный хвост редких, частоты по закону Ципфа
+VOCABULARY = WORDS + [f'термин{index}' for index in range(20_000)]
+CUM_WEIGHTS = list(accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def create_posts(author, count, words=40, batch_size=2000):
+    """
+    Массово создаёт посты со случайным текстом из словаря VOCABULARY
+    """
+    rng = random.Random(count)
+
+    def text(k):
+        return ' '.join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=k)).capitalize()
+
+    for start in range(0, count, batch_size):
+        Post.objects.bulk_create([
+            Post(
+                author=author,
+                post_type=rng.choice((Post.NEWS, Post.ARTICLE)),
+                title=text(5),
+                content=text(words),
+            )
+            for _ in range(min(batch_size, count - start))
+        ])
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+@benchmark('votes')
+def votes_benchmark(out, writers=None, count=None):
+    """
+    Голоса за один пост из нескольких потоков: чтение-изменение-save против
+    атомарного UPDATE и буфера в кеше
+    """
+    writers = writers or 8
+    count = count or 200
+    expected = writers * count
+
+    def legacy_vote(post):
+        post.refresh_from_db()
+        post.rating += 1
+        post.save()
+
+    modes = [
+        ('save()', 0, legacy_vote),
+        ('atomic', 0, Post.like),
+        ('buffered', 1, Post.like),
+    ]
+    with temporary_database(), override_settings(CACHES=LOCMEM_CACHES):
+        author = create_author()
+        for label, threshold, action in modes:
+            post = Post.objects.create(author=author, title=label, content=label * 100)
+            errors = []
+
+            def writer(index):
+                own = Post.objects.get(pk=post.pk)
+                for _ in range(count):
+                    try:
+                        action(own)
+                    except OperationalError as e:
+                        errors.append(e)
+
+            with override_settings(RATING_HOT_THRESHOLD=threshold):
+                elapsed = run_threads(writers, writer)
+                ratings.flush(Post)
+
+            post.refresh_from_db()
+            out(
+                f'{label:>10}: {expected / elapsed:9.0f} голосов/с, '
+                f'рейтинг {post.rating} из {expected}, '
+                f'потеряно {expected - len(errors) - post.rating}, ошибок блокировки {len(errors)}'
+            )
+
+
+@benchmark('search')
+def search_benchmark(out, writers=None, count=None):
+    """
+    Поиск по заголовку и тексту: icontains против индекса FTS5
+    """
+    count = count or 100_000
+    queries = ['выборы', 'курс валют', 'космос ракета', 'театр']
+
+    # сигналы сохранения постов сбрасывают кеш страниц: без Redis — в памяти
+    with temporary_database(), override_settings(CACHES=LOCMEM_CACHES):
+        started = time.perf_counter()
+        create_posts(create_author(), count)
+        out(f'Создано {count} постов за {time.perf_counter() - started:.1f} с')
+
+        def page(queryset):
+            # как в PostSearchView: COUNT(*) и первая страница
+            queryset.count()
+            list(queryset[:10])
+
+        engines = [
+            ('icontains по заголовку', lambda query: Post.objects.filter(title__icontains=query).order_by('-created_at')),
+            ('icontains по тексту', lambda query: Post.objects.filter(
+                Q(title__icontains=query) | Q(content__icontains=query)).order_by('-created_at')),
+            ('FTS5 с ранжированием', lambda query: search.search_posts(Post.objects.all(), query)),
+        ]
+        for label, build in engines:
+            total = sum(timed(lambda: page(build(query)), repeat=3) for query in queries)
+            out(f'{label:>24}: {total / len(queries):8.1f} мс на запрос')
+
+
+@benchmark('cache')
+def cache_benchmark(out, writers=None, count=None):
+    """
+    Чтение страниц из файлового кеша против двухуровневого и число
+    пересчётов одной страницы, когда её срок истёк под нагрузкой
+    """
+    writers = writers or 8
+    count = count or 2000
+    page = 'x' * 30_000
+    keys = [f'page:{index}' for index in range(50)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp}
+        settings = {
+            'file': file_cache,
+            # замеряется только чтение страниц: счётчики здесь не нужны
+            'twotier': {
+                'BACKEND': 'news.cache_backends.TwoTierCache', 'LOCATION': 'benchmark',
+                'OPTIONS': {'SHARED': 'file', 'REQUIRE_ATOMIC': False},
+            },
+        }
+        with override_settings(CACHES={'default': file_cache, **settings}):
+            for alias in ('file', 'twotier'):
+                backend = caches[alias]
+                backend.set_many({key: page for key in keys}, 60)
+
+                def reader(index):
+                    rng = random.Random(index)
+                    for _ in range(count):
+                        caches[alias].get(rng.choice(keys))
+
+                elapsed = run_threads(writers, reader)
+                out(f'{alias:>8}: {writers * count / elapsed:9.0f} чтений/с')
+                if alias == 'twotier':
+                    out(f'{"":>8}  ' + ', '.join(f'{metric}={value}' for metric, value in backend.stats().items()))
+
+                backend.set('expiring', page, 1)
+                time.sleep(1.1)
+                renders = []
+
+                def visitor(index):
+                    if caches[alias].get('expiring') is None:
+                        renders.append(index)
+                        time.sleep(0.05)
+                        caches[alias].set('expiring', page, 60)
+
+                run_threads(writers * 4, visitor)
+                out(f'{"":>8}  {writers * 4} одновременных запросов к истёкшей странице: пересчётов {len(renders)}')
+
+
+@benchmark('digest')
+def digest_benchmark(out, writers=None, count=None):
+    """
+    Еженедельная рассылка для подписчиков: цикл по категориям с письмом на
+    каждую категорию против одного письма на подписчика из двух запросов
+    """
+    count = count or 10_000
+    week_ago = timezone.now() - timedelta(days=7)
+
+    def legacy_digest():
+        # прежний send_weekly_digest без логирования
+        for category in Category.objects.all():
+            new_posts = Post.objects.filter(categories=category, created_at__gte=week_ago).order_by('-created_at')
+            if not new_posts:
+                continue
+            for user in category.subscribers.all():
+                if user.email:
+                    # тот же шаблон с одним разделом — прежнее письмо на категорию
+                    html_content = render_to_string('account/email/weekly_digest.html', {
+                        'user': user, 'sections': [(category, new_posts)], 'total': new_posts.count(), 'week_ago': week_ago,
+                    })
+                    msg = EmailMultiAlternatives(
+                        subject=f'{new_posts.count()} новых статей в разделе "{category.name}"',
+                        body=f'За неделю появилось {new_posts.count()} новых статей.',
+                        to=[user.email],
+                    )
+                    msg.attach_alternative(html_content, 'text/html')
+                    msg.send()
+
+    with temporary_database(), override_settings(
+        CACHES=LOCMEM_CACHES, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', MAIL_RATE_LIMITS={},
+    ):
+        rng = random.Random(0)
+        author = create_author()
+        categories = Category.objects.bulk_create([Category(name=f'Раздел {index}') for index in range(10)])
+        create_posts(author, 60)
+        PostCategory.objects.bulk_create([
+            PostCategory(post_id=pk, category=category)
+            for pk in Post.objects.values_list('pk', flat=True)
+            for category in rng.sample(categories, rng.randint(1, 2))
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'reader{index}', email=f'reader{index}@example.com') for index in range(count)
+        ], batch_size=2000)
+        Subscription.objects.bulk_create([
+            Subscription(user=user, category=category)
+            for user in users for category in rng.sample(categories, rng.randint(1, 3))
+        ], batch_size=2000)
+        out(f'Подписчиков: {count}, подписок: {Subscription.objects.count()}, постов за неделю: 60')
+
+        for label, run in [('по категориям', legacy_digest), ('по подписчикам', tasks.send_weekly_digest)]:
+            mail.outbox = []
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - started
+            # по подписчикам каждая пачка ещё отмечается в DigestRun
+            reads = sum(query['sql'].startswith('SELECT') for query in queries)
+            out(f'{label:>16}: {elapsed:7.1f} с, чтений {reads}, запросов {len(queries)}, писем {len(mail.outbox)}')
+
+
+@benchmark('email-render')
+def email_render_benchmark(out, writers=None, count=None):
+    """
+    Сборка уведомлений о посте: рендеринг шаблона на каждого получателя
+    против рендеринга один раз и подстановки имени
+    """
+    count = count or 5000
+    post = Post(pk=1, title='Заголовок новости', content=' '.join(random.Random(0).choices(WORDS, k=200)))
+    categories = [Category(pk=1, name='Спорт')]
+    users = [User(pk=index, username=f'reader{index}', email=f'reader{index}@example.com') for index in range(count)]
+
+    def per_recipient():
+        for user in users:
+            html = render_to_string('account/email/new_post_notification.html', {
+                'post': post, 'user': user, 'categories': categories,
+            })
+            msg = EmailMultiAlternatives(subject='Новая запись', body=mailing.html_to_text(html), to=[user.email])
+            msg.attach_alternative(html, 'text/html')
+
+    def render_once():
+        email = mailing.RenderedEmail('account/email/new_post_notification.html', {
+            'post': post, 'categories': categories,
+        }, subject='Новая запись')
+        for user in users:
+            email.message(user)
+
+    for label, build in [('на получателя', per_recipient), ('один раз', render_once)]:
+        elapsed = timed(build, repeat=1)
+        out(f'{label:>14}: {elapsed / count * 1000:8.1f} мкс на письмо')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Локальный SMTP-сервер, который принимает и выбрасывает письма.
+    handshake_delay — задержка перед приветствием вместо TLS-рукопожатия
+    и авторизации у внешнего провайдера
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake_delay):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.handshake_delay = handshake_delay
+        self.received = 0
+        self.connections = 0
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        time.sleep(self.server.handshake_delay)
+        self.reply(b'220 sink ESMTP')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b'.\r\n':
+                    in_data = False
+                    self.server.received += 1
+                    self.reply(b'250 OK')
+                continue
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply(b'250-sink\r\n250 8BITMIME')
+            elif command == b'DATA':
+                in_data = True
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            else:
+                self.reply(b'250 OK')
+
+
+@benchmark('smtp-pool')
+def smtp_pool_benchmark(out, writers=None, count=None):
+    """
+    Задачи уведомлений по 5 писем через локальный SMTP-приёмник с задержкой
+    рукопожатия 30 мс: соединение на письмо (msg.send()), соединение на
+    задачу и пул соединений воркера
+    """
+    count = count or 50
+    per_task = 5
+    sink = SMTPSink(handshake_delay=0.03)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    tasks_messages = [
+        [mail.EmailMessage('Новая запись', 'Текст уведомления', to=[f'reader{task}-{index}@example.com'])
+         for index in range(per_task)]
+        for task in range(count)
+    ]
+
+    def per_message():
+        for messages in tasks_messages:
+            for message in messages:
+                message.send()
+
+    def per_task_or_pooled():
+        for messages in tasks_messages:
+            for _, error in mailing.send_each(enumerate(messages)):
+                assert error is None, error
+
+    smtp_settings = {
+        'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+        'EMAIL_HOST': '127.0.0.1',
+        'EMAIL_PORT': sink.server_address[1],
+        'EMAIL_USE_SSL': False,
+        'EMAIL_USE_TLS': False,
+        'EMAIL_HOST_USER': '',
+        'EMAIL_HOST_PASSWORD': '',
+        'MAIL_RATE_LIMITS': {},
+    }
+    modes = [
+        ('на письмо', per_message, {}),
+        # пул нулевого размера закрывает соединение в конце каждой задачи
+        ('на задачу', per_task_or_pooled, {'SMTP_POOL_SIZE': 0}),
+        ('пул воркера', per_task_or_pooled, {'SMTP_POOL_SIZE': 4}),
+    ]
+    try:
+        for label, run, pool_settings in modes:
+            sink.received = sink.connections = 0
+            with override_settings(**smtp_settings, **pool_settings):
+                mailing.pool.close_all()
+                elapsed = timed(run, repeat=1) / 1000
+                mailing.pool.close_all()
+            out(f'{label:>12}: {sink.received / elapsed:7.1f} писем/с, соединений {sink.connections}, {elapsed:5.2f} с')
+    finally:
+        sink.shutdown()
+        sink.server_close()
+
+
+@benchmark('censor')
+def censor_benchmark(out, writers=None, count=None):
+    """
+    Фильтр censor на длинных постах со словарём из 3000 слов: перебор
+    словаря для каждого слова против одного скомпилированного выражения и
+    повторного вывода из кеша
+    """
+    count = count or 20
+    rng = random.Random(0)
+    letters = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+    dictionary = list({''.join(rng.choices(letters, k=rng.randint(5, 9))) for _ in range(3000)})
+    posts = [
+        ' '.join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=5000) + rng.sample(dictionary, 20))
+        for _ in range(count)
+    ]
+
+    def legacy_censor(value):
+        censored_words = []
+        for word in value.split():
+            word_lower = word.lower()
+            is_bad = any(bad_word in word_lower for bad_word in dictionary)
+            censored_words.append(word[0] + '*' * (len(word) - 1) if is_bad and len(word) > 1 else word)
+        return ' '.join(censored_words)
+
+    started = time.perf_counter()
+    engine = censor.Censor(dictionary, cache_size=count)
+    out(f'Компиляция словаря: {(time.perf_counter() - started) * 1000:.1f} мс, постов {count} по 5000 слов')
+
+    expected = [legacy_censor(post) for post in posts[:2]]
+    assert [engine.censor(post) for post in posts[:2]] == expected
+    engine.cache.clear()
+
+    for label, run in [
+        ('перебор словаря', lambda: [legacy_censor(post) for post in posts]),
+        ('одно выражение', lambda: [engine.censor(post) for post in posts]),
+        ('из кеша', lambda: [engine.censor(post) for post in posts]),
+    ]:
+        elapsed = timed(run, repeat=1)
+        out(f'{label:>16}: {elapsed / count:9.2f} мс на пост')
@@ -0,0 +1,261 @@
+"""
+Двухуровневый кеш: LRU в памяти процесса поверх общего бэкенда.
+
+Значения, записанные через set() со сроком жизни, дублируются в
+ограниченный LRU процесса на LOCAL_TIMEOUT секунд: повторное чтение не
+ходит в общий кеш (файлы, Redis). Как и в LocMemCache, значения хранятся в
+pickle, чтобы изменение полученного объекта не портило кеш.
+Счётчики (целые числа и всё, что пишется через add/incr/decr) всегда
+читаются из общего кеша и не копируются в процесс. add, incr и decr
+передаются общему кешу как есть, поэтому атомарны они ровно настолько,
+насколько атомарен он сам. В FileBasedCache и DatabaseCache это чтение и
+перезапись значения: параллельные процессы теряют приращения и оба
+получают одну «блокировку». На таком общем кеше TwoTierCache не
+создаётся, если в OPTIONS не указано REQUIRE_ATOMIC: False (например,
+для замеров чтения страниц). Подходят Redis, Memcached и LocMem (только
+внутри одного процесса: тесты и разработка).
+
+Защита от «давки» при истечении ключа: в общем кеше значение живёт на
+STALE_GRACE секунд дольше своего срока. Первый, кто прочитал
+просроченное значение, берёт блокировку и получает промах — он и
+пересчитывает значение, а остальные до обновления получают старое.
+
+Настройка:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'news.cache_backends.TwoTierCache',
+            'LOCATION': 'default',
+            'OPTIONS': {'SHARED': 'shared', 'LOCAL_MAX_ENTRIES': 1000},
+        },
+        'shared': {...},
+    }
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+
+Entry = namedtuple('Entry', 'value soft_expire local_expire')
+
+METRICS = ('local_hits', 'local_misses', 'shared_hits', 'shared_misses', 'stale_hits', 'rebuilds')
+
+# Общие для всех потоков процесса: бэкенды Django создаются на каждый поток
+_local_tiers = {}
+_metrics = {}
+_lock = threading.Lock()
+
+# бэкенды, у которых add, incr и decr атомарны
+ATOMIC_BACKENDS = (RedisCache, BaseMemcachedCache, LocMemCache)
+
+
+def has_atomic_counters(backend):
+    """
+    Можно ли строить на кеше счётчики, блокировки и лимиты
+    """
+    if isinstance(backend, TwoTierCache):
+        backend = backend.shared
+    return isinstance(backend, ATOMIC_BACKENDS)
+
+
+class LocalTier:
+    """
+    Ограниченный LRU в памяти процесса
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry.local_expire or now >= entry.soft_expire:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, soft_expire, local_expire):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = Entry(value, soft_expire, local_expire)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Бэкенд кеша: LRU процесса поверх общего бэкенда OPTIONS['SHARED']
+    """
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.name = name or 'default'
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 2)
+        self.stale_grace = options.get('STALE_GRACE', 30)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        self.stats_interval = options.get('STATS_INTERVAL', 10)
+        with _lock:
+            self.local = _local_tiers.setdefault(self.name, LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000)))
+            self.metrics = _metrics.setdefault(self.name, {'counts': dict.fromkeys(METRICS, 0), 'pushed_at': time.time()})
+        if options.get('REQUIRE_ATOMIC', True) and not isinstance(self.shared, ATOMIC_BACKENDS):
+            raise ImproperlyConfigured(
+                f'Общий кеш {self.shared_alias!r} ({type(self.shared).__name__}) не поддерживает атомарные '
+                f'add/incr: нужен Redis или Memcached'
+            )
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _meta_key(self, key):
+        return f'{key}:soft-expire'
+
+    def _lock_key(self, key):
+        return f'{key}:rebuild'
+
+    def _count(self, metric):
+        counts = self.metrics['counts']
+        with _lock:
+            counts[metric] += 1
+            due = time.time() - self.metrics['pushed_at'] >= self.stats_interval
+        if due:
+            self.push_stats()
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        full_key = self.shared.make_key(key, version)
+        now = time.time()
+        entry = self.local.get(full_key, now)
+        if entry is not None:
+            self._count('local_hits')
+            return pickle.loads(entry.value)
+        self._count('local_misses')
+
+        meta_key = self._meta_key(key)
+        found = self.shared.get_many([key, meta_key], version=version)
+        if key not in found:
+            self._count('shared_misses')
+            return default
+        self._count('shared_hits')
+
+        value, soft_expire = found[key], found.get(meta_key)
+        if soft_expire is None:
+            # счётчики и бессрочные значения не кешируются в процессе
+            return value
+        if now >= soft_expire:
+            if self.shared.add(self._lock_key(key), 1, self.lock_timeout, version=version):
+                self._count('rebuilds')
+                return default
+            self._count('stale_hits')
+            return value
+        self.local.put(full_key, value, soft_expire, min(soft_expire, now + self.local_timeout))
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        for key in keys:
+            value = self.get(key, self, version=version)
+            if value is not self:
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        full_key = self.shared.make_key(key, version)
+        if timeout is None or timeout <= 0 or isinstance(value, int):
+            self.local.discard(full_key)
+            self.shared.set(key, value, timeout, version=version)
+            self.shared.delete(self._meta_key(key), version=version)
+            return
+        now = time.time()
+        soft_expire = now + timeout
+        self.shared.set_many({key: value, self._meta_key(key): soft_expire}, timeout + self.stale_grace, version=version)
+        # значение пересчитано: следующее истечение снова пересчитает первый читатель
+        # (BaseCache.set_many пишет через set, поэтому снимается и там)
+        self.shared.delete(self._lock_key(key), version=version)
+        self.local.put(full_key, value, soft_expire, min(soft_expire, now + self.local_timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.discard(self.shared.make_key(key, version))
+        return self.shared.add(key, value, self._timeout(timeout), version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.discard(self.shared.make_key(key, version))
+        return self.shared.touch(key, self._timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.local.discard(self.shared.make_key(key, version))
+        self.shared.delete(self._meta_key(key), version=version)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.local.discard(*[self.shared.make_key(key, version) for key in keys])
+        self.shared.delete_many(keys + [self._meta_key(key) for key in keys], version=version)
+
+    def has_key(self, key, version=None):
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.discard(self.shared.make_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        """
+        Счётчики попаданий и промахов по уровням в этом процессе
+        """
+        with _lock:
+            return dict(self.metrics['counts'])
+
+    def push_stats(self):
+        """
+        Переносит счётчики процесса в общий кеш, где их суммируют все воркеры
+        """
+        with _lock:
+            counts = self.metrics['counts']
+            pending = {metric: count for metric, count in counts.items() if count}
+            self.metrics['counts'] = dict.fromkeys(METRICS, 0)
+            self.metrics['pushed_at'] = time.time()
+        for metric, count in pending.items():
+            key = f'twotier-stats:{self.name}:{metric}'
+            self.shared.add(key, 0, None)
+            self.shared.incr(key, count)
+
+    def shared_stats(self):
+        """
+        Счётчики всех процессов, накопленные в общем кеше
+        """
+        keys = {f'twotier-stats:{self.name}:{metric}': metric for metric in METRICS}
+        found = self.shared.get_many(list(keys))
+        return {metric: found.get(key, 0) for key, metric in keys.items()}
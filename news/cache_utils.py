@@ -0,0 +1,19 @@
+"""
+Счётчики в кеше, общие для буфера рейтингов, лимитов отправки писем и
+других модулей. Атомарны настолько, насколько атомарны add и incr
+бэкенда (см. cache_backends.has_atomic_counters).
+"""
+
+
+def incr(cache, key, delta=1, timeout=None):
+    """
+    Прибавляет delta к счётчику, создавая его при необходимости, и
+    возвращает новое значение
+    """
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # ключ успел истечь между add и incr
+        cache.set(key, delta, timeout=timeout)
+        return delta
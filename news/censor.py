@@ -0,0 +1,177 @@
+"""
+Цензура слов для фильтра censor.
+
+Словарь компилируется один раз в одно регулярное выражение: запрещённые
+слова собираются в префиксное дерево, и выражение ветвится по очередной
+букве, а не перебирает весь словарь. Текст в нижнем регистре проходится
+один раз: слово, внутри которого встретилось запрещённое, заменяется
+первой буквой и звёздочками, пробелы и переводы строк остаются как были.
+
+Результаты запоминаются в ограниченном LRU по хешу текста: одни и те же
+заголовки и анонсы выводятся в каждой ленте. Словарь читается из файла
+CENSOR_WORDS_FILE (одно слово в строке, # — комментарий) и
+перечитывается без перезапуска, когда файл меняется: время изменения
+проверяется не чаще раза в CENSOR_RELOAD_INTERVAL секунд.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+BAD_WORDS = [
+    'падла', 'тварь', 'урод', 'дебил'
+]
+
+
+def _trie_pattern(words):
+    """
+    Регулярное выражение, совпадающее с любым из слов, в виде префиксного
+    дерева: (?:д(?:ебил|ура)|урод)
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        # слово словаря — префикс более длинных: для замены хватает короткого
+        if '' in node:
+            return ''
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else f'(?:{"|".join(branches)})'
+
+    return build(trie)
+
+
+def _mask(word):
+    return word[0] + '*' * (len(word) - 1) if len(word) > 1 else word
+
+
+class Censor:
+    def __init__(self, words, cache_size=2048):
+        words = sorted({word.strip().lower() for word in words if word.strip()})
+        self.words = words
+        # слово целиком: от пробела до пробела, если внутри есть запрещённое
+        self.source = rf'(?<!\S)\S*?{_trie_pattern(words)}\S*' if words else None
+        self.pattern = re.compile(self.source) if words else None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _censor(self, text):
+        # re.IGNORECASE в несколько раз медленнее: ищем в тексте в нижнем
+        # регистре и заменяем слова в исходном по тем же позициям
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # редкие буквы меняют длину при lower(), позиции бы разошлись
+            return re.sub(self.source, lambda match: _mask(match.group()), text, flags=re.IGNORECASE)
+        parts, last = [], 0
+        for match in self.pattern.finditer(lowered):
+            start, end = match.span()
+            parts += [text[last:start], _mask(text[start:end])]
+            last = end
+        if not parts:
+            return text
+        parts.append(text[last:])
+        return ''.join(parts)
+
+    def censor(self, text):
+        if self.pattern is None:
+            return text
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        result = self._censor(text)
+        with self.lock:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def count(self, text):
+        """
+        Сколько слов текста будет замаскировано; без кеша — для разовой
+        проверки всего архива (news/moderation.py)
+        """
+        if self.pattern is None:
+            return 0
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            return len(re.findall(self.source, text, flags=re.IGNORECASE))
+        return len(self.pattern.findall(lowered))
+
+
+# Проверка архива в пуле процессов: каждый процесс один раз компилирует
+# словарь и получает только (id, текст), без обращений к базе
+_scan_censor = None
+
+
+def init_scan_worker(words):
+    global _scan_censor
+    _scan_censor = Censor(words, cache_size=0)
+
+
+def scan_chunk(chunk):
+    """
+    Проверяет пачку [(id, текст), ...]; возвращает последний id, размер
+    пачки и [(id, число совпадений)] для найденных
+    """
+    flagged = [(pk, matches) for pk, text in chunk if (matches := _scan_censor.count(text))]
+    return chunk[-1][0], len(chunk), flagged
+
+
+def read_words(path):
+    with open(path, encoding='utf-8') as file:
+        return [line.split('#', 1)[0] for line in file]
+
+
+_lock = threading.Lock()
+_state = {'censor': None, 'mtime': None, 'checked_at': 0.0}
+
+
+def _words_file():
+    return getattr(settings, 'CENSOR_WORDS_FILE', None)
+
+
+def reload():
+    """
+    Перечитывает словарь и сбрасывает запомненные результаты
+    """
+    path = _words_file()
+    try:
+        mtime = os.path.getmtime(path) if path else None
+        words = read_words(path) if path else BAD_WORDS
+    except OSError:
+        mtime, words = None, BAD_WORDS
+    censor = Censor(words, cache_size=getattr(settings, 'CENSOR_CACHE_SIZE', 2048))
+    with _lock:
+        _state.update(censor=censor, mtime=mtime, checked_at=time.monotonic())
+    return censor
+
+
+def get_censor():
+    """
+    Текущий скомпилированный словарь; перечитывается, если файл изменился
+    """
+    censor = _state['censor']
+    if censor is None:
+        return reload()
+    now = time.monotonic()
+    if now - _state['checked_at'] >= getattr(settings, 'CENSOR_RELOAD_INTERVAL', 5):
+        _state['checked_at'] = now
+        path = _words_file()
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        if mtime != _state['mtime']:
+            return reload()
+    return censor
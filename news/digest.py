@@ -0,0 +1,163 @@
+"""
+Еженедельная рассылка: одно письмо на подписчика по всем его категориям.
+
+Посты за неделю и их связи с категориями читаются одним запросом и
+раскладываются по категориям в памяти, подписки — вторым запросом.
+Дальше письма собираются без обращений к базе, и шаблон рендерится один
+раз на каждый набор категорий, а не на каждого подписчика.
+
+Каждая неделя — один запуск DigestRun с сохранённой границей периода и
+последним обработанным получателем. Упавший или запущенный повторно
+запуск продолжает с места остановки, а не рассылает всё заново. Отметка
+после каждого письма пишется в кеш, в базу — после каждой пачки, чтобы
+не платить за коммит на каждое письмо; письмо может уйти дважды, только
+если воркер упал между отправкой и отметкой.
+
+Одновременно неделю рассылает только один воркер: блокировка — токен и
+срок в строке DigestRun этой недели. Её берёт условный UPDATE («если
+срок пуст или истёк»), который база выполняет атомарно, поэтому из двух
+воркеров строку получает только один. Срок продлевается после каждой
+пачки и истекает через DIGEST_LOCK_TIMEOUT секунд после падения воркера.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from . import mailing
+from .models import DigestRun, PostCategory, Subscription
+
+def week_start():
+    return timezone.now() - timedelta(days=7)
+
+
+def current_period():
+    year, week, _ = timezone.localdate().isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def _lock_timeout():
+    return getattr(settings, 'DIGEST_LOCK_TIMEOUT', 600)
+
+
+def _locked_until():
+    return timezone.now() + timedelta(seconds=_lock_timeout())
+
+
+def acquire_lock(period):
+    """
+    Блокировка запуска за неделю: токен владельца или None, если рассылка
+    уже идёт
+    """
+    DigestRun.objects.get_or_create(period=period, defaults={'since': week_start()})
+    token = uuid.uuid4().hex
+    free = Q(locked_until__isnull=True) | Q(locked_until__lte=timezone.now())
+    taken = DigestRun.objects.filter(free, period=period).update(lock_token=token, locked_until=_locked_until())
+    return token if taken else None
+
+
+def refresh_lock(period, token):
+    DigestRun.objects.filter(period=period, lock_token=token).update(locked_until=_locked_until())
+
+
+def release_lock(period, token):
+    DigestRun.objects.filter(period=period, lock_token=token).update(lock_token='', locked_until=None)
+
+
+def _progress_key(run):
+    return f'weekly-digest:{run.period}:progress'
+
+
+def open_run(period):
+    """
+    Запуск рассылки за неделю: новый или прерванный, с последней отметкой
+    """
+    run, _ = DigestRun.objects.get_or_create(period=period, defaults={'since': week_start()})
+    progress = cache.get(_progress_key(run))
+    if progress and progress[0] > run.last_user_id:
+        run.last_user_id, run.sent, run.failed = progress
+    return run
+
+
+def checkpoint(run, user_id, error=None):
+    """
+    Отмечает получателя обработанным
+    """
+    run.last_user_id = user_id
+    if error is None:
+        run.sent += 1
+    else:
+        run.failed += 1
+    cache.set(_progress_key(run), (run.last_user_id, run.sent, run.failed), timeout=None)
+
+
+def save_progress(run):
+    run.save(update_fields=['last_user_id', 'sent', 'failed'])
+
+
+def finish_run(run):
+    run.finished_at = timezone.now()
+    run.save(update_fields=['last_user_id', 'sent', 'failed', 'finished_at'])
+    cache.delete(_progress_key(run))
+
+
+class Digest:
+    """
+    Посты за период, разложенные по категориям
+    """
+    def __init__(self, since):
+        self.since = since
+        self.categories = {}
+        self.posts_by_category = defaultdict(list)
+        self.emails = {}
+        links = PostCategory.objects.filter(post__created_at__gte=since).select_related(
+            'post__author', 'category',
+        ).order_by('-post__created_at', '-post_id')
+        for link in links:
+            self.categories[link.category_id] = link.category
+            self.posts_by_category[link.category_id].append(link.post)
+
+    def recipients(self, after=0):
+        """
+        Подписчики с email, у которых в категориях есть посты за период:
+        пары (пользователь, [id категорий]), по одной на пользователя, по
+        возрастанию id начиная после after
+        """
+        rows = Subscription.objects.filter(
+            category_id__in=self.categories, user_id__gt=after,
+        ).exclude(user__email='').values_list(
+            'user_id', 'user__username', 'user__email', 'category_id',
+        ).order_by('user_id', 'category_id').distinct()
+        return [
+            (User(pk=user_id, username=username, email=email), [row[3] for row in group])
+            for (user_id, username, email), group in groupby(rows, key=itemgetter(0, 1, 2))
+        ]
+
+    def sections(self, category_ids):
+        return [
+            (self.categories[pk], self.posts_by_category[pk])
+            for pk in category_ids if pk in self.categories
+        ]
+
+    def message(self, user, category_ids):
+        key = tuple(pk for pk in category_ids if pk in self.categories)
+        if not key:
+            return None
+        # одно письмо рендерится на каждый набор категорий, получателю — только подстановка
+        if key not in self.emails:
+            sections = self.sections(key)
+            total = len({post.pk for _, posts in sections for post in posts})
+            names = ', '.join(f'"{category.name}"' for category, _ in sections)
+            self.emails[key] = mailing.RenderedEmail('account/email/weekly_digest.html', {
+                'sections': sections,
+                'total': total,
+                'week_ago': self.since,
+            }, subject=f'📰 Еженедельная рассылка: {total} новых статей в {"разделах" if len(sections) > 1 else "разделе"} {names}')
+        return self.emails[key].message(user)
@@ -1,6 +1,8 @@
 from django_filters import FilterSet, ModelChoiceFilter, CharFilter, DateFilter
 from django import forms
 from .models import Post, Category, Author
+from . import search
+from .autocomplete import AutocompleteSelect
 
 
 class PostFilter(FilterSet):
@@ -20,7 +22,7 @@ class PostFilter(FilterSet):
         queryset=Category.objects.all(),
         label='Категория',
         empty_label='Все категории',
-        widget=forms.Select(attrs={
+        widget=AutocompleteSelect('category_autocomplete', attrs={
             'class': 'form-control',
             'style': 'font-size: 14px;'
         })
@@ -32,11 +34,10 @@ class PostFilter(FilterSet):
 
 class PostSearchFilter(FilterSet):
     title = CharFilter(
-        field_name='title',
-        lookup_expr='icontains',
-        label='Название содержит',
+        method='filter_text',
+        label='Название или текст содержит',
         widget=forms.TextInput(attrs={
-            'placeholder': 'Введите часть названия...',
+            'placeholder': 'Введите слова для поиска...',
             'class': 'form-control',
             'style': 'font-size: 14px;'
         })
@@ -47,7 +48,7 @@ class PostSearchFilter(FilterSet):
         queryset=Author.objects.all(),
         label='Автор',
         empty_label='Все авторы',
-        widget=forms.Select(attrs={
+        widget=AutocompleteSelect('author_autocomplete', attrs={
             'class': 'form-control',
             'style': 'font-size: 14px;'
         })
@@ -76,4 +77,7 @@ class PostSearchFilter(FilterSet):
 
     class Meta:
         model = Post
-        fields = ['title', 'author', 'created_after', 'post_type']
\ No newline at end of file
+        fields = ['title', 'author', 'created_after', 'post_type']
+
+    def filter_text(self, queryset, name, value):
+        return search.search_posts(queryset, value)
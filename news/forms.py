@@ -3,10 +3,22 @@ from django.core.exceptions import ValidationError
 from allauth.account.forms import SignupForm
 from django.contrib.auth.models import Group
 from .models import Post, Category, Author
-from django.utils import timezone
-from datetime import timedelta
+from . import publishing, quota
+from .autocomplete import AutocompleteSelect, AutocompleteSelectMultiple
 
-class PostForm(forms.ModelForm):
+
+class PostQuotaMixin:
+    """
+    Заранее показывает ошибку лимита публикаций (news/quota.py). Это
+    подсказка по кешу: лимит проверяется ещё раз при публикации, в одной
+    транзакции со вставкой поста
+    """
+    def check_quota(self, author):
+        if not self.instance.pk and not self.errors:
+            quota.precheck(author)
+
+
+class PostForm(PostQuotaMixin, forms.ModelForm):
     class Meta:
         model = Post
         fields = ['title',
@@ -18,7 +30,7 @@ class PostForm(forms.ModelForm):
         queryset=Author.objects.filter(user__is_staff=False),
         label='Автор',
         empty_label="Выберите автора",
-        widget=forms.Select(attrs={
+        widget=AutocompleteSelect('author_autocomplete', query='staff=0', attrs={
             'class': 'form-control',
             'style': 'font-size: 14px;'
         })
@@ -45,7 +57,7 @@ class PostForm(forms.ModelForm):
     categories = forms.ModelMultipleChoiceField(
         queryset=Category.objects.all(),
         label='Категории',
-        widget=forms.SelectMultiple(attrs={
+        widget=AutocompleteSelectMultiple('category_autocomplete', attrs={
             'class': 'form-control',
             'style': 'font-size: 14px;'
         })
@@ -64,21 +76,6 @@ class PostForm(forms.ModelForm):
         cleaned_data = super().clean()
         content = cleaned_data.get('content')
         author = cleaned_data.get('author')
-        if author and not self.instance.pk:
-            today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tomorrow_start = today_start + timedelta(days=1)
-
-            posts_today = Post.objects.filter(
-                author=author,
-                created_at__gte=today_start,
-                created_at__lt=tomorrow_start
-            ).count()
-
-            if posts_today >= 3:
-                raise ValidationError(
-                    f'Нельзя публиковать более 3 постов в сутки. '
-                    f'Автор "{author}" уже опубликовал {posts_today} постов сегодня.'
-                )
         if content is not None and len(content) < 50:
             raise ValidationError({
                 "content": "Описание не может быть менее 50 символов."
@@ -90,6 +87,8 @@ class PostForm(forms.ModelForm):
                 'Содержание не должно быть идентичным заголовку.'
             )
 
+        if author:
+            self.check_quota(author)
         return cleaned_data
 
     def clean_title(self):
@@ -109,10 +108,11 @@ class PostForm(forms.ModelForm):
         return content
 
     def save(self, commit=True):
-        post = super().save(commit=commit)
-        if commit:
-            self.save_m2m()
-        return post
+        # ModelForm.save() сам сохраняет категории при правке; новый пост
+        # публикуется одной вставкой с категориями
+        if not commit or self.instance.pk:
+            return super().save(commit=commit)
+        return publishing.publish(self.instance, self.cleaned_data['categories'])
 
 class CommonSignupForm(SignupForm):
     def save(self, request):
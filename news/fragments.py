@@ -0,0 +1,164 @@
+"""
+Пользовательские фрагменты закешированных страниц (как ESI).
+
+Ленты рендерятся и кешируются один раз для всех читателей: вместо кнопок,
+зависящих от пользователя, шаблон ставит метку {% fragment 'имя' аргументы %}.
+FragmentMiddleware уже после кеша заменяет метки фрагментами для текущего
+пользователя. Данные пользователя (права, группа, подписки) загружаются
+один раз на запрос и только если на странице есть нужные метки.
+"""
+import re
+from functools import cached_property
+
+from django.urls import reverse
+from django.utils.html import format_html
+
+from .models import Subscription
+
+FRAGMENTS = {}
+
+MARKER_RE = re.compile(r'<!--fragment:(\w+)((?::\d+)*)-->')
+
+
+def fragment(name):
+    def decorator(func):
+        FRAGMENTS[name] = func
+        return func
+    return decorator
+
+
+def marker(name, *args):
+    return ''.join([f'<!--fragment:{name}', *(f':{int(arg)}' for arg in args), '-->'])
+
+
+class UserState:
+    """
+    Всё, что фрагментам нужно знать о пользователе, с загрузкой по требованию
+    """
+    def __init__(self, request):
+        self.user = request.user
+
+    @cached_property
+    def is_authenticated(self):
+        return self.user.is_authenticated
+
+    @cached_property
+    def is_author(self):
+        return self.is_authenticated and self.user.groups.filter(name='authors').exists()
+
+    @cached_property
+    def subscriptions(self):
+        """
+        Режим уведомлений по id категорий, на которые подписан пользователь
+        """
+        if not self.is_authenticated:
+            return {}
+        return dict(Subscription.objects.filter(user=self.user).values_list('category_id', 'delivery_mode'))
+
+    def has_perm(self, perm):
+        return self.is_authenticated and self.user.has_perm(perm)
+
+
+@fragment('post_buttons')
+def post_buttons(state):
+    if not state.has_perm('news.add_post'):
+        return ''
+    return format_html(
+        '<a href="{}" class="btn btn-success">Добавить новость</a>\n'
+        '<a href="{}" class="btn btn-success">Добавить статью</a>',
+        reverse('news_create'), reverse('article_create'),
+    )
+
+
+@fragment('author_banner')
+def author_banner(state):
+    if not state.is_authenticated:
+        return ''
+    if state.is_author:
+        return format_html('<div style="margin-bottom: 20px;"><span class="btn btn-success">{}</span></div>', 'Вы автор!')
+    return format_html('<div style="margin-bottom: 20px;"><a href="{}" class="btn btn-info">{}</a></div>', reverse('upgrade'), 'Стать автором!')
+
+
+# значок текущего режима уведомлений и режим, на который переключает щелчок
+MODE_SWITCH = {
+    Subscription.IMMEDIATE: ('⚡', Subscription.HOURLY),
+    Subscription.HOURLY: ('🕐', Subscription.DAILY),
+    Subscription.DAILY: ('📅', Subscription.IMMEDIATE),
+}
+
+
+@fragment('subscription')
+def subscription(state, category_id):
+    if not state.is_authenticated:
+        return ''
+    if category_id in state.subscriptions:
+        icon, next_mode = MODE_SWITCH[state.subscriptions[category_id]]
+        modes = dict(Subscription.DELIVERY_MODES)
+        return format_html(
+            '<a href="{}" style="text-decoration: none; margin-left: 3px;" title="Уведомления: {}. Переключить на «{}»">{}</a>'
+            '<a href="{}" style="color: #dc3545; text-decoration: none; margin-left: 3px;" title="Отписаться">✕</a>',
+            reverse('subscription_mode', args=[category_id, next_mode]),
+            modes[state.subscriptions[category_id]].lower(), modes[next_mode].lower(), icon,
+            reverse('unsubscribe_category', args=[category_id]),
+        )
+    return format_html(
+        '<a href="{}" style="color: #28a745; text-decoration: none; margin-left: 3px;" title="Подписаться">+</a>',
+        reverse('subscribe_category', args=[category_id]),
+    )
+
+
+def _actions(state, update_url, delete_url):
+    links = []
+    if state.has_perm('news.change_post'):
+        links.append(format_html('<a href="{}">Редактировать</a>', update_url))
+    if state.has_perm('news.delete_post'):
+        links.append(format_html('<a href="{}">Удалить</a>', delete_url))
+    return '\n'.join(links)
+
+
+@fragment('news_actions')
+def news_actions(state, pk):
+    return _actions(state, reverse('news_update', args=[pk]), reverse('news_delete', args=[pk]))
+
+
+@fragment('article_actions')
+def article_actions(state, pk):
+    return _actions(state, reverse('article_update', args=[pk]), reverse('article_delete', args=[pk]))
+
+
+def fill(request, content):
+    """
+    Заменяет метки в HTML фрагментами для пользователя запроса
+    """
+    state = UserState(request)
+
+    def render(match):
+        func = FRAGMENTS.get(match.group(1))
+        if func is None:
+            return ''
+        args = [int(arg) for arg in match.group(2).split(':') if arg]
+        return func(state, *args)
+
+    return MARKER_RE.sub(render, content)
+
+
+class FragmentMiddleware:
+    """
+    Вставляет пользовательские фрагменты в HTML-ответы, в том числе взятые
+    из кеша страниц. Должен стоять после AuthenticationMiddleware
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or not response.get('Content-Type', '').startswith('text/html')
+            or b'<!--fragment:' not in response.content
+        ):
+            return response
+        response.content = fill(request, response.content.decode(response.charset)).encode(response.charset)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
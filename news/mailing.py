@@ -0,0 +1,197 @@
+"""
+Массовые письма: рендеринг один раз на всех получателей и отправка
+пачками через одно SMTP-соединение.
+
+Шаблон письма рендерится один раз с заглушкой вместо пользователя: поля
+получателя ({{ user.username }} и т. п.) попадают в HTML метками, которые
+для каждого получателя заменяются простой подстановкой. Текстовая версия
+строится из того же HTML. Фильтры к полям получателя в таких шаблонах не
+применяются: поле выводится как есть (с экранированием в HTML).
+
+msg.send() открывает и закрывает своё соединение (с TLS-рукопожатием) на
+каждое письмо. Здесь пачка идёт через одно соединение из пула воркера
+(news/smtp_pool.py), а ошибка одного письма не останавливает остальные.
+Скорость отправки всех воркеров ограничивает общая корзина токенов
+(news/throttle.py).
+"""
+import logging
+import re
+import time
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import smtp_pool, throttle
+
+logger = logging.getLogger(__name__)
+
+
+# соединения переживают задачу и переиспользуются следующими задачами воркера
+pool = smtp_pool.ConnectionPool(lambda: get_connection(fail_silently=False))
+
+
+def chunks(items, size=None):
+    size = size or getattr(settings, 'NOTIFICATION_CHUNK_SIZE', 100)
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def send_each(messages, limits=('smtp',)):
+    """
+    Отправляет письма через одно соединение из пула воркера. messages —
+    пары (ключ, письмо); для каждого письма выдаёт (ключ, ошибка или
+    None). limits — корзины MAIL_RATE_LIMITS, из которых письмо берёт
+    токен перед отправкой
+    """
+    limiters = throttle.buckets(*limits)
+    messages = iter(messages)
+    try:
+        connection = pool.acquire()
+    except Exception as e:
+        logger.error(f"Не удалось открыть SMTP-соединение: {e}")
+        for key, message in messages:
+            yield key, e
+        return
+    try:
+        for key, message in messages:
+            for limiter in limiters:
+                limiter.acquire()
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                logger.error(f"Ошибка отправки письма {', '.join(message.to)}: {e}")
+                yield key, e
+                # после ошибки сервер мог закрыть сессию: берём другое соединение
+                pool.discard(connection)
+                connection = None
+                try:
+                    connection = pool.acquire()
+                except Exception as e:
+                    # сервер недоступен: остальные письма пачки получают эту
+                    # ошибку, а не теряются вместе с генератором
+                    logger.error(f"Не удалось заново открыть SMTP-соединение: {e}")
+                    for key, message in messages:
+                        yield key, e
+                    return
+            else:
+                yield key, None
+    finally:
+        if connection is not None:
+            pool.release(connection)
+
+
+def send_messages(messages, limits=('smtp',)):
+    """
+    Отправляет письма через одно соединение. Возвращает словарь с числом
+    отправленных и неотправленных писем и временем в секундах
+    """
+    started = time.perf_counter()
+    sent = failed = 0
+    for _, error in send_each(enumerate(messages), limits):
+        if error is None:
+            sent += 1
+        else:
+            failed += 1
+    return {'sent': sent, 'failed': failed, 'duration': round(time.perf_counter() - started, 3)}
+
+
+# Символы из области частного использования: шаблон их не экранирует,
+# а в тексте писем они не встречаются
+FIELD_START, FIELD_END = '\ue000', '\ue001'
+FIELD_RE = re.compile(f'{FIELD_START}(\\w+){FIELD_END}')
+
+
+class Recipient:
+    """
+    Заглушка пользователя при рендеринге: любое поле выводится меткой
+    """
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return mark_safe(f'{FIELD_START}{name}{FIELD_END}')
+
+
+class Personalized:
+    """
+    Строка с метками полей, разобранная один раз: подстановка — это join
+    """
+    def __init__(self, text, escape_values):
+        self.parts = FIELD_RE.split(text)
+        self.escape_values = escape_values
+
+    def fill(self, user):
+        parts = self.parts[:]
+        for index in range(1, len(parts), 2):
+            value = str(getattr(user, parts[index], ''))
+            parts[index] = escape(value) if self.escape_values else value
+        return ''.join(parts)
+
+
+class RenderedEmail:
+    """
+    Письмо, отрендеренное один раз для группы получателей с одинаковым
+    содержимым. message(user) собирает письмо конкретному получателю
+    """
+    def __init__(self, template_name, context, subject):
+        html = render_to_string(template_name, {**context, 'user': Recipient()})
+        self.subject = Personalized(subject, escape_values=False)
+        self.html = Personalized(html, escape_values=True)
+        self.text = Personalized(html_to_text(html), escape_values=False)
+
+    def message(self, user):
+        msg = EmailMultiAlternatives(
+            subject=self.subject.fill(user),
+            body=self.text.fill(user),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+        msg.attach_alternative(self.html.fill(user), "text/html")
+        return msg
+
+
+class _TextExtractor(HTMLParser):
+    BLOCKS = {'p', 'div', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'tr', 'center', 'hr'}
+    SKIP = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip = 0
+        self.href = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+        elif tag == 'a':
+            self.href = dict(attrs).get('href')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip -= 1
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+        elif tag == 'a' and self.href:
+            self.parts.append(f' ({self.href})')
+            self.href = None
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data.replace('\n', ' '))
+
+
+def html_to_text(html):
+    """
+    Текстовая версия письма: блоки — строками, ссылки — с адресом в скобках
+    """
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = [' '.join(line.split()) for line in ''.join(parser.parts).split('\n')]
+    text = '\n'.join(lines)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
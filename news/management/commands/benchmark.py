@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from news.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Запускает нагрузочный замер на временной базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', type=str, help=f'Замер: {", ".join(sorted(BENCHMARKS))}')
+        parser.add_argument('--writers', type=int, help='Число параллельных потоков')
+        parser.add_argument('--count', type=int, help='Размер нагрузки')
+
+    def handle(self, *args, **options):
+        try:
+            func = BENCHMARKS[options['name']]
+        except KeyError:
+            raise CommandError(f'Неизвестный замер {options["name"]}. Доступны: {", ".join(sorted(BENCHMARKS))}')
+
+        description = ' '.join(func.__doc__.split())
+        self.stdout.write(self.style.SUCCESS(f'Замер {options["name"]}: {description}'))
+        func(self.stdout.write, writers=options['writers'], count=options['count'])
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from news import throttle
+from news.models import Delivery
+from project.celery import queue_depth
+
+
+class Command(BaseCommand):
+    help = 'Длина очередей писем и ожидание в ограничителе скорости отправки'
+
+    def handle(self, *args, **options):
+        queues = sorted({route['queue'] for route in getattr(settings, 'CELERY_TASK_ROUTES', {}).values()})
+        for queue in queues:
+            depth = queue_depth(queue)
+            self.stdout.write(f'queue.{queue}.depth {"брокер недоступен" if depth is None else depth}')
+
+        due = Delivery.objects.filter(status__in=[Delivery.PENDING, Delivery.SENDING]).count()
+        self.stdout.write(f'outbox.pending {due}')
+
+        for name in getattr(settings, 'MAIL_RATE_LIMITS', throttle.DEFAULT_LIMITS):
+            stats = throttle.bucket(name).stats()
+            self.stdout.write(f'throttle.{name}.acquired {stats["acquired"]}')
+            self.stdout.write(f'throttle.{name}.waited_seconds {stats["waited"]:.3f}')
@@ -0,0 +1,39 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from news import censor, moderation
+
+
+class Command(BaseCommand):
+    help = 'Проверяет опубликованные посты и комментарии текущим словарём цензуры'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число процессов проверки')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--restart', action='store_true', help='Начать проверку этого словаря заново')
+
+    def handle(self, *args, **options):
+        words = censor.reload().words
+        scan = moderation.open_scan(words, restart=options['restart'])
+        if scan.finished_at:
+            self.stdout.write(f'{scan} уже завершена: проверено {scan.scanned}, отмечено {scan.flagged}. '
+                              f'Повторить: --restart')
+            return
+        if scan.last_post_id or scan.last_comment_id:
+            self.stdout.write(f'Продолжение после поста #{scan.last_post_id}, '
+                              f'комментария #{scan.last_comment_id}')
+
+        def progress(kind, last_id, scanned):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{kind} #{last_id}: проверено {scanned}')
+
+        started = time.perf_counter()
+        scanned = moderation.run(scan, words, workers=max(options['workers'], 1),
+                                 chunk_size=options['chunk_size'], progress=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено {scanned} документов за {elapsed:.1f} с ({scanned / elapsed:.0f} док/с), '
+            f'отмечено всего {scan.flagged}'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from news import ratings
+from news.models import Author
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг всех авторов одним групповым запросом'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только показать расхождения, ничего не менять')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        authors = ratings.annotate_computed_rating(Author.objects.select_related('user').only('rating', 'user__username'))
+
+        with transaction.atomic():
+            drifted = []
+            for author in authors.iterator(chunk_size=options['batch_size']):
+                if author.rating != author.computed_rating:
+                    if options['check']:
+                        self.stdout.write(f'{author}: {author.rating}, должно быть {author.computed_rating}')
+                    author.rating = author.computed_rating
+                    drifted.append(author)
+
+            if options['check']:
+                if drifted:
+                    raise CommandError(f'Рейтинг расходится у {len(drifted)} авторов')
+                self.stdout.write(self.style.SUCCESS('Рейтинги авторов сходятся'))
+                return
+
+            Author.objects.bulk_update(drifted, ['rating'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитан рейтинг {len(drifted)} авторов'))
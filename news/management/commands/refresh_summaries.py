@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from news import page_cache, summaries
+from news.models import Category, Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводки постов для лент, например после правки словаря цензуры'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        refreshed = sum(
+            summaries.refresh(post_ids[start:start + batch_size], batch_size=batch_size)
+            for start in range(0, len(post_ids), batch_size)
+        )
+        # ленты строятся по сводкам: сбрасываются один раз после пересчёта
+        category_ids = Category.objects.values_list('pk', flat=True)
+        page_cache.bump(page_cache.LIST, *map(page_cache.category_scope, category_ids))
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны сводки {refreshed} постов'))
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from news import search
+
+
+def create_index(apps, schema_editor):
+    search.install(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    search.uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0004_keyset_feed_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,34 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+from news import search
+
+
+def copy_created_at(apps, schema_editor):
+    Post = apps.get_model('news', 'Post')
+    Post.objects.update(updated_at=F('created_at'))
+
+
+def install_triggers(apps, schema_editor):
+    search.install_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0005_post_fts'),
+    ]
+
+    operations = [
+        # при откате RemoveField тоже пересоздаёт news_post
+        migrations.RunPython(migrations.RunPython.noop, install_triggers),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.RunPython(install_triggers, migrations.RunPython.noop),
+    ]
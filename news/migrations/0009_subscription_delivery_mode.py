@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0008_digest_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='delivery_mode',
+            field=models.CharField(choices=[('immediate', 'Сразу'), ('hourly', 'Раз в час'), ('daily', 'Раз в день')], default='immediate', max_length=10),
+        ),
+    ]
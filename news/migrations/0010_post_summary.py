@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+from news import summaries
+
+
+def build_summaries(apps, schema_editor):
+    Post = apps.get_model('news', 'Post')
+    PostSummary = apps.get_model('news', 'PostSummary')
+    posts = Post.objects.select_related('author').prefetch_related('categories').annotate(comments=Count('comment'))
+    PostSummary.objects.bulk_create([
+        PostSummary(post=post, **summaries.summary_values(
+            post, sorted(post.categories.all(), key=lambda category: category.pk), post.comments,
+        ))
+        for post in posts.iterator(chunk_size=500)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0009_subscription_delivery_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSummary',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='news.post')),
+                ('title', models.CharField(max_length=255)),
+                ('preview', models.TextField()),
+                ('author_name', models.CharField(max_length=100)),
+                ('categories', models.JSONField(default=list)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
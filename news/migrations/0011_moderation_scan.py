@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0010_post_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dictionary', models.CharField(max_length=32, unique=True)),
+                ('words', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_post_id', models.PositiveIntegerField(default=0)),
+                ('last_comment_id', models.PositiveIntegerField(default=0)),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('flagged', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ModerationFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Пост'), ('comment', 'Комментарий')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('matches', models.PositiveIntegerField()),
+                ('scan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flags', to='news.moderationscan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scan', 'kind', 'object_id'), name='moderation_flag_scan_kind_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0011_moderation_scan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='post_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Лимит постов в сутки'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+def fill_search_names(apps, schema_editor):
+    for model_name in ('Author', 'Category'):
+        model = apps.get_model('news', model_name)
+        objects = list(model.objects.only('name'))
+        for obj in objects:
+            obj.search_name = obj.name.lower()
+        model.objects.bulk_update(objects, ['search_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0012_author_post_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0013_search_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestrun',
+            name='lock_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='digestrun',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
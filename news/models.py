@@ -1,30 +1,48 @@
+from collections import Counter
+
 from django.db import models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from . import ratings
+
+
+class SearchNameMixin:
+    """
+    Хранит name в нижнем регистре в search_name: поиск по началу имени в
+    автодополнении идёт диапазоном по индексу (news/autocomplete.py).
+    LOWER() и LIKE в SQLite не знают кириллицы, поэтому имя приводится
+    здесь, а не в запросе
+    """
+    def save(self, *args, **kwargs):
+        self.search_name = self.name.lower()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'search_name'}
+        super().save(*args, **kwargs)
+
 
-class Author(models.Model):
+class Author(SearchNameMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
+    search_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     rating = models.IntegerField(default=0)
+    # личный лимит постов в сутки вместо общего (news/quota.py)
+    post_limit = models.PositiveIntegerField('Лимит постов в сутки', null=True, blank=True)
 
     def update_rating(self):
-        from django.db.models import Sum
-
-        post_rating = Post.objects.filter(author = self).aggregate(pr=Sum('rating'))['pr'] or 0
-        post_rating *= 3
-
-        comment_rating = self.user.comment_set.aggregate(cr=Sum('rating'))['cr'] or 0
-
-        post_comment_rating = Comment.objects.filter(post__author=self).aggregate(pcr=Sum('rating'))['pcr'] or 0
-
-        self.rating = post_rating + comment_rating + post_comment_rating
-        self.save()
+        authors = ratings.annotate_computed_rating(Author.objects.filter(pk=self.pk))
+        self.rating = authors.values_list('computed_rating', flat=True).get()
+        self.save(update_fields=['rating'])
 
     def __str__(self):
         return self.user.username
 
-class Category(models.Model):
+class Category(SearchNameMixin, models.Model):
     name = models.CharField(max_length=255, unique=True)
+    search_name = models.CharField(max_length=255, default='', editable=False, db_index=True)
     subscribers = models.ManyToManyField(User, through='Subscription', related_name='subscribed_categories', blank=True)
 
     def __str__(self):
@@ -32,35 +50,93 @@ class Category(models.Model):
 
 
 class Subscription(models.Model):
+    IMMEDIATE = 'immediate'
+    HOURLY = 'hourly'
+    DAILY = 'daily'
+    # уведомления о новых постах: сразу или одним письмом за час или за день
+    DELIVERY_MODES = [
+        (IMMEDIATE, 'Сразу'),
+        (HOURLY, 'Раз в час'),
+        (DAILY, 'Раз в день'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     subscribed_at = models.DateTimeField(auto_now_add=True)
+    delivery_mode = models.CharField(max_length=10, choices=DELIVERY_MODES, default=IMMEDIATE)
 
     class Meta:
         unique_together = ('user', 'category')
+        indexes = [
+            # подписчики категории без обращения к самой таблице
+            models.Index(fields=['category', 'user'], name='subscription_category_user_idx'),
+        ]
 
 class Post(models.Model):
+    """
+    Внимание: на news_post висят триггеры полнотекстового индекса
+    (news/search.py). SQLite пересоздаёт таблицу при AddField, AlterField
+    и т. п. и молча удаляет их: миграция, меняющая Post, должна вызвать
+    search.install_triggers (см. 0006_post_updated_at). post_migrate
+    восстанавливает потерянные триггеры и перестраивает индекс
+    """
     ARTICLE = 'AR'
     NEWS = 'NW'
     POST_TYPES = [
         (ARTICLE, 'Статья'),
         (NEWS, 'Новость'),
     ]
+    # Рейтинг поста входит в рейтинг автора с этим множителем
+    AUTHOR_RATING_WEIGHT = 3
+
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     post_type = models.CharField(max_length=2, choices=POST_TYPES, default=ARTICLE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Время последнего изменения страницы поста: правки, комментарии и
+    # голоса. Отдаётся в Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
     categories = models.ManyToManyField('Category', through='PostCategory')
     title = models.CharField(max_length=255)
     content = models.TextField()
     rating = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # ленты новостей и статей: WHERE post_type ORDER BY -created_at, -id
+            models.Index(fields=['post_type', '-created_at', '-id'], name='post_type_created_id_idx'),
+            # лимит постов автора за сутки в PostForm.clean
+            models.Index(fields=['author', 'created_at'], name='post_author_created_idx'),
+        ]
+
     def like(self):
-        self.rating += 1
-        self.save()
+        ratings.vote(self, 1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        ratings.vote(self, -1)
+
+    @classmethod
+    def author_rating_deltas(cls, deltas):
+        result = Counter()
+        for pk, author_id in cls.objects.filter(pk__in=deltas).values_list('pk', 'author_id'):
+            result[author_id] += cls.AUTHOR_RATING_WEIGHT * deltas[pk]
+        return result
+
+    # поля, смена которых переносит рейтинг на другого автора
+    RATING_OWNER_FIELDS = ('author',)
+
+    @classmethod
+    def rating_shares(cls, pk):
+        """
+        Вклад поста в рейтинг авторов по строке в базе: сам пост с весом и
+        комментарии к нему
+        """
+        row = cls.objects.filter(pk=pk).annotate(
+            comments_rating=Coalesce(Sum('comment__rating'), 0),
+        ).values_list('author_id', 'rating', 'comments_rating').first()
+        if row is None:
+            return Counter()
+        author_id, rating, comments_rating = row
+        return Counter({author_id: cls.AUTHOR_RATING_WEIGHT * rating + comments_rating})
 
     def preview(self):
         return self.content[:124] + '...' if len(self.content) > 124 else self.content
@@ -71,10 +147,34 @@ class Post(models.Model):
     def __str__(self):
         return self.title
 
+class PostSummary(models.Model):
+    """
+    Готовые к выводу данные поста для лент: заголовок и анонс уже
+    процензурированы, имя автора и категории скопированы. Ленты читают
+    только эту строку и не загружают content. Обновляется сигналами при
+    изменении поста, его категорий, комментариев и автора (news/summaries.py)
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    title = models.CharField(max_length=255)
+    preview = models.TextField()
+    author_name = models.CharField(max_length=100)
+    # [[id, название], ...] по возрастанию id
+    categories = models.JSONField(default=list)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.title
+
 class  PostCategory(models.Model):
     post = models.ForeignKey('Post', on_delete=models.CASCADE)
     category = models.ForeignKey('Category', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # фильтр по категории в PostFilter: category -> post без чтения строк
+            models.Index(fields=['category', 'post'], name='postcategory_category_post_idx'),
+        ]
+
 class Comment(models.Model):
     post = models.ForeignKey('Post', on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -82,13 +182,153 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     rating = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at'], name='comment_post_created_idx'),
+        ]
+
     def like(self):
-        self.rating += 1
-        self.save()
+        ratings.vote(self, 1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        ratings.vote(self, -1)
+
+    @classmethod
+    def author_rating_deltas(cls, deltas):
+        result = Counter()
+        rows = cls.objects.filter(pk__in=deltas).values_list('pk', 'user__author', 'post__author_id')
+        for pk, commenter_id, post_author_id in rows:
+            if commenter_id:
+                result[commenter_id] += deltas[pk]
+            result[post_author_id] += deltas[pk]
+        return result
+
+    RATING_OWNER_FIELDS = ('user', 'post')
+
+    @classmethod
+    def rating_shares(cls, pk):
+        """
+        Вклад комментария в рейтинг авторов по строке в базе: его автора и
+        автора поста
+        """
+        return cls.author_rating_deltas({
+            pk: rating for pk, rating in cls.objects.filter(pk=pk).values_list('pk', 'rating')
+        })
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post.title}"
+
+
+class Delivery(models.Model):
+    """
+    Строка исходящей очереди писем: одна на (пост, пользователь, вид).
+    Пишется в той же транзакции, что и пост, отправляется воркерами
+    (news/outbox.py)
+    """
+    NEW_POST = 'new_post'
+    KINDS = [
+        (NEW_POST, 'Новый пост'),
+    ]
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Ожидает'),
+        (SENDING, 'Отправляется'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KINDS, default=NEW_POST)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # для PENDING — когда повторить, для SENDING — до когда действует захват
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # ключ идемпотентности: повторная постановка не создаёт второе письмо
+            models.UniqueConstraint(fields=['post', 'user', 'kind'], name='delivery_post_user_kind_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='delivery_due_idx'),
+            models.Index(fields=['claim'], name='delivery_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.post_id} -> {self.user_id} ({self.status})"
+
+
+class DigestRun(models.Model):
+    """
+    Запуск еженедельной рассылки: один на неделю. Получатели обходятся по
+    возрастанию id, и последний обработанный запоминается, поэтому
+    прерванный запуск продолжается с того же места (news/digest.py)
+    """
+    # неделя по ISO, например 2025-W07
+    period = models.CharField(max_length=10, unique=True)
+    since = models.DateTimeField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_user_id = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # блокировка единственного воркера: токен владельца и срок её действия
+    lock_token = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Рассылка {self.period}"
+
+
+class ModerationScan(models.Model):
+    """
+    Проверка опубликованных постов и комментариев словарём цензуры: одна
+    на версию словаря. Документы обходятся по возрастанию id, последний
+    проверенный запоминается, поэтому прерванная проверка продолжается с
+    того же места (news/moderation.py)
+    """
+    # хеш словаря: после его правки начинается новая проверка
+    dictionary = models.CharField(max_length=32, unique=True)
+    words = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_post_id = models.PositiveIntegerField(default=0)
+    last_comment_id = models.PositiveIntegerField(default=0)
+    scanned = models.PositiveIntegerField(default=0)
+    flagged = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Проверка словаря {self.dictionary[:8]}"
+
+
+class ModerationFlag(models.Model):
+    """
+    Пост или комментарий, в котором проверка нашла слова из словаря
+    """
+    POST = 'post'
+    COMMENT = 'comment'
+    KINDS = [
+        (POST, 'Пост'),
+        (COMMENT, 'Комментарий'),
+    ]
+
+    scan = models.ForeignKey(ModerationScan, on_delete=models.CASCADE, related_name='flags')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    matches = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scan', 'kind', 'object_id'], name='moderation_flag_scan_kind_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id}: {self.matches}"
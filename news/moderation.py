@@ -0,0 +1,109 @@
+"""
+Проверка уже опубликованных постов и комментариев словарём цензуры.
+
+Фильтр censor применяется только при выводе, поэтому после правки
+словаря неизвестно, какие старые тексты теперь под него попадают. Здесь
+посты и комментарии читаются пачками по возрастанию id и проверяются в
+пуле процессов: каждый процесс компилирует словарь один раз и получает
+только тексты, а база остаётся в главном процессе.
+
+Результаты пачек забираются в порядке id. Найденные документы и id
+последнего проверенного пишутся в одной транзакции на пачку, поэтому
+прерванная проверка продолжается с того же места и ничего не считает
+дважды. Проверка привязана к хешу словаря: после его правки начинается
+новая.
+"""
+import hashlib
+import multiprocessing
+from collections import deque
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import censor
+from .models import Comment, ModerationFlag, ModerationScan, Post
+
+# вид документа -> модель, поля текста и поле контрольной точки
+SOURCES = [
+    (ModerationFlag.POST, Post, ('title', 'content'), 'last_post_id'),
+    (ModerationFlag.COMMENT, Comment, ('content',), 'last_comment_id'),
+]
+
+
+def dictionary_key(words):
+    return hashlib.blake2b('\n'.join(sorted(words)).encode(), digest_size=16).hexdigest()
+
+
+def open_scan(words, restart=False):
+    """
+    Проверка для текущего словаря: продолжает начатую или создаёт новую
+    """
+    key = dictionary_key(words)
+    if restart:
+        ModerationScan.objects.filter(dictionary=key).delete()
+    scan, _ = ModerationScan.objects.get_or_create(dictionary=key, defaults={'words': len(words)})
+    return scan
+
+
+def chunks(model, fields, after, chunk_size):
+    """
+    Пачки [(id, текст), ...] по возрастанию id, начиная после after
+    """
+    while True:
+        rows = list(model.objects.filter(pk__gt=after).order_by('pk').values_list('pk', *fields)[:chunk_size])
+        if not rows:
+            return
+        yield [(pk, '\n'.join(parts)) for pk, *parts in rows]
+        after = rows[-1][0]
+
+
+def _ordered_results(pool, batches, window):
+    # не больше window пачек в работе: архив не читается в память целиком,
+    # а чтение базы остаётся в этом потоке
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(censor.scan_chunk, (batch,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def save_chunk(scan, kind, checkpoint, last_id, scanned, flagged):
+    with transaction.atomic():
+        ModerationFlag.objects.bulk_create([
+            ModerationFlag(scan=scan, kind=kind, object_id=pk, matches=matches) for pk, matches in flagged
+        ])
+        setattr(scan, checkpoint, last_id)
+        scan.scanned += scanned
+        scan.flagged += len(flagged)
+        scan.save(update_fields=[checkpoint, 'scanned', 'flagged'])
+
+
+def run(scan, words, workers=1, chunk_size=500, progress=None):
+    """
+    Проверяет документы после контрольных точек scan; возвращает число
+    проверенных за этот запуск
+    """
+    scanned = 0
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=censor.init_scan_worker, initargs=(words,))
+    else:
+        censor.init_scan_worker(words)
+    try:
+        for kind, model, fields, checkpoint in SOURCES:
+            batches = chunks(model, fields, getattr(scan, checkpoint), chunk_size)
+            results = _ordered_results(pool, batches, workers * 2) if pool else map(censor.scan_chunk, batches)
+            for last_id, count, flagged in results:
+                save_chunk(scan, kind, checkpoint, last_id, count, flagged)
+                scanned += count
+                if progress:
+                    progress(kind, last_id, scanned)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    scan.finished_at = timezone.now()
+    scan.save(update_fields=['finished_at'])
+    return scanned
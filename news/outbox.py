@@ -0,0 +1,205 @@
+"""
+Исходящая очередь уведомлений.
+
+Сигнал о категориях поста не ставит задачу напрямую, а пишет строки
+Delivery в той же транзакции, что и пост: откат транзакции отменяет и
+письма. Уникальный ключ (пост, пользователь, вид) не даёт поставить одно
+письмо дважды, например при повторном сохранении поста в админке.
+
+Воркеры захватывают созревшие строки пачками под случайный токен, поэтому
+два воркера не отправят одно письмо, а захват упавшего воркера истекает
+через OUTBOX_CLAIM_TIMEOUT секунд. Ошибка отправки откладывает строку на
+OUTBOX_RETRY_DELAY * 2^(попытка - 1) секунд; после OUTBOX_MAX_ATTEMPTS
+попыток строка помечается FAILED. Строка помечается SENT сразу после
+своего письма, а исключение посреди пачки возвращает неотправленные
+строки в очередь, поэтому повторный захват не дублирует ушедшие письма.
+
+Подписка может копить уведомления (Subscription.delivery_mode): строка
+такого подписчика созревает в конце окна — в начале следующего часа или
+в NOTIFICATION_DAILY_HOUR следующего утра. Все строки одного получателя
+захватываются вместе и уходят одним письмом со списком постов, поэтому
+серия постов в категории даёт одно письмо за окно, а не письмо на пост.
+"""
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import mailing
+from .models import Category, Delivery, Subscription
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def due_at(mode, now=None):
+    """
+    Когда отправлять уведомление подписке с этим режимом: сразу или в
+    конце текущего окна
+    """
+    now = now or timezone.now()
+    if mode == Subscription.HOURLY:
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    if mode == Subscription.DAILY:
+        local = timezone.localtime(now)
+        send_at = local.replace(hour=_setting('NOTIFICATION_DAILY_HOUR', 9), minute=0, second=0, microsecond=0)
+        return send_at if send_at > local else send_at + timedelta(days=1)
+    return now
+
+
+def enqueue_new_post(post_id):
+    """
+    Ставит в очередь по письму каждому подписчику категорий поста с email.
+    Вызывается внутри транзакции, сохраняющей пост; уже поставленные
+    письма пропускаются
+    """
+    now = timezone.now()
+    modes = Subscription.objects.filter(
+        category__postcategory__post_id=post_id,
+    ).exclude(user__email='').values_list('user_id', 'delivery_mode').order_by('user_id').distinct()
+    # подписчик нескольких категорий поста получает его в самое раннее из окон
+    send_at = {}
+    for user_id, mode in modes:
+        when = due_at(mode, now)
+        send_at[user_id] = min(send_at.get(user_id, when), when)
+    deliveries = [
+        Delivery(post_id=post_id, user_id=user_id, kind=Delivery.NEW_POST, next_attempt_at=when)
+        for user_id, when in send_at.items()
+    ]
+    Delivery.objects.bulk_create(deliveries, batch_size=500, ignore_conflicts=True)
+    return len(deliveries)
+
+
+def claim(limit):
+    """
+    Захватывает созревшие строки до limit получателей, каждого — со всеми
+    его строками. Возвращает токен захвата или None, если отправлять нечего
+    """
+    now = timezone.now()
+    due = Delivery.objects.filter(
+        status__in=[Delivery.PENDING, Delivery.SENDING], next_attempt_at__lte=now,
+    )
+    user_ids = set(due.order_by('next_attempt_at').values_list('user_id', flat=True)[:limit])
+    if not user_ids:
+        return None
+    token = uuid.uuid4().hex
+    # Повторное условие отсекает строки, которые успел захватить другой воркер
+    claimed = due.filter(user_id__in=user_ids).update(
+        status=Delivery.SENDING,
+        claim=token,
+        next_attempt_at=now + timedelta(seconds=_setting('OUTBOX_CLAIM_TIMEOUT', 600)),
+    )
+    return token if claimed else claim(limit)
+
+
+def _build_messages(deliveries):
+    """
+    Письма для захваченных строк, по одному на получателя: категории
+    получателей — одним запросом, шаблон — один раз на одинаковое
+    содержимое. Возвращает письма и строки каждого письма по id получателя
+    """
+    post_ids = {delivery.post_id for delivery in deliveries}
+    user_ids = {delivery.user_id for delivery in deliveries}
+    matched = defaultdict(list)
+    rows = list(Subscription.objects.filter(
+        user_id__in=user_ids, category__postcategory__post_id__in=post_ids,
+    ).values_list('category__postcategory__post_id', 'user_id', 'category_id').order_by('category_id').distinct())
+    for post_id, user_id, category_id in rows:
+        matched[post_id, user_id].append(category_id)
+    categories = Category.objects.in_bulk({category_id for _, _, category_id in rows})
+
+    by_user = defaultdict(list)
+    for delivery in deliveries:
+        if matched[delivery.post_id, delivery.user_id] and delivery.user.email:
+            by_user[delivery.user_id].append(delivery)
+
+    emails = {}
+    messages = {}
+    for user_id, user_deliveries in by_user.items():
+        user_deliveries.sort(key=lambda delivery: (delivery.post.created_at, delivery.post_id))
+        key = tuple((delivery.post_id, tuple(matched[delivery.post_id, user_id])) for delivery in user_deliveries)
+        if key not in emails:
+            items = [(delivery.post, [categories[pk] for pk in pks]) for delivery, (_, pks) in zip(user_deliveries, key)]
+            emails[key] = _render(items)
+        messages[user_id] = emails[key].message(user_deliveries[0].user)
+    return messages, by_user
+
+
+def _render(items):
+    if len(items) == 1:
+        post, user_categories = items[0]
+        names = ', '.join(f'"{category.name}"' for category in user_categories)
+        return mailing.RenderedEmail(
+            'account/email/new_post_notification.html',
+            {'post': post, 'categories': user_categories},
+            subject=f'Новая запись в {"разделах" if len(user_categories) > 1 else "разделе"} {names}',
+        )
+    return mailing.RenderedEmail(
+        'account/email/new_posts_batch.html',
+        {'items': items},
+        subject=f'Новые записи в ваших разделах: {len(items)}',
+    )
+
+
+def _retry(delivery, error):
+    attempts = delivery.attempts + 1
+    if attempts >= _setting('OUTBOX_MAX_ATTEMPTS', 5):
+        status, next_attempt_at = Delivery.FAILED, timezone.now()
+    else:
+        delay = _setting('OUTBOX_RETRY_DELAY', 60) * 2 ** (attempts - 1)
+        status, next_attempt_at = Delivery.PENDING, timezone.now() + timedelta(seconds=delay)
+    Delivery.objects.filter(pk=delivery.pk, claim=delivery.claim).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, claim='', last_error=str(error)[:1000],
+    )
+
+
+def deliver(token):
+    """
+    Отправляет строки, захваченные под token, через одно SMTP-соединение
+    """
+    started = time.perf_counter()
+    deliveries = list(Delivery.objects.filter(claim=token, status=Delivery.SENDING).select_related('post', 'user'))
+    messages, by_user = _build_messages(deliveries)
+
+    queued = {delivery.pk for user_deliveries in by_user.values() for delivery in user_deliveries}
+    skipped = [delivery for delivery in deliveries if delivery.pk not in queued]
+    Delivery.objects.filter(pk__in=[delivery.pk for delivery in skipped], claim=token).update(
+        status=Delivery.FAILED, attempts=F('attempts') + 1, claim='',
+        last_error='Получатель отписался от категорий поста или не указал email',
+    )
+
+    # строки отмечаются сразу после своего письма: после падения посреди
+    # пачки повторный захват не отправит уже ушедшие письма ещё раз
+    pending = dict(by_user)
+    failed = 0
+    try:
+        for user_id, error in mailing.send_each(messages.items()):
+            user_deliveries = pending.pop(user_id)
+            if error is None:
+                Delivery.objects.filter(pk__in=[delivery.pk for delivery in user_deliveries], claim=token).update(
+                    status=Delivery.SENT, attempts=F('attempts') + 1, sent_at=timezone.now(), claim='',
+                )
+            else:
+                failed += 1
+                for delivery in user_deliveries:
+                    _retry(delivery, error)
+    except Exception as e:
+        logger.error(f"Отправка пачки {token} прервана, неотправленные письма вернутся в очередь: {e}")
+        for user_deliveries in pending.values():
+            for delivery in user_deliveries:
+                _retry(delivery, e)
+        raise
+    return {
+        'sent': len(messages) - failed,
+        'failed': failed,
+        'skipped': len(skipped),
+        'duration': round(time.perf_counter() - started, 3),
+    }
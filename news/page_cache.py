@@ -0,0 +1,150 @@
+"""
+Кеш страниц с версионными ключами.
+
+У каждого поста, каждой категории и у ленты в целом есть номер поколения в
+кеше. Ключ закешированной страницы включает поколения, от которых она
+зависит, а сигналы моделей увеличивают их при любом изменении. После правки
+страница сразу рендерится заново, а неизменившиеся страницы живут в кеше
+часами.
+
+Те же поколения служат ETag: браузер и обратный прокси перепроверяют
+страницу запросом с If-None-Match и получают 304 без рендеринга и без
+чтения страницы из кеша.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from django.views.decorators.cache import cache_page
+
+from .models import Post
+
+LIST = 'list'
+# ответы автодополнения (news/autocomplete.py)
+AUTHORS = 'authors'
+CATEGORIES = 'categories'
+
+
+def post_scope(pk):
+    return f'post:{pk}'
+
+
+def category_scope(pk):
+    return f'category:{pk}'
+
+
+def user_scope(pk):
+    # пользовательские фрагменты: подписки, группы и права
+    return f'user:{pk}'
+
+
+def _key(scope):
+    return f'page-generation:{scope}'
+
+
+def _fresh_generation():
+    # Если номер вытеснен из кеша, новый не совпадёт ни с одним из старых
+    return int(time.time() * 1000)
+
+
+def generations(scopes):
+    keys = [_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _fresh_generation(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """
+    Делает устаревшими все страницы, зависящие от этих областей
+    """
+    for scope in set(scopes):
+        try:
+            cache.incr(_key(scope))
+        except ValueError:
+            cache.set(_key(scope), _fresh_generation(), timeout=None)
+
+
+def cache_versioned(scopes, timeout=None, per_user=False, last_modified=None):
+    """
+    Как cache_page, но ключ страницы включает поколения областей, которые
+    scopes(request, **kwargs) возвращает для запроса. Из тех же поколений
+    строится ETag; per_user добавляет к нему поколение фрагментов
+    пользователя, last_modified(request, **kwargs) даёт Last-Modified
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            scope_list = scopes(request, **kwargs)
+            key_prefix = '.'.join(f'{scope}={generation}' for scope, generation in zip(scope_list, generations(scope_list)))
+            page_timeout = timeout or getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 6)
+            cached_view = cache_page(page_timeout, key_prefix=key_prefix)(view)
+            if request.method not in ('GET', 'HEAD'):
+                return cached_view(request, *args, **kwargs)
+
+            etag = _etag(request, key_prefix, per_user)
+            modified = last_modified(request, **kwargs) if last_modified else None
+            modified = int(modified.timestamp()) if modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=modified)
+            if response is None:
+                response = cached_view(request, *args, **kwargs)
+
+            def add_validators(response):
+                # В закешированном ответе могут быть заголовки от первого запроса
+                if response.status_code in (200, 304):
+                    response.headers['ETag'] = etag
+                    if modified:
+                        response.headers['Last-Modified'] = http_date(modified)
+                # Клиент может хранить страницу, но перед показом перепроверяет
+                patch_cache_control(response, no_cache=True, max_age=0)
+                response.headers.pop('Expires', None)
+                return response
+
+            # Свежий ответ рендерится позже: заголовки ставятся после того,
+            # как cache_page сохранит его в кеш
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.add_post_render_callback(add_validators)
+                return response
+            return add_validators(response)
+        return wrapped
+    return decorator
+
+
+def _etag(request, key_prefix, per_user):
+    tag = key_prefix
+    if per_user:
+        user_id = request.session.get(SESSION_KEY)
+        if user_id:
+            tag += f'.user={generations([user_scope(user_id)])[0]}'
+    return quote_etag(hashlib.md5(tag.encode(), usedforsecurity=False).hexdigest())
+
+
+def list_scopes(request, **kwargs):
+    category = request.GET.get('category', '')
+    if category.isdigit():
+        return [category_scope(category)]
+    return [LIST]
+
+
+def author_choice_scopes(request, **kwargs):
+    return [AUTHORS]
+
+
+def category_choice_scopes(request, **kwargs):
+    return [CATEGORIES]
+
+
+def detail_scopes(request, pk, **kwargs):
+    return [post_scope(pk)]
+
+
+def detail_last_modified(request, pk, **kwargs):
+    return Post.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
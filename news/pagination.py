@@ -0,0 +1,102 @@
+"""
+Курсорная (keyset) пагинация лент по (created_at, id).
+
+Вместо OFFSET и COUNT(*) страница выбирается условием по ключу последней
+показанной записи, поэтому глубокие страницы открываются так же быстро,
+как первая. Общее число страниц не считается.
+
+Курсор подходит только лентам в порядке ORDERING: поиск с ранжированием
+упорядочен по релевантности, и для него представление оставляет
+обычную пагинацию (см. CursorPaginator.supports).
+"""
+from datetime import datetime
+
+from django.core import signing
+from django.http import Http404
+
+SALT = 'news.pagination.cursor'
+NEXT = 'n'
+PREVIOUS = 'p'
+ORDERING = ('-created_at', '-id')
+
+
+class CursorPage:
+    """
+    Страница курсорной пагинации. Вместо номера страницы и их общего
+    числа — непрозрачные токены соседних страниц
+    """
+    paginator = None
+    number = None
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @staticmethod
+    def supports(queryset):
+        """
+        Не потеряет ли курсор порядок queryset
+        """
+        return tuple(queryset.query.order_by) in ((), ORDERING)
+
+    def encode(self, post, direction):
+        return signing.dumps([post.created_at.isoformat(), post.pk, direction], salt=SALT, compress=True)
+
+    def decode(self, cursor):
+        try:
+            created_at, pk, direction = signing.loads(cursor, salt=SALT)
+            return datetime.fromisoformat(created_at), int(pk), direction
+        except (signing.BadSignature, ValueError, TypeError):
+            raise Http404('Неверный курсор страницы')
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*ORDERING)
+        direction = NEXT
+        if cursor:
+            created_at, pk, direction = self.decode(cursor)
+            if direction == PREVIOUS:
+                queryset = queryset.filter(created_at__gte=created_at).exclude(created_at=created_at, pk__lte=pk)
+                queryset = queryset.order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, pk__gte=pk)
+
+        # Лишняя запись показывает, есть ли что-то дальше
+        posts = list(queryset[:self.per_page + 1])
+        has_more = len(posts) > self.per_page
+        posts = posts[:self.per_page]
+
+        if direction == PREVIOUS:
+            posts.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        if not posts:
+            return CursorPage(posts)
+        return CursorPage(
+            posts,
+            next_cursor=self.encode(posts[-1], NEXT) if has_next else None,
+            previous_cursor=self.encode(posts[0], PREVIOUS) if has_previous else None,
+        )
@@ -0,0 +1,63 @@
+"""
+Публикация нового поста: одна вставка поста, одна пачка связей с
+категориями и задачи — только после коммита.
+
+Раньше представления сохраняли пост и категории, а затем form_valid
+вызывал form.save() ещё раз: второй UPDATE поста, повторный set()
+категорий с сигналами m2m и лишняя задача уведомлений, которая могла
+запуститься до коммита. Здесь связи пишутся одним bulk_create, а строки
+исходящей очереди — в той же транзакции. Задача доставки ставится через
+transaction.on_commit один раз на транзакцию.
+
+Общий путь для PostForm (NewsCreate, ArticleCreate, create_news) и
+админки.
+"""
+from django.db import transaction
+
+from . import outbox, page_cache, quota, summaries
+from .models import PostCategory
+from .tasks import deliver_outbox
+
+
+def dispatch_on_commit(task):
+    """
+    Ставит задачу после коммита текущей транзакции, не больше одного раза
+    на транзакцию
+    """
+    connection = transaction.get_connection()
+    if any(getattr(func, 'task', None) is task for _, func, _ in connection.run_on_commit):
+        return
+
+    def dispatch():
+        task.delay()
+
+    dispatch.task = task
+    transaction.on_commit(dispatch)
+
+
+def link_categories(post, categories):
+    """
+    Связывает только что сохранённый пост с категориями одной вставкой и
+    ставит уведомления подписчикам
+    """
+    category_ids = sorted({getattr(category, 'pk', category) for category in categories})
+    if not category_ids:
+        return
+    # bulk_create не шлёт m2m_changed: сводка, кеш и очередь обновляются здесь
+    PostCategory.objects.bulk_create([PostCategory(post=post, category_id=pk) for pk in category_ids])
+    summaries.refresh([post.pk])
+    page_cache.bump(*map(page_cache.category_scope, category_ids))
+    outbox.enqueue_new_post(post.pk)
+    dispatch_on_commit(deliver_outbox)
+
+
+def publish(post, categories):
+    """
+    Сохраняет новый пост с категориями в одной транзакции. Лимит
+    публикаций автора проверяется в ней же, см. news/quota.py
+    """
+    with transaction.atomic():
+        quota.check(post.author)
+        post.save(force_insert=True)
+        link_categories(post, categories)
+    return post
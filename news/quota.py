@@ -0,0 +1,112 @@
+"""
+Лимит публикаций автора: не больше N постов за скользящие сутки.
+
+Раньше PostForm.clean считал посты автора за день запросом COUNT при
+каждой проверке формы, в том числе при повторном показе после ошибок, а
+две одновременные отправки обе проходили проверку.
+
+Обязательная проверка — check() в транзакции публикации, перед вставкой
+поста (publishing.publish, PostAdmin.save_model). Она считает посты
+автора за окно запросом по индексу (author, created_at) под блокировкой,
+которая держится до коммита, поэтому вторая публикация того же автора
+ждёт первую и видит её пост: последний слот получает только одна. На
+PostgreSQL и MySQL это select_for_update строки автора. В SQLite он
+ничего не блокирует, и транзакции открываются как BEGIN IMMEDIATE
+(transaction_mode в DATABASES): блокировка записи берётся в начале
+транзакции, а вторая ждёт её до timeout секунд. Ничего не занимается
+заранее, и отклонённая форма лимит не тратит.
+
+Форма проверяет лимит заранее через precheck(), чтобы показать ошибку
+рядом с полями: времена публикаций автора за окно кешируются и
+сбрасываются сигналами при создании и удалении поста. Это только
+подсказка: если параллельный запрос успел занять последний слот,
+публикация бросит QuotaExceeded, и представление покажет ту же ошибку.
+
+Лимит: Author.post_limit, иначе наибольший из POST_QUOTA_GROUP_LIMITS
+для групп пользователя, иначе POST_QUOTA_LIMIT.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .models import Author, Post
+
+
+class QuotaExceeded(ValidationError):
+    def __init__(self, author, limit, used):
+        super().__init__(
+            f'Нельзя публиковать более {limit} постов в сутки. '
+            f'Автор "{author}" уже опубликовал {used} постов за сутки.'
+        )
+        self.limit = limit
+        self.used = used
+
+
+def window():
+    return getattr(settings, 'POST_QUOTA_WINDOW', 24 * 60 * 60)
+
+
+def _key(author_id):
+    return f'post-quota:{author_id}'
+
+
+def _since(now):
+    return (now or timezone.now()) - timedelta(seconds=window())
+
+
+def limit_for(author):
+    if author.post_limit is not None:
+        return author.post_limit
+    group_limits = getattr(settings, 'POST_QUOTA_GROUP_LIMITS', {})
+    names = []
+    if group_limits:
+        names = Group.objects.filter(user=author.user_id, name__in=group_limits).values_list('name', flat=True)
+    return max((group_limits[name] for name in names), default=getattr(settings, 'POST_QUOTA_LIMIT', 3))
+
+
+def used(author_id, now=None):
+    """
+    Сколько постов автор опубликовал за окно
+    """
+    return Post.objects.filter(author_id=author_id, created_at__gt=_since(now)).count()
+
+
+def check(author, now=None):
+    """
+    Проверяет лимит перед вставкой нового поста или бросает QuotaExceeded.
+    Вызывается внутри транзакции публикации: блокировка держится до её
+    коммита
+    """
+    author = Author.objects.select_for_update().get(pk=author.pk)
+    limit = limit_for(author)
+    taken = used(author.pk, now)
+    if taken >= limit:
+        raise QuotaExceeded(author, limit, taken)
+
+
+def precheck(author, now=None):
+    """
+    Предварительная проверка для формы по кешу, без блокировок
+    """
+    since = _since(now)
+    published = cache.get(_key(author.pk))
+    if published is None:
+        published = list(Post.objects.filter(
+            author_id=author.pk, created_at__gt=since,
+        ).values_list('created_at', flat=True))
+        cache.set(_key(author.pk), published, timeout=window())
+    taken = sum(1 for created_at in published if created_at > since)
+    limit = limit_for(author)
+    if taken >= limit:
+        raise QuotaExceeded(author, limit, taken)
+
+
+def forget(author_id):
+    """
+    Сбрасывает кеш precheck: пост автора создан или удалён
+    """
+    cache.delete(_key(author_id))
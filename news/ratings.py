@@ -0,0 +1,231 @@
+"""
+Счётчики рейтинга постов и комментариев.
+
+Голос применяется одним UPDATE ... SET rating = rating + N: строка не
+читается, остальные колонки (включая content) не перезаписываются, и
+параллельные голоса не теряются.
+
+Если объект за окно RATING_HOT_WINDOW секунд набирает больше
+RATING_HOT_THRESHOLD голосов, он считается «горячим»: его голоса копятся
+в кеше и сбрасываются в базу пачкой задачей flush_rating_buffers.
+Для буфера нужен кеш с атомарными incr/decr (Redis, Memcached, LocMem):
+на другом кеше голоса всегда пишутся в базу сразу.
+
+Каждое изменение рейтинга поста или комментария сразу переносится на
+Author.rating, поэтому рейтинг авторов не нужно пересчитывать целиком.
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+from django.dispatch import Signal
+
+from .cache_backends import has_atomic_counters
+from .cache_utils import incr
+
+logger = logging.getLogger(__name__)
+
+# Сколько объектов обновлять одним UPDATE при сбросе буфера
+FLUSH_BATCH_SIZE = 500
+
+# Рейтинг объектов изменился в обход save(): sender — модель, pks — их ключи
+ratings_changed = Signal()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _key(model, *parts):
+    return ':'.join(['rating', model._meta.label_lower, *map(str, parts)])
+
+
+def vote(obj, delta):
+    """
+    Применяет голос к посту или комментарию
+    """
+    model = type(obj)
+    if _is_hot(model, obj.pk):
+        _buffer(model, obj.pk, delta)
+    else:
+        apply_deltas(model, {obj.pk: delta})
+    obj.rating += delta
+
+
+def _is_hot(model, pk):
+    threshold = _setting('RATING_HOT_THRESHOLD', 20)
+    if not threshold or not has_atomic_counters(caches['default']):
+        return False
+    hits = incr(cache, _key(model, 'hits', pk), timeout=_setting('RATING_HOT_WINDOW', 10))
+    return hits > threshold
+
+
+def _buffer(model, pk, delta):
+    incr(cache, _key(model, 'delta', pk), delta)
+    # В очередь на сброс объект попадает один раз, пока буфер не сброшен
+    if incr(cache, _key(model, 'pending', pk)) == 1:
+        _enqueue(model, pk)
+
+
+def _enqueue(model, pk):
+    seq = incr(cache, _key(model, 'queue', 'tail'))
+    cache.set(_key(model, 'queue', seq), pk, timeout=None)
+
+
+def pending_delta(model, pk):
+    """
+    Голоса объекта, ещё не сброшенные в базу
+    """
+    return cache.get(_key(model, 'delta', pk), 0)
+
+
+def apply_deltas(model, deltas):
+    """
+    Прибавляет накопленные голоса к рейтингу объектов и их авторов
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    with transaction.atomic(savepoint=False):
+        updated = _update_ratings(model, deltas)
+        if hasattr(model, 'author_rating_deltas'):
+            apply_author_deltas(model, deltas)
+    if updated:
+        ratings_changed.send(sender=model, pks=list(deltas))
+    return updated
+
+
+def apply_author_deltas(model, deltas):
+    """
+    Переносит изменение рейтинга постов или комментариев на рейтинг авторов
+    """
+    from .models import Author
+
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        _update_ratings(Author, model.author_rating_deltas(deltas))
+
+
+def move_author_rating(before, after):
+    """
+    Переносит рейтинг между авторами: before и after — вклад объекта в
+    рейтинг авторов до и после изменения (rating_shares)
+    """
+    from .models import Author
+
+    deltas = Counter(after)
+    deltas.subtract(before)
+    _update_ratings(Author, deltas)
+
+
+def _update_ratings(model, deltas):
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    items = list(deltas.items())
+    # рейтинг виден на странице поста: её Last-Modified тоже меняется
+    touch = {'updated_at': Now()} if any(field.name == 'updated_at' for field in model._meta.fields) else {}
+    updated = 0
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = dict(items[start:start + FLUSH_BATCH_SIZE])
+        if len(batch) == 1:
+            increment = Value(next(iter(batch.values())))
+        else:
+            increment = Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in batch.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        updated += model.objects.filter(pk__in=batch).update(rating=F('rating') + increment, **touch)
+    return updated
+
+
+def annotate_computed_rating(authors):
+    """
+    Добавляет к авторам поле computed_rating, посчитанное одним запросом:
+    утроенный рейтинг постов, рейтинг комментариев автора и рейтинг
+    комментариев к его постам
+    """
+    from .models import Comment, Post
+
+    def rating_sum(queryset, field, outer='pk'):
+        totals = queryset.filter(**{field: OuterRef(outer)}).order_by().values(field).annotate(total=Sum('rating'))
+        return Coalesce(Subquery(totals.values('total')), 0)
+
+    return authors.annotate(computed_rating=(
+        Post.AUTHOR_RATING_WEIGHT * rating_sum(Post.objects.all(), 'author')
+        + rating_sum(Comment.objects.all(), 'user', outer='user_id')
+        + rating_sum(Comment.objects.all(), 'post__author')
+    ))
+
+
+def _ready_tail(model, head, tail, found):
+    """
+    Последний номер очереди, до которого все ячейки записаны.
+
+    _enqueue сначала получает номер, а потом пишет ячейку: если сброс
+    пришёл между ними, head не должен перескочить пустую ячейку, иначе
+    объект из неё не попадёт в базу. Ячейка, пустая и при следующем
+    сбросе, считается потерянной (процесс упал между incr и set)
+    """
+    gap_key = _key(model, 'queue', 'gap')
+    for seq in range(head + 1, tail + 1):
+        if _key(model, 'queue', seq) in found:
+            continue
+        if cache.get(gap_key) != seq:
+            cache.set(gap_key, seq, timeout=None)
+            return seq - 1
+        logger.warning(f"Пропущена незаписанная ячейка {seq} очереди рейтингов {model._meta.label}")
+    return tail
+
+
+def flush(model):
+    """
+    Сбрасывает буфер голосов модели в базу. Возвращает число обновлённых объектов
+    """
+    lock_key = _key(model, 'flush-lock')
+    if not cache.add(lock_key, 1, timeout=60):
+        return 0
+
+    try:
+        head_key = _key(model, 'queue', 'head')
+        head = cache.get(head_key, 0)
+        tail = cache.get(_key(model, 'queue', 'tail'), 0)
+        if tail <= head:
+            return 0
+
+        found = cache.get_many([_key(model, 'queue', seq) for seq in range(head + 1, tail + 1)])
+        tail = _ready_tail(model, head, tail, found)
+        if tail <= head:
+            return 0
+        slots = [_key(model, 'queue', seq) for seq in range(head + 1, tail + 1)]
+        deltas = {}
+        requeue = []
+        for pk in {found[slot] for slot in slots if slot in found}:
+            delta = cache.get(_key(model, 'delta', pk), 0)
+            if delta:
+                cache.decr(_key(model, 'delta', pk), delta)
+                deltas[pk] = delta
+            pending = cache.get(_key(model, 'pending', pk), 0)
+            # Голоса, пришедшие во время сброса, уйдут в следующий раз
+            if pending and cache.decr(_key(model, 'pending', pk), pending) > 0:
+                requeue.append(pk)
+
+        cache.delete_many(slots)
+        cache.set(head_key, tail, timeout=None)
+
+        try:
+            updated = apply_deltas(model, deltas)
+        except Exception:
+            logger.exception(f"Не удалось сбросить рейтинги {model._meta.label}, голоса возвращены в буфер")
+            for pk, delta in deltas.items():
+                incr(cache, _key(model, 'delta', pk), delta)
+            requeue = set(requeue) | set(deltas)
+            raise
+        finally:
+            for pk in requeue:
+                _enqueue(model, pk)
+
+        return updated
+    finally:
+        cache.delete(lock_key)
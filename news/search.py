@@ -0,0 +1,173 @@
+"""
+Полнотекстовый поиск постов на SQLite FTS5.
+
+Индекс news_post_fts хранит только токены заголовка и текста (external
+content): сами строки читаются из news_post. Синхронизацию при вставке,
+изменении и удалении постов делают триггеры, поэтому индекс не отстаёт
+даже при queryset.update() и удалении из админки.
+
+Токенизатор unicode61 приводит кириллицу к нижнему регистру, «ё» сводится
+к «е» ещё в триггерах. Слова запроса обрезаются до основы (грубый стеммер для русского) и
+ищутся по префиксу, так что «новостями» найдёт «новость» и «новости».
+На других СУБД поиск сводится к icontains по заголовку и тексту.
+"""
+import logging
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'news_post_fts'
+
+# Вес заголовка и текста в bm25: совпадение в заголовке важнее
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+def _fold(column):
+    # unicode61 не сводит «ё» к «е», поэтому это делается до индексации
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _indexed(row):
+    return f"{row}.id, {_fold(f'{row}.title')}, {_fold(f'{row}.content')}"
+
+
+TRIGGERS = [f'{FTS_TABLE}_insert', f'{FTS_TABLE}_delete', f'{FTS_TABLE}_update']
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON news_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES ({_indexed('new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON news_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', {_indexed('old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, content ON news_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', {_indexed('old')});
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES ({_indexed('new')});
+    END""",
+]
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, content,
+        content='news_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    *TRIGGERS_SQL,
+    f"INSERT INTO {FTS_TABLE}(rowid, title, content) SELECT {_indexed('news_post')} FROM news_post",
+]
+
+DROP_SQL = [
+    *(f'DROP TRIGGER IF EXISTS {name}' for name in TRIGGERS),
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+WORD_RE = re.compile(r'\w+')
+
+# Окончания русских слов от длинных к коротким
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ией',
+    'ов', 'ев', 'ей', 'ой', 'ый', 'ий', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ах', 'ях', 'ом', 'ем', 'ам', 'ям', 'ию', 'ия', 'ье', 'ья',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+MIN_STEM = 3
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def install(schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def install_triggers(schema_editor):
+    """
+    SQLite пересоздаёт news_post при AddField/AlterField и теряет триггеры:
+    миграции, меняющие таблицу, вызывают это после своих операций
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in TRIGGERS_SQL:
+            schema_editor.execute(sql)
+
+
+def missing_triggers(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'news_post'")
+        present = {row[0] for row in cursor.fetchall()}
+    return [name for name in TRIGGERS if name not in present]
+
+
+def repair_triggers(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Обработчик post_migrate: миграция, которая пересоздала news_post и не
+    вызвала install_triggers, оставляет индекс без синхронизации. Триггеры
+    ставятся заново, а индекс перестраивается по таблице, чтобы вернуть
+    изменения, сделанные без них
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite' or FTS_TABLE not in db.introspection.table_names():
+        return []
+    missing = missing_triggers(using)
+    if missing:
+        logger.warning(f"Триггеры поиска {', '.join(missing)} потеряны, индекс {FTS_TABLE} перестраивается")
+        with db.cursor() as cursor:
+            for sql in TRIGGERS_SQL:
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return missing
+
+
+def uninstall(schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match(query):
+    """
+    Превращает пользовательский запрос в выражение MATCH: все слова
+    обязательны и ищутся по префиксу основы
+    """
+    terms = [stem(word) for word in WORD_RE.findall(query)]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+def search_posts(queryset, query, ranked=True):
+    """
+    Оставляет в queryset посты, подходящие под запрос. С ranked=True
+    добавляет поле search_rank (меньше — релевантнее) и сортирует по нему
+    """
+    match = build_match(query)
+    if not match:
+        return queryset
+    if not is_available():
+        return queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+
+    if not ranked:
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,)))
+    # Соединение с индексом: MATCH выбирает строки, bm25 считается один раз на строку
+    return queryset.extra(
+        select={'search_rank': f'bm25({FTS_TABLE}, %s, %s)'},
+        select_params=(TITLE_WEIGHT, CONTENT_WEIGHT),
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = news_post.id'],
+        params=(match,),
+    ).order_by('search_rank', '-created_at', '-id')
+
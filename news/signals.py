@@ -1,17 +1,222 @@
-from django.db.models.signals import m2m_changed
+import logging
+
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import Post
-from .tasks import send_new_post_notification
+from django.contrib.auth.models import Group, User
+from django.utils import timezone
+from .models import Author, Category, Post, PostCategory, Comment, Subscription
+from . import outbox, page_cache, publishing, quota, ratings, summaries
+from .tasks import deliver_outbox
+
+logger = logging.getLogger(__name__)
+
 
 @receiver(m2m_changed, sender=Post.categories.through)
-def notify_subscribers_m2m(sender, instance, action, **kwargs):
+def notify_subscribers_m2m(sender, instance, action, reverse, pk_set, **kwargs):
     if action == "post_add":
-        print(f"🎯 M2M: категории добавлены к посту '{instance.title}'")
-        categories = instance.categories.all()
+        post_ids = pk_set if reverse else [instance.pk]
+        # строки очереди пишутся в транзакции поста, отправка — после коммита
+        queued = sum(outbox.enqueue_new_post(post_id) for post_id in post_ids)
+        publishing.dispatch_on_commit(deliver_outbox)
+        logger.info(f"Уведомления поставлены в очередь: {queued} (Post ID: {', '.join(map(str, post_ids))})")
+
+
+@receiver(pre_save, sender=Comment)
+@receiver(pre_save, sender=Post)
+def remember_rating_shares(sender, instance, update_fields=None, **kwargs):
+    # смена автора поста, автора или поста комментария переносит их рейтинг:
+    # вклад в рейтинг авторов запоминается до записи
+    if instance._state.adding or instance.pk is None:
+        return
+    fields = {*sender.RATING_OWNER_FIELDS, *(f'{name}_id' for name in sender.RATING_OWNER_FIELDS), 'rating'}
+    if update_fields is None or fields & set(update_fields):
+        instance._rating_shares = sender.rating_shares(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Post)
+def add_author_rating(sender, instance, created, **kwargs):
+    if created and instance.rating:
+        ratings.apply_author_deltas(sender, {instance.pk: instance.rating})
+    before = instance.__dict__.pop('_rating_shares', None)
+    if not created and before is not None:
+        ratings.move_author_rating(before, sender.rating_shares(instance.pk))
+
+
+@receiver(pre_delete, sender=Comment)
+@receiver(pre_delete, sender=Post)
+def remove_author_rating(sender, instance, **kwargs):
+    # pre_delete: строки ещё в базе, и авторов можно найти по ним
+    if instance.rating:
+        ratings.apply_author_deltas(sender, {instance.pk: -instance.rating})
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    category_ids = PostCategory.objects.filter(post_id=instance.pk).values_list('category_id', flat=True)
+    page_cache.bump(
+        page_cache.LIST,
+        page_cache.post_scope(instance.pk),
+        *[page_cache.category_scope(pk) for pk in category_ids],
+    )
+
+
+@receiver(post_save, sender=PostCategory)
+@receiver(post_delete, sender=PostCategory)
+def invalidate_post_category_pages(sender, instance, **kwargs):
+    page_cache.bump(page_cache.LIST, page_cache.post_scope(instance.post_id), page_cache.category_scope(instance.category_id))
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def invalidate_post_categories_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.post_set if reverse else instance.categories
+        pk_set = set(related.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    post_ids, category_ids = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    page_cache.bump(
+        page_cache.LIST,
+        *map(page_cache.post_scope, post_ids),
+        *map(page_cache.category_scope, category_ids),
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, instance, **kwargs):
+    # Названия категорий есть в строках постов любой ленты и в автодополнении
+    category_ids = Category.objects.values_list('pk', flat=True)
+    page_cache.bump(
+        page_cache.LIST, page_cache.CATEGORIES,
+        page_cache.category_scope(instance.pk), *map(page_cache.category_scope, category_ids),
+    )
+
+
+def category_scopes(post_ids):
+    # ленты категорий, в которых показаны эти посты
+    category_ids = PostCategory.objects.filter(post_id__in=post_ids).values_list('category_id', flat=True).distinct()
+    return map(page_cache.category_scope, category_ids)
+
+
+def touch_posts(posts):
+    # Last-Modified страницы поста, когда меняется то, что на ней показано
+    posts.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Author)
+def invalidate_author_pages(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'rating'}:
+        return
+    posts = Post.objects.filter(author=instance)
+    post_ids = list(posts.values_list('pk', flat=True))
+    if post_ids:
+        touch_posts(posts)
+    # имя автора есть и в строках лент категорий
+    page_cache.bump(page_cache.LIST, *map(page_cache.post_scope, post_ids), *category_scopes(post_ids))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=User)
+def invalidate_author_choices(sender, instance, update_fields=None, **kwargs):
+    # автодополнение авторов: имена и is_staff; рейтинг и вход не влияют
+    if update_fields and set(update_fields) <= {'rating', 'last_login'}:
+        return
+    page_cache.bump(page_cache.AUTHORS)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    touch_posts(Post.objects.filter(pk=instance.post_id))
+    # число комментариев показано и в строках лент
+    page_cache.bump(page_cache.LIST, page_cache.post_scope(instance.post_id), *category_scopes([instance.post_id]))
+
+
+@receiver(ratings.ratings_changed)
+def invalidate_rated_pages(sender, pks, **kwargs):
+    if sender is Comment:
+        pks = list(Comment.objects.filter(pk__in=pks).values_list('post_id', flat=True).distinct())
+        touch_posts(Post.objects.filter(pk__in=pks))
+    if sender is Post:
+        # рейтинг поста показан и в строках лент
+        page_cache.bump(page_cache.LIST, *map(page_cache.post_scope, pks), *category_scopes(pks))
+    elif sender is Comment:
+        page_cache.bump(*map(page_cache.post_scope, pks))
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_fragments(sender, instance, **kwargs):
+    page_cache.bump(page_cache.user_scope(instance.user_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_fragments(sender, instance, action, reverse, pk_set, **kwargs):
+    # Баннер автора и кнопки по правам; reverse — изменение со стороны группы или права
+    if action == 'pre_clear':
+        pk_set = set((instance.user_set if reverse else User.objects.filter(pk=instance.pk)).values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    user_ids = pk_set if reverse else [instance.pk]
+    page_cache.bump(*map(page_cache.user_scope, user_ids))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_fragments(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    groups = Group.objects.filter(permissions__in=pk_set) if reverse else Group.objects.filter(pk=instance.pk)
+    user_ids = User.objects.filter(groups__in=groups).values_list('pk', flat=True).distinct()
+    page_cache.bump(*map(page_cache.user_scope, user_ids))
+
+
+@receiver(post_save, sender=Post)
+def refresh_post_summary(sender, instance, **kwargs):
+    summaries.refresh([instance.pk])
+
+
+@receiver(post_save, sender=PostCategory)
+@receiver(post_delete, sender=PostCategory)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def refresh_related_summary(sender, instance, signal, **kwargs):
+    summaries.refresh([instance.post_id], existing_only=signal is post_delete)
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def refresh_post_categories_summaries(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # после очистки связей посты категории уже не найти
+        instance._cleared_post_ids = list(instance.post_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        summaries.refresh(getattr(instance, '_cleared_post_ids', []) if reverse else [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        summaries.refresh(pk_set if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def refresh_author_summaries(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'rating'}:
+        return
+    summaries.refresh(Post.objects.filter(author=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_summaries(sender, instance, created, **kwargs):
+    if not created:
+        summaries.refresh(Post.objects.filter(categories=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Post)
+def count_post_quota(sender, instance, created, **kwargs):
+    if created:
+        quota.forget(instance.author_id)
 
-        if categories.count() == 0:
-            print("❌ Нет категорий - уведомления не отправляются")
-            return
 
-        send_new_post_notification.delay(instance.id)
-        print(f"✅ Уведомления должны отправиться (Post ID: {instance.id})")
+@receiver(post_delete, sender=Post)
+def reset_post_quota(sender, instance, **kwargs):
+    quota.forget(instance.author_id)
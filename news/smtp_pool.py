@@ -0,0 +1,105 @@
+"""
+Пул SMTP-соединений воркера.
+
+Без пула каждая задача уведомлений открывала своё соединение: TCP, TLS и
+авторизация на smtp.yandex.ru занимают больше времени, чем отправка
+небольшой пачки писем. Пул живёт в процессе воркера и отдаёт задачам уже
+открытые соединения.
+
+Соединение, пролежавшее без дела дольше SMTP_POOL_IDLE_TIMEOUT секунд,
+закрывается: сервер всё равно оборвёт его сам. Перед выдачей соединение
+проверяется командой NOOP, а сломанное после ошибки отправки
+закрывается вместо возврата в пул. Больше SMTP_POOL_SIZE простаивающих
+соединений процесс не держит. После fork пул дочернего процесса
+начинается пустым: сокеты родителя не переиспользуются.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('opened', 'reused', 'expired', 'broken')
+
+
+class ConnectionPool:
+    def __init__(self, factory):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.idle = []
+        self.pid = os.getpid()
+        self.stats = dict.fromkeys(METRICS, 0)
+
+    @property
+    def size(self):
+        return getattr(settings, 'SMTP_POOL_SIZE', 4)
+
+    @property
+    def idle_timeout(self):
+        return getattr(settings, 'SMTP_POOL_IDLE_TIMEOUT', 60)
+
+    def _take_idle(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle, self.pid = [], os.getpid()
+            return self.idle.pop() if self.idle else None
+
+    @staticmethod
+    def _healthy(connection):
+        smtp = getattr(connection, 'connection', None)
+        if smtp is None:
+            # не SMTP (locmem, console): проверять нечего
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии SMTP-соединения: {e}")
+
+    def acquire(self):
+        """
+        Открытое соединение: из пула, если есть живое, иначе новое
+        """
+        while (idle := self._take_idle()) is not None:
+            connection, released_at = idle
+            if time.monotonic() - released_at > self.idle_timeout:
+                self.stats['expired'] += 1
+            elif not self._healthy(connection):
+                self.stats['broken'] += 1
+            else:
+                self.stats['reused'] += 1
+                return connection
+            self._close(connection)
+        connection = self.factory()
+        connection.open()
+        self.stats['opened'] += 1
+        return connection
+
+    def release(self, connection):
+        """
+        Возвращает соединение в пул или закрывает, если пул полон
+        """
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append((connection, time.monotonic()))
+                return
+        self._close(connection)
+
+    def discard(self, connection):
+        self.stats['broken'] += 1
+        self._close(connection)
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self._close(connection)
@@ -0,0 +1,55 @@
+"""
+Сводки постов для лент (PostSummary).
+
+Лента раньше для каждой строки резала и цензурировала полный content,
+подтягивала автора и отдельным запросом категории. Теперь всё это
+считается один раз при изменении поста и хранится в одной строке, а
+ленты читают её вместо content.
+
+Сводка пересчитывается сигналами (news/signals.py) при сохранении поста,
+изменении его категорий, комментариев, имени автора и названий
+категорий. После правки словаря цензуры сводки пересчитываются командой
+refresh_summaries.
+"""
+from django.db.models import Count, Prefetch
+from django.utils.text import Truncator
+
+from . import censor
+from .models import Category, Post, PostSummary
+
+# как truncatewords:20 в прежних шаблонах лент
+PREVIEW_WORDS = 20
+
+FIELDS = ['title', 'preview', 'author_name', 'categories', 'comment_count']
+
+
+def summary_values(post, categories, comment_count):
+    engine = censor.get_censor()
+    return {
+        'title': engine.censor(post.title),
+        'preview': engine.censor(Truncator(post.content).words(PREVIEW_WORDS, truncate=' …')),
+        'author_name': post.author.name,
+        'categories': [[category.pk, category.name] for category in categories],
+        'comment_count': comment_count,
+    }
+
+
+def refresh(post_ids, batch_size=500, existing_only=False):
+    """
+    Пересчитывает сводки постов; удалённые посты пропускаются.
+
+    existing_only — только уже существующие сводки: при каскадном удалении
+    поста его комментарии и связи удаляются вместе с ним, и сводка не
+    должна появиться заново
+    """
+    posts = Post.objects.filter(pk__in=list(post_ids))
+    if existing_only:
+        posts = posts.filter(summary__isnull=False)
+    posts = posts.select_related('author').prefetch_related(
+        Prefetch('categories', queryset=Category.objects.order_by('pk')),
+    ).annotate(comments=Count('comment'))
+    summaries = [PostSummary(post=post, **summary_values(post, post.categories.all(), post.comments)) for post in posts]
+    PostSummary.objects.bulk_create(
+        summaries, batch_size=batch_size, update_conflicts=True, unique_fields=['post'], update_fields=FIELDS,
+    )
+    return len(summaries)
@@ -1,103 +1,89 @@
 from celery import shared_task
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from celery.signals import worker_process_shutdown
 from django.conf import settings
-from django.utils import timezone
-from datetime import timedelta
-from .models import Post, Category
+from .models import Post, Comment
+from . import digest, mailing, outbox, ratings
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@worker_process_shutdown.connect
+def close_smtp_connections(**kwargs):
+    # соединения пула живут между задачами и закрываются вместе с процессом
+    mailing.pool.close_all()
+
+
 @shared_task
-def send_new_post_notification(post_id):
+def deliver_outbox():
     """
-    Асинхронная отправка уведомлений о новом посте подписчикам
+    Раздаёт созревшие уведомления из исходящей очереди пачками: каждую
+    пачку отправляет отдельная задача через одно SMTP-соединение
     """
-    try:
-        post = Post.objects.get(id=post_id)
-        categories = post.categories.all()
-
-        for category in categories:
-            subscribers = category.subscribers.all()
-
-            for user in subscribers:
-                if user.email:
-                    html_content = render_to_string('account/email/new_post_notification.html', {
-                        'post': post,
-                        'user': user,
-                        'category': category,
-                    })
-
-                    msg = EmailMultiAlternatives(
-                        subject=f'Новая запись в разделе "{category.name}"',
-                        body=f'Здравствуй, {user.username}. Новая статья в твоём любимом разделе!\n\n'
-                             f'Заголовок: {post.title}\n'
-                             f'Текст: {post.content[:50]}...\n\n'
-                             f'Категория: {category.name}',
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        to=[user.email],
-                    )
-                    msg.attach_alternative(html_content, "text/html")
-                    msg.send()
-
-                    logger.info(f"Уведомление отправлено {user.email}")
-
-    except Post.DoesNotExist:
-        logger.error(f"Пост с ID {post_id} не найден")
-    except Exception as e:
-        logger.error(f"Ошибка отправки уведомления: {e}")
+    chunks = 0
+    while token := outbox.claim(getattr(settings, 'NOTIFICATION_CHUNK_SIZE', 100)):
+        send_outbox_chunk.delay(token)
+        chunks += 1
+    return chunks
 
 
 @shared_task
-def send_weekly_digest():
+def send_outbox_chunk(token):
     """
-    Еженедельная рассылка новых статей подписчикам
+    Отправляет пачку уведомлений, захваченную под token
     """
-    logger.info("Запуск еженедельной рассылки...")
-
-    week_ago = timezone.now() - timedelta(days=7)
-    total_emails = 0
-
-    for category in Category.objects.all():
-        new_posts = Post.objects.filter(
-            categories=category,
-            created_at__gte=week_ago
-        ).order_by('-created_at')
+    result = outbox.deliver(token)
+    logger.info(
+        f"Уведомления: отправлено {result['sent']}, ошибок {result['failed']}, "
+        f"пропущено {result['skipped']}, {result['duration']} с"
+    )
+    return result
 
-        if not new_posts:
-            continue
 
-        subscribers = category.subscribers.all()
-
-        for user in subscribers:
-            if user.email:
-                try:
-                    html_content = render_to_string('account/email/weekly_digest.html', {
-                        'user': user,
-                        'category': category,
-                        'posts': new_posts,
-                        'week_ago': week_ago,
-                    })
-
-                    msg = EmailMultiAlternatives(
-                        subject=f'📰 Еженедельная рассылка: {new_posts.count()} новых статей в разделе "{category.name}"',
-                        body=f'Здравствуй, {user.username}!\n\n'
-                             f'За неделю в разделе "{category.name}" появилось {new_posts.count()} новых статей.\n\n'
-                             f'Читайте на нашем портале: http://127.0.0.1:8000/news/\n\n'
-                             f'С уважением,\nNews Portal',
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        to=[user.email],
-                    )
-                    msg.attach_alternative(html_content, "text/html")
-                    msg.send()
-
-                    total_emails += 1
-                    logger.info(f"Еженедельная рассылка отправлена {user.email}")
+@shared_task
+def send_weekly_digest(period=None):
+    """
+    Еженедельная рассылка новых статей подписчикам: одно письмо на
+    подписчика по всем его категориям, пачками через одно SMTP-соединение.
+    Прерванный запуск за ту же неделю продолжается с места остановки
+    """
+    period = period or digest.current_period()
+    token = digest.acquire_lock(period)
+    if token is None:
+        logger.warning("Еженедельная рассылка уже идёт в другом воркере")
+        return "Рассылка уже идёт"
+    try:
+        run = digest.open_run(period)
+        if run.finished_at:
+            logger.info(f"Еженедельная рассылка {run.period} уже завершена")
+            return f"Отправлено писем: {run.sent}"
+        if run.last_user_id:
+            logger.info(f"Продолжение рассылки {run.period} после пользователя {run.last_user_id}")
+        else:
+            logger.info(f"Запуск еженедельной рассылки {run.period}...")
+
+        week = digest.Digest(run.since)
+        for batch in mailing.chunks(week.recipients(after=run.last_user_id)):
+            messages = [(user.pk, week.message(user, category_ids)) for user, category_ids in batch]
+            for user_id, error in mailing.send_each([item for item in messages if item[1]], limits=('digest', 'smtp')):
+                digest.checkpoint(run, user_id, error)
+            digest.save_progress(run)
+            digest.refresh_lock(period, token)
+            logger.info(f"Еженедельная рассылка {run.period}: отправлено {run.sent}, ошибок {run.failed}")
+        digest.finish_run(run)
+    finally:
+        digest.release_lock(period, token)
+
+    logger.info(f"Еженедельная рассылка {run.period} завершена. Отправлено писем: {run.sent}, ошибок: {run.failed}")
+    return f"Отправлено писем: {run.sent}"
 
-                except Exception as e:
-                    logger.error(f"Ошибка еженедельной рассылки: {e}")
 
-    logger.info(f"Еженедельная рассылка завершена. Отправлено писем: {total_emails}")
-    return f"Отправлено писем: {total_emails}"
+@shared_task
+def flush_rating_buffers():
+    """
+    Сброс накопленных в кеше голосов за горячие посты и комментарии
+    """
+    updated = sum(ratings.flush(model) for model in (Post, Comment))
+    if updated:
+        logger.info(f"Сброшены рейтинги объектов: {updated}")
+    return updated
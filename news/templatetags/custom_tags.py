@@ -1,6 +1,9 @@
 from datetime import datetime
 
 from django import template
+from django.utils.safestring import mark_safe
+
+from ..fragments import marker
 
 
 register = template.Library()
@@ -14,5 +17,16 @@ def current_time(format_string='%m %d %Y H:i'):
 def url_replace(context, **kwargs):
    d = context['request'].GET.copy()
    for k, v in kwargs.items():
-       d[k] = v
-   return d.urlencode()
\ No newline at end of file
+       if v is None:
+           d.pop(k, None)
+       else:
+           d[k] = v
+   return d.urlencode()
+
+@register.simple_tag()
+def fragment(name, *args):
+   """
+   Метка пользовательского фрагмента: страница с ней кешируется одна на
+   всех, а фрагмент подставляет news.fragments.FragmentMiddleware
+   """
+   return mark_safe(marker(name, *args))
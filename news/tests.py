@@ -1,3 +1,1645 @@
-from django.test import TestCase
+import os
+import re
+import smtplib
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management import call_command, CommandError
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date, urlencode
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.http import Http404
+from django.urls import reverse
+from django.template.loader import render_to_string
+
+from project.celery import app as celery_app
+
+from . import (
+    autocomplete, censor, digest, mailing, moderation, outbox, page_cache, publishing, quota, ratings, search, smtp_pool,
+    tasks, throttle,
+)
+from .cache_backends import TwoTierCache, has_atomic_counters
+from .pagination import CursorPaginator
+from .templatetags import censor_filter
+from .filters import PostFilter
+from .forms import PostForm
+from .models import (
+    Author, Category, Comment, Delivery, DigestRun, ModerationFlag, ModerationScan, Post, PostSummary, Subscription,
+)
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'news-tests',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MAIL_RATE_LIMITS={})
+class NewsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # задачи Celery выполняются сразу, без брокера
+        cls.addClassCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.author = Author.objects.create(user=cls.user, name='Автор')
+        cls.category = Category.objects.create(name='Спорт')
+
+    def setUp(self):
+        cache.clear()
+        mailing.pool.close_all()
+
+    def create_post(self, title='Заголовок', post_type=Post.NEWS, **kwargs):
+        kwargs.setdefault('content', 'Текст новости ' * 10)
+        return Post.objects.create(author=self.author, title=title, post_type=post_type, **kwargs)
+
+
+class RatingTests(NewsTestCase):
+    @override_settings(RATING_HOT_THRESHOLD=0)
+    def test_votes_are_atomic_increments(self):
+        post = self.create_post()
+        stale = Post.objects.get(pk=post.pk)
+        post.like()
+        post.like()
+        stale.dislike()
+
+        self.assertEqual(post.rating, 2)
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 1)
+
+    @override_settings(RATING_HOT_THRESHOLD=0)
+    def test_vote_updates_only_rating(self):
+        post = self.create_post()
+        # два UPDATE и категории поста для сброса их лент
+        with self.assertNumQueries(4) as ctx:
+            post.like()
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertIn('"news_post"', updates[0])
+        self.assertNotIn('"content"', updates[0])
+        self.assertIn('"news_author"', updates[1])
+
+    @override_settings(RATING_HOT_THRESHOLD=2)
+    def test_hot_post_votes_are_buffered_and_flushed(self):
+        post = self.create_post()
+        comment = Comment.objects.create(post=post, user=self.user, content='Комментарий')
+        for _ in range(5):
+            post.like()
+        comment.dislike()
+
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 2)
+        self.assertEqual(ratings.pending_delta(Post, post.pk), 3)
+
+        with self.assertNumQueries(4):
+            self.assertEqual(ratings.flush(Post), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 5)
+        self.assertEqual(ratings.pending_delta(Post, post.pk), 0)
+
+        post.like()
+        ratings.flush(Post)
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 6)
+        comment.refresh_from_db()
+        self.assertEqual(comment.rating, -1)
+
+
+    @override_settings(RATING_HOT_THRESHOLD=1)
+    def test_flush_does_not_skip_slot_being_enqueued(self):
+        post = self.create_post()
+        other = self.create_post('Другой пост')
+        post.like()
+        post.like()
+        # другой процесс получил номер в очереди, но ещё не записал ячейку
+        seq = cache.incr(ratings._key(Post, 'queue', 'tail'))
+        cache.set(ratings._key(Post, 'delta', other.pk), 4)
+        cache.set(ratings._key(Post, 'pending', other.pk), 1)
+
+        self.assertEqual(ratings.flush(Post), 1)
+        cache.set(ratings._key(Post, 'queue', seq), other.pk)
+        self.assertEqual(ratings.flush(Post), 1)
+        other.refresh_from_db()
+        self.assertEqual(other.rating, 4)
+
+    @override_settings(RATING_HOT_THRESHOLD=1)
+    def test_lost_slot_does_not_block_queue(self):
+        post = self.create_post()
+        # номер 1 выдан процессу, который упал, не записав ячейку
+        cache.set(ratings._key(Post, 'queue', 'tail'), 1)
+        post.like()
+        post.like()
+
+        self.assertEqual(ratings.flush(Post), 0)
+        with self.assertLogs('news.ratings', 'WARNING'):
+            self.assertEqual(ratings.flush(Post), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 2)
+
+    @override_settings(RATING_HOT_THRESHOLD=1)
+    def test_votes_are_not_buffered_without_atomic_cache(self):
+        post = self.create_post()
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp},
+        }))
+        with mock.patch.object(ratings, 'incr') as incr:
+            for _ in range(3):
+                post.like()
+        incr.assert_not_called()
+        post.refresh_from_db()
+        self.assertEqual(post.rating, 3)
+
+
+@override_settings(RATING_HOT_THRESHOLD=0)
+class AuthorRatingTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        reader = User.objects.create_user('reader')
+        self.reader_author = Author.objects.create(user=reader, name='Читатель')
+        self.post = self.create_post()
+        self.comment = Comment.objects.create(post=self.post, user=reader, content='Комментарий')
+
+    def assertRatingsConsistent(self):
+        for author in (self.author, self.reader_author):
+            author.refresh_from_db()
+            stored = author.rating
+            author.update_rating()
+            self.assertEqual(stored, author.rating)
+
+    def test_rating_changes_are_applied_to_authors(self):
+        self.post.like()
+        self.post.like()
+        self.comment.like()
+        self.author.refresh_from_db()
+        self.reader_author.refresh_from_db()
+        self.assertEqual(self.author.rating, 2 * 3 + 1)
+        self.assertEqual(self.reader_author.rating, 1)
+
+        Comment.objects.create(post=self.post, user=self.user, content='Ещё', rating=4)
+        self.assertRatingsConsistent()
+
+        self.comment.delete()
+        self.assertRatingsConsistent()
+
+        self.post.delete()
+        self.assertRatingsConsistent()
+
+    def test_reassigned_post_and_comment_move_rating(self):
+        self.post.like()
+        self.comment.like()
+        self.comment.like()
+
+        self.post.author = self.reader_author
+        self.post.save()
+        self.author.refresh_from_db()
+        self.reader_author.refresh_from_db()
+        self.assertEqual((self.author.rating, self.reader_author.rating), (0, 3 + 2 + 2))
+        self.assertRatingsConsistent()
+
+        other_post = self.create_post(title='Другой пост')
+        self.comment.user = self.user
+        self.comment.post = other_post
+        self.comment.save()
+        self.assertRatingsConsistent()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.rating, 2 + 2)
+
+        # сохранение без полей владельца не читает вклад из базы
+        with mock.patch.object(Comment, 'rating_shares') as rating_shares:
+            self.comment.save(update_fields=['content'])
+        rating_shares.assert_not_called()
+
+    def test_recompute_ratings_command(self):
+        self.post.like()
+        Author.objects.update(rating=100)
+
+        with self.assertRaises(CommandError):
+            call_command('recompute_ratings', '--check', stdout=StringIO())
+
+        # SELECT с подзапросами и UPDATE, обёрнутые в точку сохранения
+        with self.assertNumQueries(4):
+            call_command('recompute_ratings', stdout=StringIO())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.rating, 3)
+        call_command('recompute_ratings', '--check', stdout=StringIO())
+
+
+class QueryPlanTests(NewsTestCase):
+    """
+    Горячие запросы не должны сканировать таблицы целиком
+    """
+    def query_plan(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, queryset, ordered=False):
+        sql, params = queryset.query.sql_with_params()
+        plan = self.query_plan(sql, params)
+        for step in plan:
+            self.assertFalse(step.startswith('SCAN '), f'Полный просмотр таблицы: {plan}\n{sql}')
+            if ordered:
+                self.assertNotIn('TEMP B-TREE', step, f'Сортировка без индекса: {plan}\n{sql}')
+
+    def test_news_and_articles_lists(self):
+        for post_type in (Post.NEWS, Post.ARTICLE):
+            queryset = Post.objects.filter(post_type=post_type).order_by('-created_at', '-id')
+            self.assertUsesIndexes(queryset[:10], ordered=True)
+
+    def test_category_filter(self):
+        queryset = Post.objects.filter(post_type=Post.NEWS).order_by('-created_at')
+        filterset = PostFilter({'category': self.category.pk}, queryset)
+        self.assertUsesIndexes(filterset.qs[:10])
+
+    def test_subscription_lookups(self):
+        self.assertUsesIndexes(Subscription.objects.filter(user=self.user, category=self.category))
+        self.assertUsesIndexes(self.category.subscribers.all())
+        self.assertUsesIndexes(self.user.subscribed_categories.values('pk'))
+
+    def test_daily_post_limit(self):
+        data = {
+            'title': 'Заголовок',
+            'content': 'Текст новости ' * 10,
+            'author': self.author.pk,
+            'categories': [self.category.pk],
+            'post_type': Post.NEWS,
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            PostForm(data).is_valid()
+        posts = [query['sql'] for query in ctx.captured_queries if 'FROM "news_post"' in query['sql']]
+        self.assertEqual(len(posts), 1)
+        self.assertFalse([step for step in self.query_plan(posts[0]) if step.startswith('SCAN ')])
+
+        # счётчики уже в кеше: база не читается
+        with CaptureQueriesContext(connection) as ctx:
+            PostForm(data).is_valid()
+        self.assertFalse([query for query in ctx.captured_queries if 'FROM "news_post"' in query['sql']])
+
+    def test_autocomplete_prefix_search(self):
+        self.assertUsesIndexes(autocomplete.prefix_search(Category.objects.all(), 'спо')[:21], ordered=True)
+        authors = Author.objects.filter(user__is_staff=False)
+        self.assertUsesIndexes(autocomplete.prefix_search(authors, 'авт')[:21], ordered=True)
+
+    def test_cursor_page(self):
+        post = self.create_post()
+        queryset = Post.objects.filter(post_type=Post.NEWS).order_by('-created_at', '-id')
+        queryset = queryset.filter(created_at__lte=post.created_at).exclude(created_at=post.created_at, pk__gte=post.pk)
+        self.assertUsesIndexes(queryset[:11], ordered=True)
+
+    def test_post_comments(self):
+        post = self.create_post()
+        self.assertUsesIndexes(post.comment_set.order_by('created_at'), ordered=True)
+
+
+class PostListQueryTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        Subscription.objects.create(user=self.user, category=self.category)
+
+    def add_posts(self, count, subscribers):
+        categories = [Category.objects.create(name=f'Категория {Category.objects.count()}') for _ in range(2)]
+        for index in range(subscribers):
+            user = User.objects.create_user(f'reader{User.objects.count()}')
+            for category in categories:
+                Subscription.objects.create(user=user, category=category)
+        for index in range(count):
+            for post_type in (Post.NEWS, Post.ARTICLE):
+                post = self.create_post(post_type=post_type)
+                post.categories.add(self.category, *categories)
+
+    def assertQueriesDoNotGrow(self, url, expected):
+        # COUNT и посты со сводками; во фрагментах —
+        # сессия, пользователь, права, группы и подписки пользователя
+        self.add_posts(2, subscribers=1)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+        cache.clear()
+        self.add_posts(10, subscribers=20)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_news_list(self):
+        response = self.assertQueriesDoNotGrow(reverse('news_list'), 8)
+        self.assertContains(response, reverse('unsubscribe_category', args=[self.category.pk]))
+
+    def test_articles_list(self):
+        self.assertQueriesDoNotGrow(reverse('articles_list'), 7)
+
+    def test_search(self):
+        self.assertQueriesDoNotGrow(reverse('news_search'), 2)
+
+    def test_lists_do_not_read_content(self):
+        self.add_posts(2, subscribers=1)
+        for url in (reverse('news_list'), reverse('articles_list'), reverse('news_search')):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            post_queries = [query['sql'] for query in queries if 'FROM "news_post"' in query['sql']]
+            self.assertTrue(post_queries)
+            for sql in post_queries:
+                self.assertNotIn('"news_post"."content"', sql)
+
+
+
+@override_settings(AUTOCOMPLETE_PAGE_SIZE=2)
+class AutocompleteTests(NewsTestCase):
+    def get(self, name, **params):
+        return self.client.get(reverse(name), params).json()
+
+    def test_prefix_search_pages(self):
+        for name in ('Спортзал', 'Культура', 'спорт в школе'):
+            Category.objects.create(name=name)
+        found = self.get('category_autocomplete', q='СПО')
+        self.assertEqual([item['text'] for item in found['results']], ['Спорт', 'спорт в школе'])
+        self.assertTrue(found['more'])
+        found = self.get('category_autocomplete', q='спо', page=2)
+        self.assertEqual(found, {'results': [{'id': Category.objects.get(name='Спортзал').pk, 'text': 'Спортзал'}],
+                                 'more': False})
+        self.assertEqual(self.get('category_autocomplete', q='xyz'), {'results': [], 'more': False})
+
+    def test_staff_authors_are_excluded_for_post_form(self):
+        staff = User.objects.create_user('editor', is_staff=True)
+        Author.objects.create(user=staff, name='Автор-редактор')
+        self.assertEqual(len(self.get('author_autocomplete', q='автор')['results']), 2)
+        self.assertEqual([item['text'] for item in self.get('author_autocomplete', q='автор', staff='0')['results']],
+                         ['Автор'])
+
+    def test_answers_are_cached_until_change(self):
+        self.get('category_autocomplete', q='сп')
+        with self.assertNumQueries(0):
+            self.get('category_autocomplete', q='сп')
+        self.category.name = 'Спорт и отдых'
+        self.category.save()
+        self.assertEqual(self.get('category_autocomplete', q='сп')['results'][0]['text'], 'Спорт и отдых')
+
+        self.get('author_autocomplete', q='ав')
+        self.author.name = 'Автор статей'
+        self.author.save(update_fields=['name'])
+        self.assertEqual(self.get('author_autocomplete', q='ав')['results'][0]['text'], 'Автор статей')
+        self.assertEqual(Author.objects.get().search_name, 'автор статей')
+
+    def test_forms_render_only_selected_choices(self):
+        for index in range(30):
+            Category.objects.create(name=f'Раздел {index}')
+        # проверка выбранного значения и его подпись, остальные не читаются
+        with self.assertNumQueries(2):
+            html = PostFilter({'category': self.category.pk}, Post.objects.all()).form.as_p()
+        self.assertIn('Спорт', html)
+        self.assertIn('Все категории', html)
+        self.assertNotIn('Раздел', html)
+        self.assertIn(reverse('category_autocomplete'), html)
+
+        with self.assertNumQueries(0):
+            html = PostForm().as_p()
+        self.assertIn(f'{reverse("author_autocomplete")}?staff=0', html)
+        self.assertNotIn('Раздел', html)
+        self.assertIn('js/autocomplete.js', str(PostForm().media))
+
+class PostSummaryTests(NewsTestCase):
+    def summary(self, post):
+        return PostSummary.objects.get(post=post)
+
+    def test_summary_follows_post_and_related_changes(self):
+        post = self.create_post(title='Урод дня', content='слово ' * 30)
+        post.categories.add(self.category)
+        summary = self.summary(post)
+        self.assertEqual(summary.title, 'У*** дня')
+        self.assertEqual(summary.preview, 'слово ' * 19 + 'слово …')
+        self.assertEqual(summary.author_name, 'Автор')
+        self.assertEqual(summary.categories, [[self.category.pk, 'Спорт']])
+        self.assertEqual(summary.comment_count, 0)
+
+        culture = Category.objects.create(name='Культура')
+        culture.post_set.add(post)
+        Comment.objects.create(post=post, user=self.user, content='Комментарий')
+        self.author.name = 'Новый автор'
+        self.author.save()
+        self.category.name = 'Спорт и отдых'
+        self.category.save()
+        summary = self.summary(post)
+        self.assertEqual(summary.author_name, 'Новый автор')
+        self.assertEqual(summary.categories, [[self.category.pk, 'Спорт и отдых'], [culture.pk, 'Культура']])
+        self.assertEqual(summary.comment_count, 1)
+
+        culture.post_set.clear()
+        post.comment_set.all().delete()
+        post.title = 'Другой заголовок'
+        post.save()
+        summary = self.summary(post)
+        self.assertEqual(summary.title, 'Другой заголовок')
+        self.assertEqual(summary.categories, [[self.category.pk, 'Спорт и отдых']])
+        self.assertEqual(summary.comment_count, 0)
+
+        Comment.objects.create(post=post, user=self.user, content='Комментарий')
+        post.delete()
+        self.assertFalse(PostSummary.objects.exists())
+
+    def test_command_rebuilds_summaries(self):
+        posts = [self.create_post(title=f'Новость {index}') for index in range(3)]
+        PostSummary.objects.all().delete()
+        scopes = [page_cache.LIST, page_cache.category_scope(self.category.pk)]
+        before = page_cache.generations(scopes)
+        out = StringIO()
+        call_command('refresh_summaries', stdout=out)
+        self.assertEqual(PostSummary.objects.count(), 3)
+        self.assertTrue(all(old != new for old, new in zip(before, page_cache.generations(scopes))))
+        self.assertEqual(self.summary(posts[1]).title, 'Новость 1')
+        self.assertIn('3', out.getvalue())
+
+
+@override_settings(POST_LIST_PAGINATION='cursor')
+class CursorPaginationTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        other = Category.objects.create(name='Политика')
+        created_at = timezone.now()
+        self.posts = []
+        for index in range(25):
+            post = self.create_post(title=f'Новость {index}')
+            post.categories.add(self.category if index % 2 else other)
+            self.posts.append(post)
+        # часть постов с одинаковой датой, чтобы проверить разбор по id
+        Post.objects.update(created_at=created_at)
+
+    def walk(self, url, **params):
+        titles = []
+        response = self.client.get(url, params)
+        while True:
+            titles += [post.title for post in response.context['news']]
+            page = response.context['page_obj']
+            if not page.has_next():
+                return titles, response
+            response = self.client.get(url, {**params, 'cursor': page.next_cursor})
+
+    def test_pages_cover_list_once_in_order(self):
+        titles, response = self.walk(reverse('news_list'))
+        self.assertEqual(titles, [f'Новость {index}' for index in reversed(range(25))])
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = self.client.get(reverse('news_list'))
+        second = self.client.get(reverse('news_list'), {'cursor': first.context['page_obj'].next_cursor})
+        back = self.client.get(reverse('news_list'), {'cursor': second.context['page_obj'].previous_cursor})
+        self.assertEqual(list(back.context['news']), list(first.context['news']))
+        self.assertFalse(back.context['page_obj'].has_previous())
+
+    def test_filter_is_applied(self):
+        titles, _ = self.walk(reverse('news_list'), category=self.category.pk)
+        self.assertEqual(titles, [f'Новость {index}' for index in reversed(range(1, 25, 2))])
+
+    def test_links_and_no_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('news_list'), {'page': 1})
+        self.assertFalse([query for query in ctx.captured_queries if 'COUNT(' in query['sql']])
+        cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'?{urlencode({"cursor": cursor})}"')
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(reverse('news_list'), {'cursor': 'bad'}).status_code, 404)
+        with self.assertRaises(Http404):
+            CursorPaginator(Post.objects.all(), 10).page('bad')
+
+
+class SearchTests(NewsTestCase):
+    def search(self, query):
+        return [post.title for post in search.search_posts(Post.objects.all(), query)]
+
+    def test_index_follows_create_update_delete(self):
+        post = self.create_post(title='Выборы мэра', content='Итоги голосования ' * 10)
+        self.assertEqual(self.search('выборы'), ['Выборы мэра'])
+
+        post.title = 'Футбольный матч'
+        post.save()
+        self.assertEqual(self.search('выборы'), [])
+        self.assertEqual(self.search('футбольный'), ['Футбольный матч'])
+
+        Post.objects.filter(pk=post.pk).update(content='Сборная забила гол ' * 10)
+        self.assertEqual(self.search('голосования'), [])
+        self.assertEqual(self.search('гол'), ['Футбольный матч'])
+
+        post.delete()
+        self.assertEqual(self.search('футбольный'), [])
+
+    def test_russian_forms_and_prefixes(self):
+        self.create_post(title='Новости спорта', content='Ёлка на главной площади ' * 10)
+        self.assertEqual(self.search('новостями'), ['Новости спорта'])
+        self.assertEqual(self.search('елки'), ['Новости спорта'])
+        self.assertEqual(self.search('спор'), ['Новости спорта'])
+        self.assertEqual(self.search('спорт площадь'), ['Новости спорта'])
+        self.assertEqual(self.search('спорт театр'), [])
+
+    def test_triggers_exist_after_migrate(self):
+        self.assertEqual(search.missing_triggers(), [])
+
+    def test_lost_triggers_are_repaired_after_migrate(self):
+        post = self.create_post(title='Выборы мэра')
+        with connection.cursor() as cursor:
+            for name in search.TRIGGERS:
+                cursor.execute(f'DROP TRIGGER {name}')
+        Post.objects.filter(pk=post.pk).update(title='Футбольный матч')
+
+        with self.assertLogs('news.search', 'WARNING'):
+            self.assertEqual(search.repair_triggers(), search.TRIGGERS)
+        self.assertEqual(search.missing_triggers(), [])
+        self.assertEqual(self.search('футбольный'), ['Футбольный матч'])
+        self.assertEqual(self.search('выборы'), [])
+        self.assertEqual(search.repair_triggers(), [])
+
+    def test_title_matches_rank_first(self):
+        self.create_post(title='Погода', content='Синоптики обсуждали дожди, ветер и экономику региона')
+        self.create_post(title='Экономика', content='Синоптики обсуждали курс валют и погоду на неделю')
+        self.assertEqual(self.search('экономика'), ['Экономика', 'Погода'])
+
+    @override_settings(POST_LIST_PAGINATION='cursor')
+    def test_search_view_keeps_rank_order_with_cursor_pagination(self):
+        self.create_post(title='Экономика', content='Синоптики обсуждали курс валют и погоду на неделю')
+        self.create_post(title='Погода', content='Синоптики обсуждали дожди, ветер и экономику региона')
+        response = self.client.get(reverse('news_search'), {'title': 'экономика'})
+        self.assertEqual([post.title for post in response.context['news']], ['Экономика', 'Погода'])
+        self.assertEqual(response.context['page_obj'].number, 1)
+        # без запроса поиск — обычная лента по дате с курсором
+        response = self.client.get(reverse('news_search'))
+        self.assertEqual([post.title for post in response.context['news']], ['Погода', 'Экономика'])
+        self.assertIsNone(response.context['page_obj'].number)
+
+    def test_search_view_uses_content(self):
+        self.create_post(title='Погода', content='Обсуждали экономику ' * 10)
+        response = self.client.get(reverse('news_search'), {'title': 'экономике'})
+        self.assertEqual([post.title for post in response.context['news']], ['Погода'])
+
+
+class PageCacheTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post(title='Старый заголовок')
+        self.post.categories.add(self.category)
+
+    def assertCachedPage(self, url, queries=0, **params):
+        self.client.get(url, params)
+        with self.assertNumQueries(queries):
+            return self.client.get(url, params)
+
+    def assertCachedDetail(self, url):
+        # из базы читается только updated_at для Last-Modified
+        return self.assertCachedPage(url, queries=1)
+
+    def test_detail_is_cached_until_post_or_comment_changes(self):
+        url = reverse('post_detail', args=[self.post.pk])
+        self.assertCachedDetail(url)
+
+        Comment.objects.create(post=self.post, user=self.user, content='Свежий комментарий')
+        self.assertContains(self.client.get(url), 'Свежий комментарий')
+
+        self.post.title = 'Новый заголовок'
+        self.post.save()
+        self.assertContains(self.assertCachedDetail(url), 'Новый заголовок')
+
+    def test_lists_are_invalidated_by_new_posts(self):
+        self.assertCachedPage(reverse('news_list'))
+        self.create_post(title='Срочная новость')
+        self.assertContains(self.client.get(reverse('news_list')), 'Срочная новость')
+
+    def test_category_list_ignores_other_categories(self):
+        other = Category.objects.create(name='Культура')
+        url = reverse('news_list')
+        self.assertCachedPage(url, category=self.category.pk)
+
+        post = self.create_post(title='Премьера')
+        post.categories.add(other)
+        with self.assertNumQueries(0):
+            self.client.get(url, {'category': self.category.pk})
+
+        post.categories.add(self.category)
+        self.assertContains(self.client.get(url, {'category': self.category.pk}), 'Премьера')
+
+    @override_settings(RATING_HOT_THRESHOLD=0)
+    def test_votes_invalidate_detail(self):
+        url = reverse('post_detail', args=[self.post.pk])
+        self.assertCachedDetail(url)
+        self.post.like()
+        self.assertContains(self.client.get(url), 'Рейтинг:</strong> 1')
+
+    def test_author_rename_invalidates_category_lists(self):
+        for params in ({}, {'category': self.category.pk}):
+            self.assertCachedPage(reverse('news_list'), **params)
+        self.author.name = 'Переименованный автор'
+        self.author.save()
+        for params in ({}, {'category': self.category.pk}):
+            self.assertContains(self.client.get(reverse('news_list'), params), 'Переименованный автор')
+
+    def test_comments_invalidate_lists(self):
+        for params in ({}, {'category': self.category.pk}):
+            self.assertCachedPage(reverse('news_list'), **params)
+        for _ in range(3):
+            Comment.objects.create(post=self.post, user=self.user, content='Комментарий')
+        for params in ({}, {'category': self.category.pk}):
+            self.assertContains(self.client.get(reverse('news_list'), params), '<td>3</td>')
+
+    @override_settings(RATING_HOT_THRESHOLD=0)
+    def test_post_votes_invalidate_lists(self):
+        for params in ({}, {'category': self.category.pk}):
+            self.assertCachedPage(reverse('news_list'), **params)
+        etag = self.client.get(reverse('news_list'))['ETag']
+        for _ in range(2):
+            self.post.like()
+        for params in ({}, {'category': self.category.pk}):
+            response = self.client.get(reverse('news_list'), params, headers={'if_none_match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '<td>2</td>')
+
+
+class ConditionalGetTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post()
+        self.post.categories.add(self.category)
+        # страница «устарела» на час: изменения ниже точно новее If-Modified-Since
+        self.past = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        Post.objects.filter(pk=self.post.pk).update(updated_at=self.past)
+
+    def assertNotModified(self, url, queries=0, **headers):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.templates)
+        return response
+
+    def test_list_revalidates_by_etag(self):
+        url = reverse('news_list')
+        response = self.client.get(url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotModified(url, if_none_match=response['ETag'])
+
+        self.create_post(title='Срочная новость')
+        changed = self.client.get(url, headers={'if_none_match': response['ETag']})
+        self.assertContains(changed, 'Срочная новость')
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_list_etag_follows_user_fragments(self):
+        url = reverse('news_list')
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(etag, anonymous)
+        # сессия читается, пользователь и страница — нет
+        self.assertNotModified(url, queries=1, if_none_match=etag)
+
+        Subscription.objects.create(user=self.user, category=self.category)
+        response = self.client.get(url, headers={'if_none_match': etag})
+        self.assertContains(response, reverse('unsubscribe_category', args=[self.category.pk]))
+
+    def test_detail_revalidates_by_last_modified(self):
+        url = reverse('post_detail', args=[self.post.pk])
+        response = self.client.get(url)
+        self.assertEqual(response['Last-Modified'], http_date(self.past.timestamp()))
+        self.assertNotModified(url, queries=1, if_modified_since=response['Last-Modified'])
+
+        Comment.objects.create(post=self.post, user=self.user, content='Комментарий')
+        self.assertEqual(self.client.get(url, headers={'if_modified_since': response['Last-Modified']}).status_code, 200)
+
+    @override_settings(RATING_HOT_THRESHOLD=0)
+    def test_votes_update_last_modified(self):
+        self.post.like()
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.updated_at, self.past)
+
+
+class FragmentTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post()
+        self.post.categories.add(self.category)
+        self.reader = User.objects.create_user('reader')
+        Subscription.objects.create(user=self.reader, category=self.category)
+        self.user.groups.add(Group.objects.get_or_create(name='authors')[0])
+        self.user.user_permissions.add(Permission.objects.get(codename='change_post'))
+
+    def test_shell_is_cached_once_for_all_users(self):
+        url = reverse('news_list')
+        subscribe = reverse('subscribe_category', args=[self.category.pk])
+        unsubscribe = reverse('unsubscribe_category', args=[self.category.pk])
+        edit = reverse('news_update', args=[self.post.pk])
+
+        response = self.client.get(url)
+        self.assertNotContains(response, '<!--fragment')
+        self.assertNotContains(response, subscribe)
+
+        self.client.force_login(self.reader)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([query for query in queries if 'news_post' in query['sql']])
+        self.assertContains(response, unsubscribe)
+        self.assertContains(response, 'Стать автором!')
+        self.assertNotContains(response, edit)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertContains(response, subscribe)
+        self.assertContains(response, 'Вы автор!')
+        self.assertContains(response, edit)
+        self.assertNotContains(response, reverse('news_delete', args=[self.post.pk]))
+
+
+class PublishTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.culture = Category.objects.create(name='Культура')
+        for index in range(3):
+            reader = User.objects.create_user(f'reader{index}', f'reader{index}@example.com')
+            Subscription.objects.create(user=reader, category=self.category)
+            Subscription.objects.create(user=reader, category=self.culture)
+
+    def publish(self, url, data):
+        with mock.patch.object(tasks.deliver_outbox, 'delay') as delay, \
+                self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(delay.call_count, 0)
+        with mock.patch.object(tasks.deliver_outbox, 'delay') as delay:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(delay.call_count, 1)
+
+        writes = [re.match(r'(\w+)[^"]*"(\w+)"', query['sql']).groups() for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes.count(('INSERT', 'news_post')), 1)
+        self.assertEqual(writes.count(('INSERT', 'news_postcategory')), 1)
+        self.assertEqual(writes.count(('INSERT', 'news_delivery')), 1)
+        self.assertNotIn(('UPDATE', 'news_post'), writes)
+        post = Post.objects.latest('id')
+        self.assertEqual(set(post.categories.all()), {self.category, self.culture})
+        self.assertEqual(Delivery.objects.filter(post=post).count(), 3)
+        return post
+
+    def test_view_publishes_with_single_write(self):
+        self.user.user_permissions.add(Permission.objects.get(codename='add_post'))
+        self.client.force_login(self.user)
+        post = self.publish(reverse('news_create'), {
+            'title': 'Новость дня',
+            'content': 'Содержание новости ' * 5,
+            'author': self.author.pk,
+            'categories': [self.category.pk, self.culture.pk],
+            'post_type': Post.NEWS,
+        })
+        self.assertEqual(post.post_type, Post.NEWS)
+
+    def test_admin_publishes_with_single_write(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.publish(reverse('admin:news_post_add'), {
+            'title': 'Статья дня',
+            'content': 'Содержание статьи',
+            'author': self.author.pk,
+            'post_type': Post.ARTICLE,
+            'postcategory_set-TOTAL_FORMS': 2,
+            'postcategory_set-INITIAL_FORMS': 0,
+            'postcategory_set-0-category': self.category.pk,
+            'postcategory_set-1-category': self.culture.pk,
+        })
+
+
+
+class QuotaTests(NewsTestCase):
+    def form(self, **data):
+        return PostForm({
+            'title': 'Заголовок',
+            'content': 'Текст новости ' * 10,
+            'author': self.author.pk,
+            'categories': [self.category.pk],
+            'post_type': Post.NEWS,
+            **data,
+        })
+
+    def publish(self):
+        form = self.form()
+        self.assertTrue(form.is_valid())
+        return form.save()
+
+    def test_limit_is_checked_when_publishing(self):
+        for _ in range(2):
+            self.publish()
+        # обе формы прошли предварительную проверку до публикации
+        first, second = self.form(), self.form()
+        self.assertTrue(first.is_valid())
+        self.assertTrue(second.is_valid())
+        first.save()
+        with self.assertRaisesMessage(quota.QuotaExceeded, 'Нельзя публиковать более 3 постов в сутки'):
+            second.save()
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertFalse(self.form().is_valid())
+
+    def test_view_shows_error_when_last_slot_is_taken_concurrently(self):
+        self.user.user_permissions.add(Permission.objects.get(codename='add_post'))
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.create_post()
+        data = {
+            'title': 'Новость дня',
+            'content': 'Содержание новости ' * 5,
+            'author': self.author.pk,
+            'categories': [self.category.pk],
+            'post_type': Post.NEWS,
+        }
+        # кеш предварительной проверки ещё не знает о чужих постах
+        with mock.patch.object(quota, 'precheck'):
+            response = self.client.post(reverse('news_create'), data)
+        self.assertContains(response, 'Нельзя публиковать более 3 постов в сутки')
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_invalid_form_does_not_take_slot(self):
+        for _ in range(2):
+            self.publish()
+        for _ in range(3):
+            form = self.form(title='Заголовок' * 30)
+            self.assertFalse(form.is_valid())
+            self.assertIn('title', form.errors)
+        self.assertEqual(quota.used(self.author.pk), 2)
+        self.publish()
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_precheck_cache_follows_posts(self):
+        for _ in range(2):
+            self.create_post()
+        self.assertTrue(self.form().is_valid())
+        # автор, категории и проверка внешнего ключа, без подсчёта постов
+        with self.assertNumQueries(3):
+            self.assertTrue(self.form().is_valid())
+        # пост в обход формы сбрасывает кеш сигналом
+        self.create_post()
+        self.assertFalse(self.form().is_valid())
+
+        Post.objects.first().delete()
+        self.assertEqual(quota.used(self.author.pk), 2)
+        self.assertTrue(self.form().is_valid())
+
+    def test_window_slides(self):
+        posts = [self.create_post() for _ in range(3)]
+        now = timezone.now()
+        Post.objects.filter(pk__in=[post.pk for post in posts]).update(
+            created_at=now - timedelta(seconds=quota.window() - 1),
+        )
+        with self.assertRaises(quota.QuotaExceeded):
+            quota.check(self.author, now=now)
+        quota.check(self.author, now=now + timedelta(seconds=1))
+
+    @override_settings(POST_QUOTA_GROUP_LIMITS={'authors': 5})
+    def test_author_and_group_limits(self):
+        self.assertEqual(quota.limit_for(self.author), 3)
+        self.user.groups.add(Group.objects.get_or_create(name='authors')[0])
+        self.assertEqual(quota.limit_for(self.author), 5)
+        self.author.post_limit = 1
+        self.author.save()
+        self.assertEqual(quota.limit_for(self.author), 1)
+
+        self.publish()
+        self.assertFalse(self.form().is_valid())
+
+    def test_admin_checks_limit(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        data = {
+            'title': 'Статья дня',
+            'content': 'Содержание статьи',
+            'author': self.author.pk,
+            'post_type': Post.ARTICLE,
+            'postcategory_set-TOTAL_FORMS': 1,
+            'postcategory_set-INITIAL_FORMS': 0,
+            'postcategory_set-0-category': 0,
+        }
+        for _ in range(4):
+            response = self.client.post(reverse('admin:news_post_add'), data)
+            self.assertEqual(response.status_code, 200)
+
+        data['postcategory_set-0-category'] = self.category.pk
+        for _ in range(3):
+            self.assertEqual(self.client.post(reverse('admin:news_post_add'), data).status_code, 302)
+        response = self.client.post(reverse('admin:news_post_add'), data)
+        self.assertContains(response, 'Нельзя публиковать более 3 постов в сутки')
+        self.assertEqual(Post.objects.count(), 3)
+
+        with mock.patch.object(quota, 'precheck'):
+            response = self.client.post(reverse('admin:news_post_add'), data, follow=True)
+        self.assertContains(response, 'Нельзя публиковать более 3 постов в сутки')
+        self.assertEqual(Post.objects.count(), 3)
+
+@contextmanager
+def file_database():
+    """
+    Переносит тестовую базу из памяти в файл на время блока: общая база в
+    памяти блокирует таблицы сразу, без ожидания, как у рабочей базы
+    """
+    name = connection.settings_dict['NAME']
+    # база в памяти живёт, пока открыто хотя бы одно соединение
+    keep = sqlite3.connect(name, uri=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'news.sqlite3')
+        target = sqlite3.connect(path)
+        keep.backup(target)
+        target.close()
+        with mock.patch.dict(connection.settings_dict, NAME=path):
+            connection.close()
+            try:
+                yield
+            finally:
+                connection.close()
+    connection.ensure_connection()
+    keep.close()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'проверяет блокировку транзакций SQLite')
+@override_settings(CACHES=LOCMEM_CACHES, POST_QUOTA_LIMIT=1)
+class QuotaConcurrencyTests(TransactionTestCase):
+    def test_concurrent_publish_waits_and_sees_limit(self):
+        author = Author.objects.create(user=User.objects.create_user('author'), name='Автор')
+        checked, proceed = threading.Event(), threading.Event()
+        results = {}
+
+        def first():
+            try:
+                with transaction.atomic():
+                    quota.check(author)
+                    checked.set()
+                    proceed.wait(5)
+                    Post.objects.create(author=author, title='Первый', content='Текст')
+                results['first'] = None
+            finally:
+                connections.close_all()
+
+        def second():
+            checked.wait(5)
+            try:
+                publishing.publish(Post(author=author, title='Второй', content='Текст'), [])
+            except Exception as e:
+                results['second'] = e
+            finally:
+                connections.close_all()
+
+        with file_database():
+            threads = [threading.Thread(target=first), threading.Thread(target=second)]
+            for thread in threads:
+                thread.start()
+            # вторая публикация уже ждёт блокировку записи
+            time.sleep(0.3)
+            proceed.set()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(Post.objects.count(), 1)
+
+        self.assertIsNone(results['first'])
+        self.assertIsInstance(results['second'], quota.QuotaExceeded)
+
+
+class NotificationTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.readers = [User.objects.create_user(f'reader{index}', f'reader{index}@example.com') for index in range(5)]
+        for reader in self.readers:
+            Subscription.objects.create(user=reader, category=self.category)
+        Subscription.objects.create(user=User.objects.create_user('no-email'), category=self.category)
+
+    def publish(self, post, *categories):
+        # очередь разбирается после коммита транзакции поста
+        with self.captureOnCommitCallbacks(execute=True):
+            post.categories.add(*categories)
+
+    def test_queued_notifications_are_logged(self):
+        post = self.create_post()
+        with self.assertLogs('news.signals', 'INFO') as logs:
+            self.publish(post, self.category)
+        self.assertIn(f'Уведомления поставлены в очередь: 5 (Post ID: {post.pk})', logs.output[0])
+
+    @contextmanager
+    def failing_connection(self, *emails):
+        connection = get_connection()
+
+        def send_messages(messages):
+            if messages[0].to[0] in emails:
+                raise smtplib.SMTPRecipientsRefused({})
+            return get_connection().send_messages(messages)
+
+        connection.send_messages = send_messages
+        with mock.patch('news.mailing.get_connection', return_value=connection):
+            yield
+        # соединение с подменой не должно остаться в пуле
+        mailing.pool.close_all()
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=2)
+    def test_subscribers_are_notified_in_chunks(self):
+        with mock.patch('news.mailing.get_connection', wraps=get_connection) as connections:
+            self.publish(self.create_post(title='Новость дня'), self.category)
+
+        # три пачки, но соединение одно: задачи берут его из пула воркера
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(reader.email for reader in self.readers))
+        self.assertIn('Новость дня', mail.outbox[0].body)
+        self.assertEqual(Delivery.objects.filter(status=Delivery.SENT).count(), len(self.readers))
+
+    def test_one_email_per_subscriber_lists_matched_categories(self):
+        culture, politics = Category.objects.create(name='Культура'), Category.objects.create(name='Политика')
+        Subscription.objects.create(user=self.readers[0], category=culture)
+        Subscription.objects.create(user=self.readers[1], category=politics)
+        post = self.create_post()
+        self.publish(post, self.category, culture)
+
+        self.assertEqual(len(mail.outbox), len(self.readers))
+        message = next(message for message in mail.outbox if message.to == [self.readers[0].email])
+        self.assertIn('"Спорт", "Культура"', message.subject)
+        self.assertIn('Культура', message.alternatives[0][0])
+
+        # повторное сохранение поста с новой категорией не дублирует письма
+        mail.outbox.clear()
+        self.publish(post, politics)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_batched_subscribers_get_one_email_per_window(self):
+        hourly, daily, immediate = self.readers[:3], self.readers[3], self.readers[4]
+        # дневное окно заканчивается позже часового в любое время запуска
+        self.enterContext(override_settings(NOTIFICATION_DAILY_HOUR=(timezone.localtime().hour + 3) % 24))
+        Subscription.objects.filter(user__in=hourly).update(delivery_mode=Subscription.HOURLY)
+        Subscription.objects.filter(user=daily).update(delivery_mode=Subscription.DAILY)
+        # подписчик ещё одной категории поста получает его в более раннем окне
+        culture = Category.objects.create(name='Культура')
+        Subscription.objects.create(user=hourly[0], category=culture)
+        titles = ['Матч', 'Трансфер', 'Финал']
+        for title in titles:
+            self.create_post(title=title).categories.add(self.category, culture)
+            # транзакция теста не коммитится: доставку после каждого поста запускаем сами
+            tasks.deliver_outbox()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [hourly[0].email] * 3 + [immediate.email] * 3)
+        mail.outbox.clear()
+        tasks.deliver_outbox()
+        self.assertEqual(len(mail.outbox), 0)
+
+        window_end = outbox.due_at(Subscription.HOURLY)
+        with mock.patch('django.utils.timezone.now', return_value=window_end):
+            tasks.deliver_outbox()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(user.email for user in hourly[1:]))
+        self.assertIn('Новые записи в ваших разделах: 3', mail.outbox[0].subject)
+        for title in titles:
+            self.assertIn(title, mail.outbox[0].alternatives[0][0])
+
+        mail.outbox.clear()
+        with mock.patch('django.utils.timezone.now', return_value=outbox.due_at(Subscription.DAILY)):
+            tasks.deliver_outbox()
+        self.assertEqual([message.to[0] for message in mail.outbox], [daily.email])
+        self.assertFalse(Delivery.objects.exclude(status=Delivery.SENT).exists())
+
+    def test_subscriber_switches_delivery_mode(self):
+        self.create_post().categories.add(self.category)
+        reader = self.readers[0]
+        self.client.force_login(reader)
+        hourly = reverse('subscription_mode', args=[self.category.pk, Subscription.HOURLY])
+        self.assertContains(self.client.get(reverse('news_list')), hourly)
+
+        self.client.get(hourly)
+        self.assertEqual(Subscription.objects.get(user=reader).delivery_mode, Subscription.HOURLY)
+        self.assertContains(self.client.get(reverse('news_list')), reverse('subscription_mode', args=[self.category.pk, Subscription.DAILY]))
+        self.assertEqual(self.client.get(reverse('subscription_mode', args=[self.category.pk, 'weekly'])).status_code, 404)
+
+    def test_rolled_back_post_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            self.create_post().categories.add(self.category)
+            raise RuntimeError
+        self.assertFalse(Delivery.objects.exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(OUTBOX_RETRY_DELAY=60)
+    def test_failed_delivery_is_retried_with_backoff(self):
+        post = self.create_post()
+        with self.failing_connection(self.readers[1].email):
+            self.publish(post, self.category)
+        self.assertEqual(len(mail.outbox), 4)
+
+        failed = Delivery.objects.get(user=self.readers[1])
+        self.assertEqual((failed.status, failed.attempts), (Delivery.PENDING, 1))
+        self.assertGreater(failed.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        tasks.deliver_outbox()
+        self.assertEqual(len(mail.outbox), 4)
+
+        Delivery.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        tasks.deliver_outbox()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(reader.email for reader in self.readers))
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=0)
+    def test_delivery_gives_up_after_max_attempts(self):
+        with self.failing_connection(self.readers[0].email):
+            self.publish(self.create_post(), self.category)
+            tasks.deliver_outbox()
+        failed = Delivery.objects.get(user=self.readers[0])
+        self.assertEqual((failed.status, failed.attempts), (Delivery.FAILED, 2))
+        self.assertTrue(failed.last_error)
+
+    def test_failed_reconnect_is_reported_for_rest_of_chunk(self):
+        messages = [(reader.pk, mail.EmailMessage('Тема', 'Текст', to=[reader.email])) for reader in self.readers]
+        with self.failing_connection(self.readers[1].email):
+            # после ошибки второго письма сервер перестаёт принимать соединения
+            reconnect = [mailing.pool.acquire(), smtplib.SMTPConnectError(421, 'down')]
+            with mock.patch.object(mailing.pool, 'acquire', side_effect=reconnect):
+                results = list(mailing.send_each(messages))
+        self.assertEqual([key for key, _ in results], [reader.pk for reader in self.readers])
+        self.assertEqual([error is None for _, error in results], [True, False, False, False, False])
+        self.assertIsInstance(results[2][1], smtplib.SMTPConnectError)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_interrupted_chunk_keeps_sent_rows(self):
+        post = self.create_post()
+        post.categories.add(self.category)
+        token = outbox.claim(100)
+        send_each = mailing.send_each
+
+        def crash_after_two(messages, **kwargs):
+            results = send_each(messages, **kwargs)
+            yield next(results)
+            yield next(results)
+            results.close()
+            raise RuntimeError('воркер остановлен')
+
+        with mock.patch('news.mailing.send_each', crash_after_two), self.assertRaises(RuntimeError):
+            outbox.deliver(token)
+        self.assertEqual(Delivery.objects.filter(status=Delivery.SENT).count(), 2)
+        self.assertFalse(Delivery.objects.filter(status=Delivery.SENDING).exists())
+
+        Delivery.objects.filter(status=Delivery.PENDING).update(next_attempt_at=timezone.now())
+        tasks.deliver_outbox()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(reader.email for reader in self.readers))
+
+    def test_redelivered_chunk_does_not_resend(self):
+        post = self.create_post()
+        post.categories.add(self.category)
+        token = outbox.claim(100)
+        self.assertEqual(outbox.deliver(token)['sent'], len(self.readers))
+        self.assertEqual(outbox.deliver(token)['sent'], 0)
+        self.assertIsNone(outbox.claim(100))
+        self.assertEqual(len(mail.outbox), len(self.readers))
+
+
+class RenderedEmailTests(NewsTestCase):
+    def test_template_is_rendered_once_per_category_set(self):
+        post = self.create_post(title='Новость дня')
+        readers = [User.objects.create_user(f'reader{index}', f'reader{index}@example.com') for index in range(5)]
+        for reader in readers:
+            Subscription.objects.create(user=reader, category=self.category)
+        with mock.patch('news.mailing.render_to_string', wraps=render_to_string) as render, \
+                self.captureOnCommitCallbacks(execute=True):
+            post.categories.add(self.category)
+        self.assertEqual(render.call_count, 1)
+
+        message = mail.outbox[0]
+        self.assertIn(f'Здравствуй, {message.to[0].split("@")[0]}!', message.body)
+        self.assertIn(f'Читать полностью (http://127.0.0.1:8000/news/{post.pk}/)', message.body)
+        self.assertNotIn('font-family', message.body)
+
+    def test_recipient_fields_are_escaped_in_html_only(self):
+        email = mailing.RenderedEmail(
+            'account/email/new_post_notification.html',
+            {'post': self.create_post(), 'categories': [self.category]},
+            subject='Тема',
+        )
+        user = User(username='<Аня & Co>', email='anya@example.com')
+        message = email.message(user)
+        self.assertIn('<Аня & Co>', message.body)
+        self.assertIn('&lt;Аня &amp; Co&gt;', message.alternatives[0][0])
+        self.assertEqual(message.to, ['anya@example.com'])
+
+
+class WeeklyDigestTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.culture = Category.objects.create(name='Культура')
+        old = self.create_post(title='Прошлогодняя новость')
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+        old.categories.add(self.category)
+        for title, categories in [('Матч', [self.category]), ('Премьера', [self.culture]), ('Фестиваль', [self.category, self.culture])]:
+            self.create_post(title=title).categories.add(*categories)
+
+        self.both = User.objects.create_user('both', 'both@example.com')
+        self.sport = User.objects.create_user('sport', 'sport@example.com')
+        for user, categories in [(self.both, [self.category, self.culture]), (self.sport, [self.category])]:
+            for category in categories:
+                Subscription.objects.create(user=user, category=category)
+        for index in range(20):
+            user = User.objects.create_user(f'reader{index}', f'reader{index}@example.com')
+            Subscription.objects.create(user=user, category=self.culture)
+        mail.outbox.clear()
+
+    def test_one_digest_per_subscriber_in_fixed_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            tasks.send_weekly_digest()
+
+        # посты со связями и подписчики, сколько бы их ни было; остальное — отметки запуска
+        reads = [query for query in queries if query['sql'].startswith('SELECT') and 'news_digestrun' not in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(len(mail.outbox), 22)
+        message = next(message for message in mail.outbox if message.to == [self.both.email])
+        html = message.alternatives[0][0]
+        self.assertIn('3 новых статей', message.subject)
+        self.assertEqual(html.count('Фестиваль'), 2)
+        self.assertNotIn('Прошлогодняя новость', html)
+        sport_message = next(message for message in mail.outbox if message.to == [self.sport.email])
+        self.assertNotIn('Премьера', sport_message.alternatives[0][0])
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=5)
+    def test_interrupted_run_resumes_without_duplicates(self):
+        send_each, sent = mailing.send_each, iter(range(7))
+
+        def crash_after_seven(messages, **kwargs):
+            for result in send_each(messages, **kwargs):
+                if next(sent, None) is None:
+                    raise SystemExit
+                yield result
+
+        with mock.patch('news.mailing.send_each', crash_after_seven), self.assertRaises(SystemExit):
+            tasks.send_weekly_digest()
+        self.assertEqual(len(mail.outbox), 8)
+        # в базе — отметка после первой пачки, в кеше — после седьмого письма
+        run = DigestRun.objects.get()
+        self.assertEqual((run.sent, run.finished_at), (5, None))
+
+        # письмо, отправленное перед падением без отметки, уйдёт повторно
+        self.assertEqual(tasks.send_weekly_digest(), 'Отправлено писем: 22')
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), 23)
+        self.assertEqual(len(set(recipients)), 22)
+
+        # запуск за ту же неделю уже завершён
+        tasks.send_weekly_digest()
+        self.assertEqual(len(mail.outbox), 23)
+
+    def test_single_run_at_a_time(self):
+        period = digest.current_period()
+        token = digest.acquire_lock(period)
+        self.assertIsNone(digest.acquire_lock(period))
+        self.assertEqual(tasks.send_weekly_digest(), 'Рассылка уже идёт')
+        self.assertEqual(len(mail.outbox), 0)
+
+        digest.release_lock(period, token)
+        tasks.send_weekly_digest()
+        self.assertEqual(len(mail.outbox), 22)
+        run = DigestRun.objects.get()
+        self.assertEqual((run.lock_token, run.locked_until), ('', None))
+
+    def test_expired_lock_is_taken_over(self):
+        period = digest.current_period()
+        stale = digest.acquire_lock(period)
+        DigestRun.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        token = digest.acquire_lock(period)
+        self.assertIsNotNone(token)
+        # упавший воркер, очнувшись, не снимает чужую блокировку
+        digest.release_lock(period, stale)
+        self.assertIsNone(digest.acquire_lock(period))
+
+
+class ThrottleTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        clock = mock.patch('news.throttle.time', time=lambda: self.now, sleep=self.sleep)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_bucket_is_shared_by_workers(self):
+        workers = [throttle.TokenBucket('smtp', rate=10, capacity=5) for _ in range(2)]
+        waits = [workers[index % 2].acquire() for index in range(12)]
+
+        # по 5 писем за каждые полсекунды на оба воркера вместе
+        self.assertAlmostEqual(self.now - 1000, 1.0)
+        self.assertEqual(sum(1 for wait in waits if wait), 2)
+        self.assertEqual(workers[0].stats(), {'acquired': 12, 'waited': 1.0})
+
+    def test_bucket_requires_atomic_cache(self):
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(CACHES={
+            **LOCMEM_CACHES,
+            'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp},
+        }))
+        with self.assertRaises(ImproperlyConfigured):
+            throttle.TokenBucket('smtp', rate=10, cache_alias='file')
+
+    @override_settings(MAIL_RATE_LIMITS={'smtp': {'rate': 2}, 'digest': {'rate': 1}})
+    def test_digest_takes_its_share_of_smtp_tokens(self):
+        messages = [mail.EmailMessage('Тема', 'Текст', to=[f'reader{index}@example.com']) for index in range(4)]
+        mailing.send_messages(messages[:2], limits=('digest', 'smtp'))
+        mailing.send_messages(messages[2:])
+
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(throttle.bucket('digest').stats()['acquired'], 2)
+        self.assertEqual(throttle.bucket('smtp').stats()['acquired'], 4)
+        # второе письмо дайджеста ждёт своей секунды, четвёртое — общего лимита
+        self.assertAlmostEqual(self.now - 1000, 2.0)
+
+    @override_settings(MAIL_RATE_LIMITS={'smtp': {'rate': 10}})
+    def test_queues_and_metrics(self):
+        router = celery_app.amqp.router
+        self.assertEqual(router.route({}, 'news.tasks.send_outbox_chunk')['queue'].name, 'notifications')
+        self.assertEqual(router.route({}, 'news.tasks.send_weekly_digest')['queue'].name, 'digest')
+        self.assertEqual(router.route({}, 'news.tasks.flush_rating_buffers')['queue'].name, 'celery')
+
+        throttle.bucket('smtp').acquire()
+        out = StringIO()
+        with mock.patch('news.management.commands.mail_metrics.queue_depth', side_effect=[3, None]):
+            call_command('mail_metrics', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'queue.digest.depth 3',
+            'queue.notifications.depth брокер недоступен',
+            'outbox.pending 0',
+            'throttle.smtp.acquired 1',
+            'throttle.smtp.waited_seconds 0.000',
+        ])
+
+
+class SMTPPoolTests(SimpleTestCase):
+    class Connection:
+        def __init__(self, healthy=True):
+            self.healthy = healthy
+            self.closed = False
+            self.connection = self
+
+        def open(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+        def noop(self):
+            if not self.healthy:
+                raise smtplib.SMTPServerDisconnected
+            return 250, b'OK'
+
+    def setUp(self):
+        self.opened = []
+        self.pool = smtp_pool.ConnectionPool(self.open)
+
+    def open(self):
+        self.opened.append(self.Connection())
+        return self.opened[-1]
+
+    @override_settings(SMTP_POOL_SIZE=1)
+    def test_connections_are_reused_up_to_pool_size(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertTrue(second.closed)
+        self.assertIs(self.pool.acquire(), first)
+        self.assertEqual(self.pool.stats, {'opened': 2, 'reused': 1, 'expired': 0, 'broken': 0})
+
+    @override_settings(SMTP_POOL_IDLE_TIMEOUT=60)
+    def test_idle_and_broken_connections_are_replaced(self):
+        idle, dead = self.pool.acquire(), self.pool.acquire()
+        with mock.patch('news.smtp_pool.time.monotonic', return_value=time.monotonic() - 120):
+            self.pool.release(idle)
+        dead.healthy = False
+        self.pool.release(dead)
+
+        fresh = self.pool.acquire()
+        self.assertNotIn(fresh, (idle, dead))
+        self.assertTrue(idle.closed and dead.closed)
+        self.assertEqual(self.pool.stats, {'opened': 3, 'reused': 0, 'expired': 1, 'broken': 1})
+
+    def test_forked_process_starts_with_empty_pool(self):
+        parent = self.pool.acquire()
+        self.pool.release(parent)
+        with mock.patch('news.smtp_pool.os.getpid', return_value=-1):
+            self.assertIsNot(self.pool.acquire(), parent)
+
+
+class CensorTests(SimpleTestCase):
+    def test_words_containing_dictionary_entries_are_masked(self):
+        engine = censor.Censor(['урод', 'дебил', 'уродина'])
+        self.assertEqual(
+            engine.censor('Какой-то УРОДливый  текст\nпро Дебила, а не про дом.'),
+            'Какой-то У********  текст\nпро Д****** а не про дом.',
+        )
+        # İ при lower() превращается в две буквы: позиции считаются заново
+        self.assertEqual(engine.censor('İstanbul урод'), 'İstanbul у***')
+        self.assertEqual(censor.Censor([]).censor('урод'), 'урод')
+
+    def test_results_are_memoized_in_bounded_cache(self):
+        engine = censor.Censor(['урод'], cache_size=2)
+        with mock.patch.object(engine, '_censor', wraps=engine._censor) as compute:
+            for text in ['урод', 'урод', 'текст', 'ещё текст', 'урод']:
+                engine.censor(text)
+        self.assertEqual(compute.call_count, 4)
+        self.assertEqual(len(engine.cache), 2)
+
+    def test_dictionary_is_reloaded_when_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'words.txt')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('# словарь\nурод\n')
+            with override_settings(CENSOR_WORDS_FILE=path, CENSOR_RELOAD_INTERVAL=0):
+                self.addCleanup(censor.reload)
+                censor.reload()
+                self.assertEqual(censor_filter.censor('Урод и падла'), 'У*** и падла')
+
+                with open(path, 'a', encoding='utf-8') as file:
+                    file.write('падла\n')
+                os.utime(path, (time.time() + 10, time.time() + 10))
+                self.assertEqual(censor_filter.censor('Урод и падла'), 'У*** и п****')
+                self.assertEqual(censor_filter.censor(None), None)
+
+    def test_count_matches_masked_words(self):
+        engine = censor.Censor(['урод', 'дебил'])
+        text = 'Урод, уродина и дебилы, а не дом. İ урод'
+        self.assertEqual(engine.count(text), 4)
+        self.assertEqual(engine.count(text.replace('İ', 'I')), 4)
+        self.assertEqual(censor.Censor([]).count(text), 0)
+
+
+class ModerationScanTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(censor.reload)
+        self.bad_posts = {self.create_post(title=f'Урод {index}').pk for index in range(3)}
+        self.bad_posts.add(self.create_post(content='Тварь и падла').pk)
+        for index in range(4):
+            self.create_post(title=f'Новость {index}')
+        post = Post.objects.first()
+        self.bad_comment = Comment.objects.create(post=post, user=self.user, content='Дебил').pk
+        Comment.objects.create(post=post, user=self.user, content='Хорошая новость')
+
+    def scan(self, *args):
+        out = StringIO()
+        call_command('moderation_scan', '--chunk-size', '3', *args, stdout=out)
+        return out.getvalue()
+
+    def assertFlagged(self):
+        flags = {(flag.kind, flag.object_id): flag.matches for flag in ModerationFlag.objects.all()}
+        expected = {(ModerationFlag.POST, pk): 1 for pk in self.bad_posts}
+        expected[ModerationFlag.POST, max(self.bad_posts)] = 2
+        expected[ModerationFlag.COMMENT, self.bad_comment] = 1
+        self.assertEqual(flags, expected)
+        scan = ModerationScan.objects.get()
+        self.assertEqual((scan.scanned, scan.flagged), (10, 5))
+        self.assertIsNotNone(scan.finished_at)
+
+    def test_scan_in_process_pool(self):
+        output = self.scan('--workers', '2')
+        self.assertIn('Проверено 10 документов', output)
+        self.assertIn('док/с', output)
+        self.assertFlagged()
+        self.assertIn('уже завершена', self.scan())
+
+        self.scan('--workers', '1', '--restart')
+        self.assertFlagged()
+
+    def test_interrupted_scan_resumes_after_last_chunk(self):
+        save_chunk = moderation.save_chunk
+        calls = []
+
+        def crash_on_third_chunk(*args):
+            calls.append(args)
+            if len(calls) == 3:
+                raise RuntimeError('worker killed')
+            save_chunk(*args)
+
+        with mock.patch.object(moderation, 'save_chunk', crash_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.scan('--workers', '1')
+        scan = ModerationScan.objects.get()
+        self.assertEqual(scan.scanned, 6)
+        self.assertIsNone(scan.finished_at)
+
+        output = self.scan('--workers', '1')
+        self.assertIn(f'Продолжение после поста #{scan.last_post_id}', output)
+        self.assertIn('Проверено 4 документов', output)
+        self.assertFlagged()
+
+
+TWO_TIER_CACHES = {
+    'default': {
+        'BACKEND': 'news.cache_backends.TwoTierCache',
+        'LOCATION': 'news-tests-two-tier',
+        'OPTIONS': {'SHARED': 'shared', 'STATS_INTERVAL': 3600},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'news-tests-shared',
+    },
+}
+
+
+@override_settings(CACHES=TWO_TIER_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.push_stats()
+        cache.clear()
+        self.shared = caches['shared']
+
+    def test_repeated_reads_are_served_from_process(self):
+        cache.set('page', 'первая версия', 60)
+        self.shared.set('page', 'изменено другим процессом', 60)
+        self.assertEqual(cache.get('page'), 'первая версия')
+
+        cache.delete('page')
+        self.assertIsNone(cache.get('page'))
+        self.assertEqual(cache.stats()['local_hits'], 1)
+
+    def test_counters_are_always_read_from_shared_tier(self):
+        cache.add('counter', 0, None)
+        cache.incr('counter')
+        self.assertEqual(cache.get('counter'), 1)
+        self.shared.incr('counter', 5)
+        self.assertEqual(cache.get('counter'), 6)
+        cache.set('hits', 3, 60)
+        self.shared.incr('hits')
+        self.assertEqual(cache.get('hits'), 4)
+
+    def test_only_one_reader_rebuilds_expired_value(self):
+        now = time.time()
+        cache.set('page', 'старая страница', 60)
+        with mock.patch('news.cache_backends.time.time', return_value=now + 61):
+            self.assertIsNone(cache.get('page'))
+            self.assertEqual(cache.get('page'), 'старая страница')
+            self.assertEqual(cache.get('page'), 'старая страница')
+            cache.set('page', 'новая страница', 60)
+            self.assertEqual(cache.get('page'), 'новая страница')
+        # блокировка пересчёта снята записью: следующее истечение снова
+        # пересчитывает первый читатель, а не ждёт lock_timeout
+        with mock.patch('news.cache_backends.time.time', return_value=now + 122):
+            self.assertIsNone(cache.get('page'))
+            self.assertEqual(cache.get('page'), 'новая страница')
+        cache.set_many({'page': 'третья страница'}, 60)
+        self.assertFalse(self.shared.has_key('page:rebuild'))
+
+        stats = cache.stats()
+        self.assertEqual((stats['rebuilds'], stats['stale_hits']), (2, 3))
+
+    def test_metrics_are_summed_in_shared_tier(self):
+        cache.set('page', 'страница', 60)
+        cache.get('page')
+        cache.get('missing')
+        cache.push_stats()
+        stats = cache.shared_stats()
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['shared_misses'], 1)
+
+    def test_non_atomic_shared_tier_is_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(CACHES={
+            **TWO_TIER_CACHES,
+            'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp},
+        }):
+            with self.assertRaises(ImproperlyConfigured):
+                TwoTierCache('pages', {'OPTIONS': {'SHARED': 'file'}})
+            backend = TwoTierCache('pages', {'OPTIONS': {'SHARED': 'file', 'REQUIRE_ATOMIC': False}})
+            self.assertFalse(has_atomic_counters(backend))
+        self.assertTrue(has_atomic_counters(caches['default']))
+
+    def test_local_tier_returns_copies(self):
+        cache.set('page', {'title': 'Заголовок'}, 60)
+        cache.get('page')['title'] = 'Изменено'
+        self.assertEqual(cache.get('page'), {'title': 'Заголовок'})
+
+
+class ConfiguredCacheTests(SimpleTestCase):
+    """
+    Кеш из project/settings.py, а не LocMem остальных тестов
+    """
+    def test_configured_shared_tier_has_atomic_counters(self):
+        self.assertTrue(has_atomic_counters(caches['default']))
+
+    @skipUnless(os.environ.get('TEST_REDIS_URL'), 'интеграционный тест: задайте TEST_REDIS_URL отдельной базы Redis')
+    def test_shared_tier_counters_are_atomic(self):
+        # те же бэкенды, что в настройках, но общий кеш — в отдельной
+        # тестовой базе Redis, а не в рабочей из CACHES
+        configured = {alias: dict(options) for alias, options in settings.CACHES.items()}
+        configured['shared']['LOCATION'] = os.environ['TEST_REDIS_URL']
+        self.enterContext(override_settings(CACHES=configured))
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        caches['default'].add('atomic-check', 0, 60)
+
+        def increment():
+            for _ in range(200):
+                caches['default'].incr('atomic-check')
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(caches['default'].get('atomic-check'), 1600)
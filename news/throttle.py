@@ -0,0 +1,93 @@
+"""
+Ограничение скорости отправки писем, общее для всех воркеров.
+
+Корзина токенов хранится в кеше: каждые capacity / rate секунд в неё
+кладётся capacity токенов, а токен — это incr счётчика текущего
+интервала. Пока счётчик не превысил capacity, письмо уходит сразу,
+иначе воркер спит до следующего интервала. Так все процессы вместе
+отправляют не больше rate писем в секунду в среднем и не больше
+capacity подряд. Нужен кеш с атомарным incr (Redis, Memcached, LocMem):
+на файловом кеше воркеры теряют приращения друг друга и вместе
+превышают лимит, поэтому корзина на нём не создаётся.
+
+Корзины задаются в MAIL_RATE_LIMITS: 'smtp' — лимит провайдера на все
+письма, 'digest' — доля лимита для массовой рассылки, чтобы
+еженедельный дайджест не занимал все токены и уведомления о новых
+постах уходили без задержки.
+
+Время ожидания и число выданных токенов копятся в кеше и выводятся
+командой mail_metrics вместе с длиной очередей Celery.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from .cache_backends import has_atomic_counters
+from .cache_utils import incr
+
+DEFAULT_LIMITS = {
+    'smtp': {'rate': 10},
+}
+
+
+class TokenBucket:
+    def __init__(self, name, rate, capacity=None, cache_alias='default'):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or max(1, math.ceil(rate))
+        self.interval = self.capacity / rate
+        self.cache_alias = cache_alias
+        if not has_atomic_counters(self.cache):
+            raise ImproperlyConfigured(f'Кеш {cache_alias!r} не подходит для MAIL_RATE_LIMITS: нужен атомарный incr')
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, *parts):
+        return ':'.join(['throttle', self.name, *map(str, parts)])
+
+    def acquire(self):
+        """
+        Берёт один токен, при необходимости дожидаясь его. Возвращает
+        время ожидания в секундах
+        """
+        waited = 0.0
+        while True:
+            now = time.time()
+            slot = int(now // self.interval)
+            taken = incr(self.cache, self._key('slot', slot), timeout=math.ceil(self.interval) + 1)
+            if taken <= self.capacity:
+                break
+            pause = (slot + 1) * self.interval - now
+            time.sleep(pause)
+            waited += pause
+        incr(self.cache, self._key('acquired'))
+        if waited:
+            incr(self.cache, self._key('waited_ms'), round(waited * 1000))
+        return waited
+
+    def stats(self):
+        """
+        Выданные токены и суммарное ожидание всех воркеров
+        """
+        found = self.cache.get_many([self._key('acquired'), self._key('waited_ms')])
+        return {
+            'acquired': found.get(self._key('acquired'), 0),
+            'waited': found.get(self._key('waited_ms'), 0) / 1000,
+        }
+
+
+def bucket(name):
+    limits = getattr(settings, 'MAIL_RATE_LIMITS', DEFAULT_LIMITS)
+    return TokenBucket(name, **limits[name]) if name in limits else None
+
+
+def buckets(*names):
+    """
+    Корзины из MAIL_RATE_LIMITS; ненастроенные не ограничивают
+    """
+    return [found for found in map(bucket, names) if found]
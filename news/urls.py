@@ -1,25 +1,33 @@
 from .views import (NewsListView, ArticlesListView, PostSearchView,
                    PostDetail, NewsCreate, ArticleCreate,
                    NewsUpdate, ArticleUpdate, NewsDelete, ArticleDelete, upgrade,
-                    subscribe_to_category, unsubscribe_from_category)
+                    subscribe_to_category, unsubscribe_from_category, change_delivery_mode,
+                    author_autocomplete, category_autocomplete)
 from django.urls import path
-from django.views.decorators.cache import cache_page
+from .page_cache import (cache_versioned, list_scopes, detail_scopes, detail_last_modified,
+                         author_choice_scopes, category_choice_scopes)
 urlpatterns = [
-    path('news/', cache_page(60*5)(NewsListView.as_view()), name='news_list'),
-    path('search/', cache_page(60)(PostSearchView.as_view()), name='news_search'),
+    path('news/', cache_versioned(list_scopes, per_user=True)(NewsListView.as_view()), name='news_list'),
+    path('search/', cache_versioned(list_scopes)(PostSearchView.as_view()), name='news_search'),
     path('create/', NewsCreate.as_view(), name='news_create'),
-    path('<int:pk>/', cache_page(60*5)(PostDetail.as_view()), name='post_detail'),
-    path('<int:pk>/update/', cache_page(5)(NewsUpdate.as_view()), name='news_update'),
-    path('<int:pk>/delete/', cache_page(5)(NewsDelete.as_view()), name='news_delete'),
+    path('<int:pk>/', cache_versioned(detail_scopes, last_modified=detail_last_modified)(PostDetail.as_view()), name='post_detail'),
+    path('<int:pk>/update/', NewsUpdate.as_view(), name='news_update'),
+    path('<int:pk>/delete/', NewsDelete.as_view(), name='news_delete'),
 
     # Маршруты для статей
-    path('articles/', cache_page(60*5)(ArticlesListView.as_view()), name='articles_list'),
+    path('articles/', cache_versioned(list_scopes, per_user=True)(ArticlesListView.as_view()), name='articles_list'),
     path('articles/create/', ArticleCreate.as_view(), name='article_create'),
-    path('articles/<int:pk>/update/', cache_page(5)(ArticleUpdate.as_view()), name='article_update'),
-    path('articles/<int:pk>/delete/', cache_page(5)(ArticleDelete.as_view()), name='article_delete'),
+    path('articles/<int:pk>/update/', ArticleUpdate.as_view(), name='article_update'),
+    path('articles/<int:pk>/delete/', ArticleDelete.as_view(), name='article_delete'),
 
     path('upgrade/', upgrade, name = 'upgrade'),
 
     path('category/<int:category_id>/subscribe/', subscribe_to_category, name='subscribe_category'),
     path('category/<int:category_id>/unsubscribe/', unsubscribe_from_category, name='unsubscribe_category'),
+    path('category/<int:category_id>/mode/<str:mode>/', change_delivery_mode, name='subscription_mode'),
+
+    # Автодополнение для форм постов и фильтров (news/autocomplete.py)
+    path('autocomplete/authors/', cache_versioned(author_choice_scopes)(author_autocomplete), name='author_autocomplete'),
+    path('autocomplete/categories/', cache_versioned(category_choice_scopes)(category_autocomplete),
+         name='category_autocomplete'),
 ]
\ No newline at end of file
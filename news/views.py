@@ -1,15 +1,18 @@
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 from .models import Post, Category, Subscription
 from .filters import PostFilter, PostSearchFilter
 from .forms import PostForm
+from . import autocomplete, quota
+from .pagination import CursorPaginator
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth.models import Group
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
 
 class IndexView(LoginRequiredMixin, TemplateView):
     template_name = 'index.html'
@@ -19,56 +22,54 @@ class IndexView(LoginRequiredMixin, TemplateView):
         context['is_not_authors'] = not self.request.user.groups.filter(name='authors').exists()
         return context
 
-class NewsListView(ListView):
+class PostListMixin:
+    """
+    Общая часть списков постов: фильтр и готовые сводки постов
+    (PostSummary) без чтения content. Страница не зависит от пользователя:
+    подписки и кнопки по правам подставляются фрагментами (news/fragments.py)
+    """
     model = Post
-    ordering = ['-created_at']
-    template_name = 'news.html'
-    context_object_name = 'news'
+    ordering = ['-created_at', '-id']
     paginate_by = 10
+    filterset_class = PostFilter
+    post_type = None
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(post_type='NW')
-        self.filterset = PostFilter(self.request.GET, queryset)
+        queryset = super().get_queryset().select_related('summary').defer('content')
+        if self.post_type:
+            queryset = queryset.filter(post_type=self.post_type)
+        self.filterset = self.filterset_class(self.request.GET, queryset)
         return self.filterset.qs
 
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get('cursor')
+        if cursor is None and getattr(settings, 'POST_LIST_PAGINATION', 'offset') != 'cursor':
+            return super().paginate_queryset(queryset, page_size)
+        if not CursorPaginator.supports(queryset):
+            # результаты поиска упорядочены по релевантности, а не по дате
+            return super().paginate_queryset(queryset, page_size)
+        page = CursorPaginator(queryset, page_size).page(cursor)
+        return None, page, page.object_list, page.has_other_pages()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['filterset'] = self.filterset
         return context
 
-class ArticlesListView(ListView):
-    model = Post
-    ordering = ['-created_at']
+class NewsListView(PostListMixin, ListView):
+    template_name = 'news.html'
+    context_object_name = 'news'
+    post_type = Post.NEWS
+
+class ArticlesListView(PostListMixin, ListView):
     template_name = 'articles.html'
     context_object_name = 'articles'
-    paginate_by = 10
-
-    def get_queryset(self):
-        queryset = super().get_queryset().filter(post_type='AR')
-        self.filterset = PostFilter(self.request.GET, queryset)
-        return self.filterset.qs
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['filterset'] = self.filterset
-        return context
+    post_type = Post.ARTICLE
 
-class PostSearchView(ListView):
-    model = Post
-    ordering = ['-created_at']
+class PostSearchView(PostListMixin, ListView):
     template_name = 'news_search.html'
     context_object_name = 'news'
-    paginate_by = 10
-
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        self.filterset = PostSearchFilter(self.request.GET, queryset)
-        return self.filterset.qs
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['filterset'] = self.filterset
-        return context
+    filterset_class = PostSearchFilter
 
 class PostDetail(DetailView):
     model = Post
@@ -80,11 +81,28 @@ def create_news(request):
     if request.method == 'POST':
         form = PostForm(request.POST)
         if form.is_valid():
-            form.save()
-            return HttpResponseRedirect('/news/')
+            try:
+                form.save()
+            except quota.QuotaExceeded as e:
+                form.add_error(None, e)
+            else:
+                return HttpResponseRedirect('/news/')
     return render(request, 'news_edit.html', {'form': form})
 
-class NewsCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+class PostCreateMixin:
+    """
+    Форма прошла предварительную проверку лимита, но последний слот мог
+    успеть занять параллельный запрос: публикация проверяет лимит ещё раз
+    (news/quota.py), и ошибка показывается в форме
+    """
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except quota.QuotaExceeded as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+
+class NewsCreate(LoginRequiredMixin, PermissionRequiredMixin, PostCreateMixin, CreateView):
     form_class = PostForm
     model = Post
     template_name = 'news_edit.html'
@@ -92,13 +110,11 @@ class NewsCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     success_url = reverse_lazy('news_list')
 
     def form_valid(self, form):
-        post = form.save(commit=False)
-        post.post_type = 'NW'
-        post.save()
-        form.save_m2m()
+        # form.save() в CreateView публикует пост целиком, см. news/publishing.py
+        form.instance.post_type = Post.NEWS
         return super().form_valid(form)
 
-class ArticleCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+class ArticleCreate(LoginRequiredMixin, PermissionRequiredMixin, PostCreateMixin, CreateView):
     form_class = PostForm
     model = Post
     template_name = 'news_edit.html'
@@ -106,10 +122,8 @@ class ArticleCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     permission_required = 'news.add_post'
 
     def form_valid(self, form):
-        post = form.save(commit=False)
-        post.post_type = 'AR'
-        post.save()
-        form.save_m2m()
+        # form.save() в CreateView публикует пост целиком, см. news/publishing.py
+        form.instance.post_type = Post.ARTICLE
         return super().form_valid(form)
 
 class NewsUpdate(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
@@ -187,3 +201,33 @@ def unsubscribe_from_category(request, category_id):
         messages.info(request, f'Вы не были подписаны на категорию "{category.name}"')
 
     return redirect(request.META.get('HTTP_REFERER', '/news/'))
+
+
+@login_required
+def change_delivery_mode(request, category_id, mode):
+    subscription = get_object_or_404(Subscription, user=request.user, category_id=category_id)
+    modes = dict(Subscription.DELIVERY_MODES)
+    if mode not in modes:
+        raise Http404
+    # save(), а не update(): сигнал обновляет фрагменты подписок пользователя
+    subscription.delivery_mode = mode
+    subscription.save(update_fields=['delivery_mode'])
+    messages.success(request, f'Уведомления о категории "{subscription.category.name}": {modes[mode].lower()}')
+
+    return redirect(request.META.get('HTTP_REFERER', '/news/'))
+
+
+def _autocomplete_page(request):
+    page = request.GET.get('page', '1')
+    return int(page) if page.isdigit() else 1
+
+
+def author_autocomplete(request):
+    # staff=0 — только авторы, от имени которых можно публиковать (PostForm)
+    return JsonResponse(autocomplete.authors(
+        request.GET.get('q', ''), _autocomplete_page(request), publishers_only=request.GET.get('staff') == '0',
+    ))
+
+
+def category_autocomplete(request):
+    return JsonResponse(autocomplete.categories(request.GET.get('q', ''), _autocomplete_page(request)))
@@ -1,6 +1,5 @@
 import os
 from celery import Celery
-from celery.schedules import crontab
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
@@ -8,13 +7,20 @@ app = Celery('project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+# Расписание периодических задач — CELERY_BEAT_SCHEDULE в project/settings.py
+
+
+def queue_depth(name):
+    """
+    Число задач в очереди брокера или None, если брокер недоступен
+    """
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            return connection.default_channel.queue_declare(queue=name, passive=True).message_count
+    except Exception:
+        return None
 
-app.conf.beat_schedule = {
-    'send-weekly-digest': {
-        'task': 'news.tasks.send_weekly_digest',
-        'schedule': crontab(hour=8, minute=0, day_of_week=1),
-    },
-}
 
 @app.task(bind=True)
 def debug_task(self):
@@ -59,12 +59,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'news.fragments.FragmentMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware",
-    'django.middleware.cache.UpdateCacheMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -95,6 +93,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'news.sqlite3',
+        # транзакции сразу берут блокировку записи (BEGIN IMMEDIATE): иначе
+        # select_for_update в SQLite ничего не блокирует, и две публикации
+        # одновременно проходят проверку лимита (news/quota.py) или падают
+        # с «database is locked». Вторая ждёт до timeout секунд
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
@@ -173,6 +176,59 @@ DEFAULT_FROM_EMAIL = 'vyazovoiartem@yandex.ru'
 
 ACCOUNT_EMAIL_SUBJECT_PREFIX = '[News Portal] '
 
+# Уведомления о новых постах отправляются пачками по столько писем, каждая
+# пачка — через одно SMTP-соединение
+NOTIFICATION_CHUNK_SIZE = 100
+
+# Подписки с режимом «раз в день» получают накопленные уведомления одним
+# письмом в этот час по местному времени
+NOTIFICATION_DAILY_HOUR = 9
+
+# Пул SMTP-соединений процесса воркера (news/smtp_pool.py): не больше
+# SMTP_POOL_SIZE простаивающих соединений, каждое закрывается после
+# SMTP_POOL_IDLE_TIMEOUT секунд без дела
+SMTP_POOL_SIZE = 4
+SMTP_POOL_IDLE_TIMEOUT = 60
+
+# Исходящая очередь уведомлений (news/outbox.py): повтор после ошибки через
+# OUTBOX_RETRY_DELAY * 2^(попытка - 1) секунд, не больше OUTBOX_MAX_ATTEMPTS
+# попыток; захват пачки воркером истекает через OUTBOX_CLAIM_TIMEOUT секунд
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_CLAIM_TIMEOUT = 600
+
+# Блокировка единственного запуска еженедельной рассылки (news/digest.py)
+# истекает через столько секунд без продления, например после падения воркера
+DIGEST_LOCK_TIMEOUT = 600
+
+# Скорость отправки писем всеми воркерами вместе, писем в секунду
+# (news/throttle.py): smtp — лимит провайдера на все письма, digest — доля
+# массовой рассылки, остаток лимита всегда свободен для уведомлений.
+# Счётчики корзин лежат в общем кеше (Redis, см. CACHES), поэтому лимит
+# действует на все процессы вместе, а не на каждый воркер отдельно
+MAIL_RATE_LIMITS = {
+    'smtp': {'rate': 10, 'capacity': 20},
+    'digest': {'rate': 7},
+}
+
+# Словарь фильтра censor (news/censor.py): перечитывается без перезапуска,
+# если файл изменился, проверка — не чаще раза в CENSOR_RELOAD_INTERVAL
+# секунд; CENSOR_CACHE_SIZE — сколько обработанных текстов помнит процесс
+CENSOR_WORDS_FILE = os.path.join(BASE_DIR, 'news', 'censor_words.txt')
+CENSOR_RELOAD_INTERVAL = 5
+CENSOR_CACHE_SIZE = 2048
+
+# Лимит публикаций (news/quota.py): POST_QUOTA_LIMIT постов за скользящие
+# POST_QUOTA_WINDOW секунд. POST_QUOTA_GROUP_LIMITS — лимиты по названию
+# группы пользователя, например {'authors': 5}; Author.post_limit — личный
+POST_QUOTA_LIMIT = 3
+POST_QUOTA_WINDOW = 24 * 60 * 60
+POST_QUOTA_GROUP_LIMITS = {}
+
+# Автодополнение авторов и категорий (news/autocomplete.py): размер
+# страницы JSON-ответа
+AUTOCOMPLETE_PAGE_SIZE = 20
+
 APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"
 APSCHEDULER_RUN_NOW_TIMEOUT = 25
 
@@ -185,22 +241,73 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Moscow'
 CELERY_ENABLE_UTC = False
 
-# Периодические задачи (Beat)
+# Очереди: notifications — уведомления о новых постах, digest — массовая
+# рассылка, celery — остальное. Дайджест не задерживает уведомления, если
+# их разбирают отдельные воркеры:
+#   celery -A project worker -Q notifications
+#   celery -A project worker -Q digest,celery
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = {
+    'news.tasks.deliver_outbox': {'queue': 'notifications'},
+    'news.tasks.send_outbox_chunk': {'queue': 'notifications'},
+    'news.tasks.send_weekly_digest': {'queue': 'digest'},
+}
+
+# Периодические задачи (Beat), единственное место расписания
 CELERY_BEAT_SCHEDULE = {
     'send-weekly-digest': {
         'task': 'news.tasks.send_weekly_digest',
         'schedule': crontab(hour=8, minute=0, day_of_week=1),
     },
+    'flush-rating-buffers': {
+        'task': 'news.tasks.flush_rating_buffers',
+        'schedule': 60.0,
+    },
+    'deliver-outbox': {
+        'task': 'news.tasks.deliver_outbox',
+        'schedule': 60.0,
+    },
 }
 
+# default — LRU в памяти процесса поверх общего кеша shared
+# (news/cache_backends.py). Горячие страницы читаются без обращения к
+# Redis, а истёкшую страницу пересчитывает только один запрос. На shared
+# держатся счётчики, блокировки и лимиты всех процессов (буфер рейтингов,
+# скорость отправки писем), поэтому нужен бэкенд с атомарными add/incr:
+# Redis (тот же сервер, что у Celery, другая база) или Memcached, но не
+# файловый кеш
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': os.path.join(BASE_DIR, 'cache_files'),
+        'BACKEND': 'news.cache_backends.TwoTierCache',
+        'LOCATION': 'default',
         'TIMEOUT': 60*3,
-    }
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 2,
+            'STALE_GRACE': 30,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+        'TIMEOUT': 60*3,
+    },
 }
 
+# Страницы новостей кешируются с версионными ключами (news/page_cache.py)
+# и сбрасываются сигналами при изменениях, поэтому срок жизни может быть большим
+PAGE_CACHE_TIMEOUT = 60*60*6
+
+# Рейтинги: после RATING_HOT_THRESHOLD голосов за RATING_HOT_WINDOW секунд
+# голоса за объект копятся в кеше и сбрасываются задачей flush_rating_buffers
+RATING_HOT_THRESHOLD = 20
+RATING_HOT_WINDOW = 10
+
+# Пагинация лент: 'offset' (номера страниц) или 'cursor' (курсор по дате,
+# без COUNT(*)). Курсорный режим также включается параметром ?cursor=
+POST_LIST_PAGINATION = 'offset'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
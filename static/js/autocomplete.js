@@ -0,0 +1,84 @@
+/*
+ * Автодополнение для <select data-autocomplete-url="...">
+ * (news/autocomplete.py). Сервер выводит только выбранные варианты,
+ * остальные подгружаются по мере ввода страницами JSON вида
+ * {"results": [{"id": 1, "text": "Спорт"}], "more": false}.
+ */
+(function () {
+    'use strict';
+
+    var DELAY = 250;
+
+    function keepOption(option) {
+        // выбранные и пустой вариант («Все категории») остаются в списке
+        return option.selected || option.value === '';
+    }
+
+    function load(select, term, page) {
+        var url = select.dataset.autocompleteUrl;
+        var params = 'q=' + encodeURIComponent(term) + '&page=' + page;
+        url += (url.indexOf('?') === -1 ? '?' : '&') + params;
+        return fetch(url, {headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                var more = select.querySelector('option[data-more]');
+                if (more) {
+                    more.remove();
+                }
+                if (page === 1) {
+                    Array.prototype.slice.call(select.options).forEach(function (option) {
+                        if (!keepOption(option)) {
+                            option.remove();
+                        }
+                    });
+                }
+                var present = {};
+                Array.prototype.forEach.call(select.options, function (option) {
+                    present[option.value] = true;
+                });
+                data.results.forEach(function (item) {
+                    if (!present[String(item.id)]) {
+                        select.add(new Option(item.text, item.id));
+                    }
+                });
+                if (data.more) {
+                    var option = new Option('Ещё…', '');
+                    option.dataset.more = page + 1;
+                    select.add(option);
+                }
+            });
+    }
+
+    function attach(select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control';
+        input.placeholder = 'Начните вводить название';
+        input.style.fontSize = '14px';
+        select.parentNode.insertBefore(input, select);
+
+        var timer = null;
+        var loaded = false;
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () { load(select, input.value, 1); }, DELAY);
+        });
+        select.addEventListener('focus', function () {
+            if (!loaded) {
+                loaded = true;
+                load(select, input.value, 1);
+            }
+        });
+        select.addEventListener('change', function () {
+            var more = select.querySelector('option[data-more]');
+            if (more && more.selected) {
+                more.selected = false;
+                load(select, input.value, Number(more.dataset.more));
+            }
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(attach);
+    });
+})();